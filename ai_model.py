@@ -1,85 +1,176 @@
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
-import joblib
 from sklearn.linear_model import LogisticRegression
 import numpy as np
 import pandas as pd
+from utils.model_store import SharedModelStore
+from utils.feature_store import BEHAVIOR_FEATURES, behavior_features
+from utils.rolling_adherence import rolling_adherence
+from utils.http_clients import gemini_calls, GEMINI_TIMEOUT_SECONDS
 
 # Load environment variables
 load_dotenv()
 
 # Configure Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Features the risk model is trained on, in column order
+FEATURE_NAMES = ["adherence_percent", "missed_doses", "adherence_7d", "adherence_30d"] + BEHAVIOR_FEATURES
+
+RISK_MODEL_PATH = os.getenv("RISK_MODEL_PATH", "risk_model.pkl")
+
+_feedback_model = None
+
+def feedback_model():
+    """
+    The Gemini model used for feedback, created once and reused across calls.
+    """
+    global _feedback_model
+    if _feedback_model is None:
+        _feedback_model = genai.GenerativeModel(GEMINI_MODEL)
+    return _feedback_model
+
 def generate_ai_feedback(adherence_percent, risk_label):
     """
     Generate motivational feedback using Gemini API based on adherence and risk.
     """
     try:
-        model = genai.GenerativeModel('gemini-pro')
         prompt = f"You are a health coach. Patient adherence = {adherence_percent}%, risk = {risk_label}. Write one motivational message."
-        response = model.generate_content(prompt)
+        # Bounded concurrency over the shared channel; a saturated pool falls back like a failed call
+        with gemini_calls.slot():
+            response = feedback_model().generate_content(prompt, request_options={"timeout": GEMINI_TIMEOUT_SECONDS})
         return response.text.strip()
-    except Exception as e:
+    except Exception:
         # Return a default message if API fails
         return "Keep up the good work! Consistency is key to your health journey."
 
-def create_and_save_risk_model():
+def label_risk(X):
     """
-    Create a simple logistic regression model for risk prediction and save it.
+    Rule-based risk labels for feature rows (simplified logic, a bad recent week,
+    a long silence or one badly neglected medication raises the risk).
+    """
+    columns = {name: X[:, i] for i, name in enumerate(FEATURE_NAMES)}
+    a, m = columns["adherence_percent"], columns["missed_doses"]
+    a7, a30 = columns["adherence_7d"], columns["adherence_30d"]
+    silent = columns["days_since_last_log"] > 7
+    low = (a >= 80) & (m <= 1) & (a7 >= 70) & (a30 >= 75) & (columns["min_medication_adherence"] >= 60) & ~silent
+    medium = (a >= 60) & (m <= 3) & (a7 >= 50) & ~silent
+    return np.where(low, "Low", np.where(medium, "Medium", "High"))
+
+def synthetic_features(n_samples, seed=42):
+    """
+    Generate a synthetic feature matrix in FEATURE_NAMES order.
+    """
+    rng = np.random.RandomState(seed)
+    adherence = rng.uniform(0, 100, n_samples)
+    missed_doses = rng.poisson(2, n_samples)
+    # Recent windows drift around the all-time adherence
+    adherence_30d = np.clip(adherence + rng.normal(0, 15, n_samples), 0, 100)
+    adherence_7d = np.clip(adherence_30d + rng.normal(0, 20, n_samples), 0, 100)
+    # Behavior tracks adherence: adherent patients keep streaks and log regularly
+    current_streak = rng.poisson(adherence_7d / 15)
+    longest_streak = current_streak + rng.poisson(adherence / 10)
+    days_since_last_log = rng.poisson(0.5 + (100 - adherence_7d) / 20)
+    daily_adherence_std = np.clip(rng.normal(40 - adherence / 4, 8), 0, 50)
+    weekday_spread = np.clip(rng.normal(60 - adherence / 2, 15), 0, 100)
+    min_medication_adherence = np.clip(adherence - np.abs(rng.normal(0, 15, n_samples)), 0, 100)
+    medication_count = rng.randint(1, 5, n_samples)
+    return np.column_stack((
+        adherence, missed_doses, adherence_7d, adherence_30d,
+        current_streak, longest_streak, days_since_last_log, daily_adherence_std,
+        weekday_spread, min_medication_adherence, medication_count
+    ))
+
+def train_risk_model(feature_matrix=None):
+    """
+    Train a simple logistic regression model for risk prediction.
+
+    Args:
+        feature_matrix: Optional real feature rows (e.g. from build_feature_matrix),
+            labeled with the same rules and added to the synthetic data
     """
     # Generate synthetic training data
-    np.random.seed(42)
-    n_samples = 1000
-    
-    # Generate synthetic data
-    adherence = np.random.uniform(0, 100, n_samples)
-    missed_doses = np.random.poisson(2, n_samples)
-    
-    # Create risk labels (simplified logic)
-    risk = []
-    for a, m in zip(adherence, missed_doses):
-        if a >= 80 and m <= 1:
-            risk.append("Low")
-        elif a >= 60 and m <= 3:
-            risk.append("Medium")
-        else:
-            risk.append("High")
-    
-    # Prepare features
-    X = np.column_stack((adherence, missed_doses))
-    y = np.array(risk)
+    X = synthetic_features(1000)
+    if feature_matrix is not None and len(feature_matrix):
+        X = np.vstack((X, feature_matrix))
+    y = label_risk(X)
     
     # Train model
-    model = LogisticRegression()
+    model = LogisticRegression(max_iter=1000)
     model.fit(X, y)
-    
-    # Save model
-    joblib.dump(model, 'risk_model.pkl')
     return model
 
-def predict_risk(adherence_percent, missed_doses):
+def is_current_risk_model(model):
+    """
+    Models saved before the current feature set (FEATURE_NAMES) must be retrained.
+    """
+    return getattr(model, "n_features_in_", len(FEATURE_NAMES)) == len(FEATURE_NAMES)
+
+# Shared by all uvicorn workers: built once under a file lock, loaded memory mapped
+risk_model_store = SharedModelStore(RISK_MODEL_PATH, build=train_risk_model, is_current=is_current_risk_model)
+
+def create_and_save_risk_model(feature_matrix=None):
+    """
+    Create a simple logistic regression model for risk prediction and save it.
+    """
+    return risk_model_store.rebuild(lambda: train_risk_model(feature_matrix))
+
+def build_features(adherence_percent, missed_doses, adherence_7d=None, adherence_30d=None, behavior=None):
+    """
+    Build a model feature row. Missing rolling windows fall back to the all-time adherence,
+    missing behavioral features (patient not in the feature store) to neutral values.
+    """
+    if adherence_7d is None:
+        adherence_7d = adherence_percent
+    if adherence_30d is None:
+        adherence_30d = adherence_percent
+    if behavior is None:
+        behavior = {"min_medication_adherence": adherence_percent, "medication_count": 1}
+    return [adherence_percent, missed_doses, adherence_7d, adherence_30d] + [
+        behavior.get(name, 0) for name in BEHAVIOR_FEATURES
+    ]
+
+def build_feature_matrix(patient_ids, adherence, missed_doses, today=None,
+                         rolling_tracker=rolling_adherence, feature_store=behavior_features):
+    """
+    Dense feature matrix for a cohort, for training and batch inference.
+
+    Behavioral features come from the feature store and rolling windows from the
+    rolling adherence tracker, so no raw logs are read.
+
+    Args:
+        adherence, missed_doses: Per-patient all-time values, in patient_ids order
+        today: Day ordinal the features are computed for, default today
+        rolling_tracker, feature_store: Alternatives to the shared instances,
+            e.g. replayed from historical logs for evaluation
+    """
+    windows = [rolling_tracker.windows(patient_id, today) for patient_id in patient_ids]
+    adherence = np.asarray(adherence, dtype=np.float64)
+    recent = np.array([[w["7d"], w["30d"]] for w in windows], dtype=np.float64).reshape(-1, 2)
+    recent = np.where(np.isnan(recent), adherence[:, None], recent)
+    return np.column_stack((
+        adherence, np.asarray(missed_doses, dtype=np.float64), recent,
+        feature_store.matrix(patient_ids, today)
+    ))
+
+def predict_risk(adherence_percent, missed_doses, adherence_7d=None, adherence_30d=None, behavior=None):
     """
     Predict risk label using the trained model.
+
+    Args:
+        behavior: Behavioral features, as returned by behavior_features.features()
     """
+    X = np.array([build_features(adherence_percent, missed_doses, adherence_7d, adherence_30d, behavior)])
     try:
-        # Load the model
-        model = joblib.load('risk_model.pkl')
-        
-        # Prepare features
-        X = np.array([[adherence_percent, missed_doses]])
+        # Loaded once per worker; built under the file lock if missing or outdated
+        model = risk_model_store.get()
         
         # Predict
         risk_label = model.predict(X)[0]
         return risk_label
-    except FileNotFoundError:
-        # If model doesn't exist, create it
-        model = create_and_save_risk_model()
-        X = np.array([[adherence_percent, missed_doses]])
-        risk_label = model.predict(X)[0]
-        return risk_label
     except Exception:
         # Default prediction if something goes wrong
         if adherence_percent >= 80:
@@ -87,4 +178,16 @@ def predict_risk(adherence_percent, missed_doses):
         elif adherence_percent >= 60:
             return "Medium"
         else:
-            return "High"
\ No newline at end of file
+            return "High"
+
+def warm_up_risk_model():
+    """
+    Load the risk model and run a trial prediction, so the first request pays for neither.
+    """
+    predict_risk_batch(np.array([build_features(85, 1, 80, 85)]))
+
+def predict_risk_batch(feature_matrix):
+    """
+    Predict risk labels for every row of a feature matrix (see build_feature_matrix).
+    """
+    return risk_model_store.get().predict(feature_matrix)
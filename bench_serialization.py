@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark JSON serialization and compression of large list responses.
+
+Compares FastAPI's default path (jsonable_encoder + JSONResponse) against
+FastJSONResponse for a synthetic /api/patient/all payload, and reports the
+bytes on the wire with gzip and brotli.
+"""
+
+import argparse
+import gzip
+import random
+import time
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from utils.response import success_response, dumps_json, orjson
+from utils.compression import brotli, GZIP_LEVEL, BROTLI_QUALITY
+
+CONDITIONS = ["Diabetes", "Hypertension", "Asthma", "Arthritis", "Depression", "COPD"]
+RISK_LABELS = ["Low", "Medium", "High"]
+
+def make_patients(count):
+    """Build a patient list shaped like the /api/patient/all response"""
+    random.seed(42)
+    patients = []
+    for i in range(count):
+        adherence = random.uniform(0, 100)
+        patients.append({
+            "id": str(uuid.UUID(int=random.getrandbits(128))),
+            "name": f"Patient {i}",
+            "age": random.randint(18, 95),
+            "gender": random.choice(["Male", "Female"]),
+            "condition": random.choice(CONDITIONS),
+            "adherence_percent": adherence,
+            "rolling_adherence": {"7d": adherence, "30d": adherence, "90d": None},
+            "risk_label": random.choice(RISK_LABELS)
+        })
+    return patients
+
+def time_it(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = success_response(data={"patients": make_patients(args.patients)}, message="Patients retrieved successfully")
+
+    print(f"📊 Serializing {args.patients} patients (best of {args.repeat})")
+    print(f"   orjson: {'yes' if orjson else 'no (stdlib json fallback)'}, brotli: {'yes' if brotli else 'no'}")
+    print("=" * 60)
+
+    default_seconds, default_body = time_it(lambda: JSONResponse(jsonable_encoder(payload)).body, args.repeat)
+    fast_seconds, fast_body = time_it(lambda: dumps_json(payload), args.repeat)
+    print(f"FastAPI default (jsonable_encoder): {default_seconds * 1000:8.1f} ms  {len(default_body):>10,} bytes")
+    print(f"FastJSONResponse:                   {fast_seconds * 1000:8.1f} ms  {len(fast_body):>10,} bytes")
+    print(f"Speedup: {default_seconds / fast_seconds:.1f}x")
+    print()
+
+    gzip_seconds, gzip_body = time_it(lambda: gzip.compress(fast_body, compresslevel=GZIP_LEVEL), args.repeat)
+    print(f"gzip (level {GZIP_LEVEL}):   {gzip_seconds * 1000:8.1f} ms  {len(gzip_body):>10,} bytes  ({len(gzip_body) / len(fast_body):.1%})")
+    if brotli:
+        br_seconds, br_body = time_it(lambda: brotli.compress(fast_body, quality=BROTLI_QUALITY), args.repeat)
+        print(f"brotli (quality {BROTLI_QUALITY}): {br_seconds * 1000:8.1f} ms  {len(br_body):>10,} bytes  ({len(br_body) / len(fast_body):.1%})")
+
+if __name__ == "__main__":
+    main()
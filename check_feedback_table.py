@@ -1,5 +1,5 @@
 import os
-from supabase import create_client
+from utils.http_clients import create_supabase_client
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -9,7 +9,7 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+supabase = create_supabase_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
 def check_feedback_table():
     """Check the structure of the ai_feedback table"""
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Compact old dose logs into monthly rollups.
+
+Dose logs dated before the retention horizon (whole months) are folded into
+per-patient, per-medication monthly rows of dose_log_rollups, archived to
+gzipped JSON Lines files and deleted. The server combines rollups with the
+remaining raw logs, so a patient's history costs the same to load however
+long they have been followed.
+
+Patients are processed in pages. A journal first records each page's raw
+rows and rollups; the rows are then archived, the rollups stored and the
+rows deleted. A run interrupted after the journal was written finishes that
+page from it before going on, so no dose is counted twice or lost. Run one
+compaction at a time.
+
+Usage:
+    python compact_dose_logs.py                          # keep DOSE_LOG_RETENTION_DAYS (365) of raw logs
+    python compact_dose_logs.py --retention-days 180 --archive-dir /backups/dose_logs
+    python compact_dose_logs.py --dry-run                # report what would be compacted
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import date
+
+from utils.cohort_report import REPORT_PAGE_SIZE, fetch_patient_page
+from utils.dose_rollups import (
+    DOSE_LOG_RETENTION_DAYS, MIN_RETENTION_DAYS, ROLLUPS_TABLE, build_rollups, compaction_cutoff, fetch_rollups
+)
+
+LOGS_PAGE_SIZE = 1000
+DELETE_CHUNK_SIZE = 200
+DOSE_LOG_ARCHIVE_DIR = os.getenv("DOSE_LOG_ARCHIVE_DIR", "dose_log_archive")
+
+def fetch_old_logs(supabase, patient_ids, cutoff):
+    """
+    All dose logs of a page of patients dated before the cutoff day.
+    """
+    logs, offset = [], 0
+    while True:
+        page = supabase.table("dose_logs").select("*").in_("patient_id", patient_ids).lt(
+            "date", date.fromordinal(cutoff).isoformat()
+        ).order("id").range(offset, offset + LOGS_PAGE_SIZE - 1).execute().data or []
+        logs.extend(page)
+        if len(page) < LOGS_PAGE_SIZE:
+            return logs
+        offset += LOGS_PAGE_SIZE
+
+def write_atomically(path, write):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def write_archive(path, logs):
+    def write(f):
+        with gzip.GzipFile(fileobj=f, mode="wb") as archive:
+            for log in logs:
+                archive.write(json.dumps(log, default=str).encode() + b"\n")
+    write_atomically(path, write)
+
+def apply_batch(supabase, batch):
+    """
+    Archive a page's raw rows, store its rollups, then delete the rows. Every step is safe to repeat.
+    """
+    write_archive(batch["archive"], batch["logs"])
+    if batch["rollups"]:
+        supabase.table(ROLLUPS_TABLE).upsert(batch["rollups"], on_conflict="patient_id,medication,month").execute()
+    ids = [log["id"] for log in batch["logs"]]
+    for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+        supabase.table("dose_logs").delete().in_("id", ids[start:start + DELETE_CHUNK_SIZE]).execute()
+
+def resume_pending(supabase, journal_path):
+    try:
+        with open(journal_path) as f:
+            batch = json.load(f)
+    except FileNotFoundError:
+        return
+    print(f"↩️  Finishing interrupted batch ({len(batch['logs'])} logs, archived in {batch['archive']})")
+    apply_batch(supabase, batch)
+    os.remove(journal_path)
+
+def run(supabase, cutoff, archive_dir, page_size=REPORT_PAGE_SIZE, dry_run=False):
+    """
+    Returns:
+        dict: Patients, logs compacted, rollups written and archive files
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    journal_path = os.path.join(archive_dir, "compaction.pending.json")
+    if not dry_run:
+        resume_pending(supabase, journal_path)
+
+    cutoff_label = date.fromordinal(cutoff).isoformat()
+    totals = {"patients": 0, "logs": 0, "rollups": 0, "archives": []}
+    started, after = time.perf_counter(), None
+    # Archives of every run are kept apart, also when a later run compacts late logs of the same months
+    run_label = time.strftime("%Y%m%dT%H%M%S")
+    print(f"🗜️  Compacting dose logs before {cutoff_label}{' (dry run)' if dry_run else ''}")
+    while True:
+        patients = fetch_patient_page(supabase, after, page_size)
+        if not patients:
+            break
+        after = patients[-1]["id"]
+        patient_ids = [patient["id"] for patient in patients]
+        totals["patients"] += len(patients)
+
+        logs = fetch_old_logs(supabase, patient_ids, cutoff)
+        if logs:
+            # Doses logged late for months compacted earlier are merged into their rollups
+            existing = fetch_rollups(supabase, patient_ids, end=cutoff - 1)
+            touched = {(rollup["patient_id"], rollup["medication"], rollup["month"]) for rollup in build_rollups(logs)}
+            rollups = [
+                rollup for rollup in build_rollups(logs, [rollup for rollups in existing.values() for rollup in rollups])
+                if (rollup["patient_id"], rollup["medication"], rollup["month"]) in touched
+            ]
+            archive_path = os.path.join(archive_dir, f"dose_logs-{run_label}-{patient_ids[0]}.jsonl.gz")
+            totals["logs"] += len(logs)
+            totals["rollups"] += len(rollups)
+            totals["archives"].append(archive_path)
+            if not dry_run:
+                batch = {"archive": archive_path, "logs": logs, "rollups": rollups}
+                write_atomically(journal_path, lambda f: f.write(json.dumps(batch, default=str).encode()))
+                apply_batch(supabase, batch)
+                os.remove(journal_path)
+        print(f"\r   {totals['patients']} patients, {totals['logs']} logs into {totals['rollups']} rollups   ",
+              end="", flush=True)
+        if len(patients) < page_size:
+            break
+
+    print(f"\n✅ {totals['logs']} dose logs of {totals['patients']} patients compacted into {totals['rollups']} "
+          f"monthly rollups, {len(totals['archives'])} archive files ({time.perf_counter() - started:.1f}s)")
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll old dose logs up into monthly aggregates and archive them")
+    parser.add_argument("--retention-days", type=int, default=DOSE_LOG_RETENTION_DAYS,
+                        help="Days of raw logs to keep (whole months before are compacted)")
+    parser.add_argument("--archive-dir", default=DOSE_LOG_ARCHIVE_DIR, help="Directory of the gzipped raw logs")
+    parser.add_argument("--page-size", type=int, default=REPORT_PAGE_SIZE, help="Patients per page")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be compacted without changing anything")
+    args = parser.parse_args()
+
+    if args.retention_days < MIN_RETENTION_DAYS:
+        sys.exit(f"❌ --retention-days must be at least {MIN_RETENTION_DAYS}: rolling windows, forecasts and "
+                 "model evaluation read raw logs of the last months")
+
+    from database import supabase
+    run(supabase, compaction_cutoff(retention_days=args.retention_days), args.archive_dir, args.page_size, args.dry_run)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Shared offline test doubles: an in-memory Supabase client and its pytest fixture.
+
+Routers import the Supabase client from database at import time, so a stand-in
+module is installed before any test module imports them; tests point the
+routers' `supabase` attribute at a FakeSupabase.
+"""
+
+import json
+import operator
+import re
+import sys
+import threading
+import time
+import types
+import uuid
+
+import pytest
+
+sys.modules.setdefault("database", types.ModuleType("database")).supabase = None
+
+COMPARISONS = {
+    "eq": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "in": lambda value, values: value in values,
+    # % and _ wildcards, case-insensitive
+    "ilike": lambda value, pattern: re.fullmatch(
+        re.escape(pattern).replace("%", ".*").replace("_", "."), value or "", re.IGNORECASE
+    ) is not None,
+}
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """
+    One PostgREST statement built with the supabase-py query builder, run by execute().
+
+    Filters are kept as (column, op, value) so tests can inspect the statements sent.
+    """
+
+    def __init__(self, supabase, table):
+        self.supabase, self.table = supabase, table
+        self.action, self.payload, self.on_conflict, self.count = "select", None, None, None
+        self.ignore_duplicates = False
+        self.columns = "*"
+        self.filters, self.orders, self.window = [], [], None
+
+    def select(self, columns="*", count=None):
+        self.columns, self.count = columns, count
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, values):
+        self.action, self.payload = "update", values
+        return self
+
+    def upsert(self, rows, on_conflict, ignore_duplicates=False):
+        self.action, self.payload, self.on_conflict = "upsert", rows, on_conflict.split(",")
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def _filter(self, column, op, value):
+        self.filters.append((column, op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def in_(self, column, values):
+        return self._filter(column, "in", set(values))
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, "ilike", pattern)
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self.window = (0, n)
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end + 1)
+        return self
+
+    def matches(self, row):
+        return all(COMPARISONS[op](row.get(column), value) for column, op, value in self.filters)
+
+    def execute(self):
+        return self.supabase.execute(self)
+
+
+class FakeSupabase:
+    """
+    In-memory Supabase client over `tables` ({table: [row]}).
+
+    Every statement appends its table to `requests` and itself to `queries`.
+    Rows are copied in and out, like over the wire. Inserted rows get ids that
+    sort in insertion order.
+
+    Args:
+        latency: Seconds every statement takes, so concurrent requests interleave
+        max_rows: Rows returned per statement at most, like PostgREST's row cap
+    """
+
+    def __init__(self, tables=None, latency=0, max_rows=None):
+        self.tables = tables if tables is not None else {}
+        self.latency, self.max_rows = latency, max_rows
+        self.requests, self.queries = [], []
+        self.mutex = threading.Lock()
+        self._ids = 0
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def execute(self, query):
+        """
+        Run a statement. Subclasses override this to fail or count statements.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self.mutex:
+            self.requests.append(query.table)
+            self.queries.append(query)
+            return self._run(query)
+
+    def _run(self, query):
+        rows = self.tables.setdefault(query.table, [])
+        if query.action == "insert":
+            created = []
+            for row in query.payload:
+                self._ids += 1
+                created.append({"id": str(uuid.UUID(int=self._ids)), **row})
+            rows.extend(created)
+            return FakeResponse([dict(row) for row in created])
+        if query.action == "upsert":
+            written = []
+            for new in query.payload:
+                kept = [row for row in rows if any(row.get(key) != new[key] for key in query.on_conflict)]
+                # ON CONFLICT DO NOTHING leaves the existing row
+                if query.ignore_duplicates and len(kept) < len(rows):
+                    continue
+                rows[:] = kept
+                rows.append(json.loads(json.dumps(new)))
+                written.append(new)
+            return FakeResponse(written)
+
+        matched = [row for row in rows if query.matches(row)]
+        if query.action == "update":
+            for row in matched:
+                row.update(query.payload)
+        elif query.action == "delete":
+            deleted = {id(row) for row in matched}
+            rows[:] = [row for row in rows if id(row) not in deleted]
+        for column, desc in reversed(query.orders):
+            # Rows without the column (fixtures often leave out ids) sort first
+            matched.sort(key=lambda row: (row.get(column) is not None, row.get(column)), reverse=desc)
+
+        count = len(matched) if query.count else None
+        if query.window:
+            matched = matched[slice(*query.window)]
+        if self.max_rows is not None:
+            matched = matched[:self.max_rows]
+        return FakeResponse([dict(row) for row in matched], count)
+
+
+@pytest.fixture
+def fake_supabase():
+    """An empty FakeSupabase; fill its `tables` in the test."""
+    return FakeSupabase()
@@ -1,12 +1,13 @@
 import os
-from supabase import create_client, Client
+from supabase import Client
 from dotenv import load_dotenv
+from utils.http_clients import create_supabase_client
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase client
+# Initialize Supabase client (requests share the pooled keep-alive HTTP client)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
\ No newline at end of file
+supabase: Client = create_supabase_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
\ No newline at end of file
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Evaluate risk models on replayed dose histories and benchmark their inference.
+
+Each patient's history is split at a cutoff day: the logs before it are replayed
+through the rolling adherence tracker and the behavioral feature store to build
+the features, and the adherence over the following HORIZON days gives the true
+risk class (>= 80% Low, >= 60% Medium, else High). Reports accuracy, per-class
+precision/recall and calibration, single-row and batched inference throughput
+and memory footprint, for one or more model artifacts side by side.
+
+Usage:
+    python evaluate_risk_model.py                               # synthetic histories, current model
+    python evaluate_risk_model.py --model risk_model.pkl --model candidate.pkl
+    python evaluate_risk_model.py --source stored --json report.json
+"""
+
+import argparse
+import json
+import os
+import pickle
+import time
+import tracemalloc
+from datetime import date
+
+import joblib
+import numpy as np
+
+from ai_model import RISK_MODEL_PATH, FEATURE_NAMES, build_feature_matrix, train_risk_model
+from utils.adherence import calculate_adherence, count_missed_doses
+from utils.feature_store import BehaviorFeatureStore
+from utils.model_store import process_memory
+from utils.rolling_adherence import RollingAdherenceTracker, log_date_ordinal
+
+RISK_CLASSES = ["Low", "Medium", "High"]
+HISTORY_DAYS = 90
+HORIZON_DAYS = 14
+CALIBRATION_BINS = 10
+
+def risk_class(adherence_percent):
+    if adherence_percent >= 80:
+        return "Low"
+    if adherence_percent >= 60:
+        return "Medium"
+    return "High"
+
+# Synthetic patient behaviors: daily probability of taking a dose, as a function of the day
+ARCHETYPES = {
+    "steady": lambda rng, day: rng.uniform(0.85, 0.98),
+    "declining": lambda rng, day: max(0.1, 0.95 - 0.008 * day),
+    "improving": lambda rng, day: min(0.97, 0.4 + 0.007 * day),
+    "weekend_gap": lambda rng, day: 0.3 if day % 7 in (5, 6) else 0.9,
+    "erratic": lambda rng, day: rng.uniform(0.2, 0.9),
+    "dropout": lambda rng, day: 0.85 if day < 70 else 0.15,
+}
+
+def synthetic_histories(patients, today, seed=42):
+    """
+    Generate dose histories over HISTORY_DAYS plus HORIZON_DAYS ending today.
+
+    Returns:
+        dict: patient_id -> list of dose logs
+    """
+    rng = np.random.default_rng(seed)
+    names = list(ARCHETYPES)
+    start = today - HISTORY_DAYS - HORIZON_DAYS + 1
+    histories = {}
+    for n in range(patients):
+        archetype = ARCHETYPES[names[n % len(names)]]
+        medications = [f"Medication {m}" for m in range(rng.integers(1, 4))]
+        # Patients who stop taking doses often stop logging too
+        logs = []
+        for day in range(HISTORY_DAYS + HORIZON_DAYS):
+            p_taken = archetype(rng, day)
+            if rng.random() > 0.5 + p_taken / 2:
+                continue
+            for medication in medications:
+                logs.append({
+                    "patient_id": f"patient-{n}",
+                    "medication": medication,
+                    "status": "Taken" if rng.random() < p_taken else "Missed",
+                    "date": date.fromordinal(start + day).isoformat()
+                })
+        histories[f"patient-{n}"] = logs
+    return histories
+
+def stored_histories(today):
+    """
+    Fetch dose logs of the last HISTORY_DAYS + HORIZON_DAYS days from Supabase.
+    """
+    from database import supabase
+    from forecast_adherence import fetch_all
+
+    since = date.fromordinal(today - HISTORY_DAYS - HORIZON_DAYS + 1).isoformat()
+    histories = {}
+    for log in fetch_all(lambda: supabase.table("dose_logs").select("patient_id, medication, status, date").gte("date", since).order("id")):
+        histories.setdefault(log["patient_id"], []).append(log)
+    return histories
+
+def build_dataset(histories, cutoff):
+    """
+    Replay logs before the cutoff into fresh feature stores and label by the logs after it.
+
+    Returns:
+        tuple: (feature matrix, true labels), patients without logs on both sides are skipped
+    """
+    rolling, behavior = RollingAdherenceTracker(), BehaviorFeatureStore()
+    patient_ids, adherence, missed, labels = [], [], [], []
+    for patient_id, logs in histories.items():
+        past = [log for log in logs if log_date_ordinal(log) < cutoff]
+        future = [log for log in logs if log_date_ordinal(log) >= cutoff]
+        if not past or not future:
+            continue
+        rolling.load(patient_id, past)
+        behavior.load(patient_id, past)
+        patient_ids.append(patient_id)
+        adherence.append(calculate_adherence(past))
+        missed.append(count_missed_doses(past))
+        labels.append(risk_class(calculate_adherence(future)))
+    # Features as they were on the last day before the cutoff
+    X = build_feature_matrix(patient_ids, adherence, missed, cutoff - 1, rolling_tracker=rolling, feature_store=behavior)
+    return X, np.array(labels)
+
+def calibration(probabilities, y, classes):
+    """
+    Per-class reliability: predicted probability vs observed frequency per bin,
+    expected calibration error and Brier score.
+    """
+    report = {}
+    edges = np.linspace(0, 1, CALIBRATION_BINS + 1)
+    for column, label in enumerate(classes):
+        predicted = probabilities[:, column]
+        observed = (y == label).astype(np.float64)
+        bins = np.clip(np.digitize(predicted, edges) - 1, 0, CALIBRATION_BINS - 1)
+        table, ece = [], 0.0
+        for b in range(CALIBRATION_BINS):
+            in_bin = bins == b
+            if not in_bin.any():
+                continue
+            mean_predicted, frequency = predicted[in_bin].mean(), observed[in_bin].mean()
+            ece += in_bin.mean() * abs(mean_predicted - frequency)
+            table.append({"bin": f"{edges[b]:.1f}-{edges[b + 1]:.1f}", "count": int(in_bin.sum()),
+                          "predicted": round(float(mean_predicted), 3), "observed": round(float(frequency), 3)})
+        report[label] = {
+            "ece": round(float(ece), 4),
+            "brier": round(float(np.mean((predicted - observed) ** 2)), 4),
+            "bins": table
+        }
+    return report
+
+def evaluate_quality(model, X, y):
+    predicted = model.predict(X)
+    classes = [str(label) for label in model.classes_]
+    per_class = {}
+    for label in RISK_CLASSES:
+        true_positive = int(((predicted == label) & (y == label)).sum())
+        predicted_count, support = int((predicted == label).sum()), int((y == label).sum())
+        per_class[label] = {
+            "support": support,
+            "precision": round(true_positive / predicted_count, 3) if predicted_count else None,
+            "recall": round(true_positive / support, 3) if support else None
+        }
+    confusion = {actual: {pred: int(((y == actual) & (predicted == pred)).sum()) for pred in RISK_CLASSES} for actual in RISK_CLASSES}
+    return {
+        "samples": int(len(y)),
+        "accuracy": round(float((predicted == y).mean()), 4),
+        "per_class": per_class,
+        "confusion": confusion,
+        "calibration": calibration(model.predict_proba(X), y, classes)
+    }
+
+def benchmark_inference(model, X, single_rows=1000, batch_sizes=(1000, 10000, 100000)):
+    rows = X[:single_rows]
+    latencies = []
+    for i in range(len(rows)):
+        started = time.perf_counter()
+        model.predict(rows[i:i + 1])
+        latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies) * 1000
+
+    batched = {}
+    for size in batch_sizes:
+        batch = X[np.arange(size) % len(X)]
+        started = time.perf_counter()
+        model.predict(batch)
+        batched[size] = round(size / (time.perf_counter() - started))
+    return {
+        "single_row_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "single_row_p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "single_row_per_second": round(1000 / float(latencies.mean())),
+        "batched_rows_per_second": batched
+    }
+
+def memory_footprint(model, path, X):
+    arrays = sum(value.nbytes for value in vars(model).values() if isinstance(value, np.ndarray))
+    tracemalloc.start()
+    model.predict(X)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "artifact_bytes": os.path.getsize(path) if path and os.path.exists(path) else None,
+        "pickled_bytes": len(pickle.dumps(model)),
+        "array_bytes": arrays,
+        "batch_inference_peak_bytes": peak,
+        "batch_rows": len(X),
+        "process_rss_bytes": process_memory()["rss_bytes"]
+    }
+
+def load_model(path):
+    if os.path.exists(path):
+        return joblib.load(path, mmap_mode="r")
+    print(f"⚠️  {path} not found, evaluating a freshly trained model")
+    return train_risk_model()
+
+def print_report(name, report):
+    quality, speed, memory = report["quality"], report["inference"], report["memory"]
+    print(f"\n📦 {name}")
+    print(f"   Accuracy: {quality['accuracy']:.1%} on {quality['samples']} patients")
+    for label in RISK_CLASSES:
+        stats, calib = quality["per_class"][label], quality["calibration"].get(label)
+        calib_text = f"ECE {calib['ece']:.3f}  Brier {calib['brier']:.3f}" if calib else "not predicted"
+        print(f"   {label:<7} support {stats['support']:>5}  precision {stats['precision']}  recall {stats['recall']}  {calib_text}")
+    print(f"   Single row: p50 {speed['single_row_p50_ms']} ms, p99 {speed['single_row_p99_ms']} ms ({speed['single_row_per_second']:,}/s)")
+    print("   Batched:    " + ", ".join(f"{size:,} rows {rate:,}/s" for size, rate in speed["batched_rows_per_second"].items()))
+    print(f"   Memory:     artifact {memory['artifact_bytes']} B, arrays {memory['array_bytes']} B, "
+          f"peak {memory['batch_inference_peak_bytes'] / 1e6:.1f} MB for {memory['batch_rows']:,} rows")
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate risk models on replayed dose histories")
+    parser.add_argument("--source", choices=["synthetic", "stored"], default="synthetic")
+    parser.add_argument("--patients", type=int, default=3000, help="Synthetic patients")
+    parser.add_argument("--model", action="append", help="Model artifact(s) to compare (default RISK_MODEL_PATH)")
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args()
+
+    today = date.today().toordinal()
+    histories = synthetic_histories(args.patients, today) if args.source == "synthetic" else stored_histories(today)
+    X, y = build_dataset(histories, today - HORIZON_DAYS + 1)
+    if not len(y):
+        print("❌ No patients with dose logs both before and after the cutoff")
+        return
+    print(f"📊 {len(y)} patients from {args.source} histories, labels: "
+          + ", ".join(f"{label} {int((y == label).sum())}" for label in RISK_CLASSES))
+
+    reports = {}
+    for path in args.model or [RISK_MODEL_PATH]:
+        model = load_model(path)
+        if getattr(model, "n_features_in_", len(FEATURE_NAMES)) != len(FEATURE_NAMES):
+            print(f"\n⏭️  {path}: trained on {model.n_features_in_} features, current feature set has {len(FEATURE_NAMES)}")
+            continue
+        reports[path] = {
+            "quality": evaluate_quality(model, X, y),
+            "inference": benchmark_inference(model, X),
+            "memory": memory_footprint(model, path, X[np.arange(100000) % len(X)])
+        }
+        print_report(path, reports[path])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+
+if __name__ == "__main__":
+    main()
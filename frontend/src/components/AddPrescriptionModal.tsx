@@ -38,6 +38,7 @@ export const AddPrescriptionModal = ({ open, onOpenChange }: AddPrescriptionModa
   const [patients, setPatients] = useState<Patient[]>([]);
   const [loading, setLoading] = useState(false);
   const [patient, setPatient] = useState("");
+  const [patientQuery, setPatientQuery] = useState("");
   const [medication, setMedication] = useState("");
   const [dosage, setDosage] = useState("");
   const [frequency, setFrequency] = useState("");
@@ -62,11 +63,20 @@ export const AddPrescriptionModal = ({ open, onOpenChange }: AddPrescriptionModa
     }
   }, [open]);
 
-  const fetchPatients = async () => {
+  // Search patients on the server as the query changes
+  useEffect(() => {
+    if (!open) return;
+    const timeout = setTimeout(() => fetchPatients(patientQuery), 200);
+    return () => clearTimeout(timeout);
+  }, [patientQuery]);
+
+  const fetchPatients = async (query = "") => {
     try {
       setLoading(true);
-      // Fetch patients from the backend
-      const response = await fetch("http://localhost:8000/api/patient/all");
+      // Search patients on the backend
+      const response = await fetch(
+        `http://localhost:8000/api/patient/search?q=${encodeURIComponent(query)}&limit=50`
+      );
       const data = await response.json();
       
       if (data.success) {
@@ -140,6 +150,7 @@ export const AddPrescriptionModal = ({ open, onOpenChange }: AddPrescriptionModa
 
   const resetForm = () => {
     setPatient("");
+    setPatientQuery("");
     setMedication("");
     setDosage("");
     setFrequency("");
@@ -170,6 +181,12 @@ export const AddPrescriptionModal = ({ open, onOpenChange }: AddPrescriptionModa
         <div className="space-y-4 py-4">
           <div className="space-y-2">
             <Label htmlFor="patient">Select Patient *</Label>
+            <Input
+              id="patient-search"
+              placeholder="Search by name or condition"
+              value={patientQuery}
+              onChange={(e) => setPatientQuery(e.target.value)}
+            />
             <Select value={patient} onValueChange={setPatient} disabled={loading}>
               <SelectTrigger>
                 <SelectValue placeholder="Select a patient" />
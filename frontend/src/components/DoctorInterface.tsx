@@ -18,6 +18,16 @@ interface Patient {
   risk_label?: string;
 }
 
+interface CohortStats {
+  total_patients: number;
+  average_adherence: number;
+  risk_distribution: Record<string, number>;
+  needs_attention: { count: number };
+}
+
+// Live events refetch the cohort statistics at most this often
+const STATS_REFRESH_INTERVAL_MS = 5000;
+
 interface PatientSummary {
   name: string;
   adherence: number;
@@ -27,6 +37,7 @@ interface PatientSummary {
 
 const DoctorInterface = () => {
   const [patients, setPatients] = useState<Patient[]>([]);
+  const [stats, setStats] = useState<CohortStats | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [addPatientOpen, setAddPatientOpen] = useState(false);
@@ -36,8 +47,80 @@ const DoctorInterface = () => {
   // Fetch patients from backend
   useEffect(() => {
     fetchPatients();
+    fetchStats();
+  }, []);
+
+  // Apply live change events pushed by the backend instead of polling
+  useEffect(() => {
+    const source = new EventSource("http://localhost:8000/api/events/stream");
+    // Every dose changes the statistics; coalesce a burst of events into one refetch
+    let statsTimer: ReturnType<typeof setTimeout> | null = null;
+    let lastStatsFetch = 0;
+    const scheduleStats = () => {
+      if (statsTimer) return;
+      const wait = Math.max(0, lastStatsFetch + STATS_REFRESH_INTERVAL_MS - Date.now());
+      statsTimer = setTimeout(() => {
+        statsTimer = null;
+        lastStatsFetch = Date.now();
+        fetchStats();
+      }, wait);
+    };
+    const onMetrics = (event: MessageEvent) => {
+      const data = JSON.parse(event.data);
+      setPatients(prev => prev.map(p =>
+        p.id === data.patient_id
+          ? { ...p, adherence_percent: data.adherence_percent, risk_label: data.risk_label }
+          : p
+      ));
+      scheduleStats();
+    };
+    const onCreated = (event: MessageEvent) => {
+      const data = JSON.parse(event.data);
+      setPatients(prev => [...prev, {
+        id: data.patient_id,
+        name: data.name,
+        age: data.age,
+        gender: data.gender,
+        condition: data.condition
+      }]);
+      scheduleStats();
+    };
+    const onDeleted = (event: MessageEvent) => {
+      const data = JSON.parse(event.data);
+      setPatients(prev => prev.filter(p => p.id !== data.patient_id));
+      scheduleStats();
+    };
+    const onResync = () => {
+      fetchPatients();
+      scheduleStats();
+    };
+
+    source.addEventListener("dose_logged", onMetrics);
+    source.addEventListener("patient_metrics_updated", onMetrics);
+    source.addEventListener("patient_created", onCreated);
+    source.addEventListener("patient_deleted", onDeleted);
+    source.addEventListener("resync", onResync);
+    source.addEventListener("patients_imported", onResync);
+    return () => {
+      source.close();
+      if (statsTimer) clearTimeout(statsTimer);
+    };
   }, []);
 
+  // Fetch aggregated cohort statistics computed on the server
+  const fetchStats = async () => {
+    try {
+      const response = await fetch("http://localhost:8000/api/stats/cohort");
+      const data = await response.json();
+      
+      if (data.success) {
+        setStats(data.data);
+      }
+    } catch (err) {
+      console.error("Error fetching cohort statistics:", err);
+    }
+  };
+
   const fetchPatients = async () => {
     try {
       setLoading(true);
@@ -83,12 +166,10 @@ const DoctorInterface = () => {
     toast.success("Patient NFC link copied to clipboard");
   };
 
-  // Calculate statistics based on real patient data
-  const totalPatients = patients.length;
-  const highRiskPatients = patients.filter(p => p.risk_label?.toLowerCase() === 'high').length;
-  const avgAdherence = patients.length > 0 
-    ? Math.round(patients.reduce((sum, p) => sum + (p.adherence_percent || 0), 0) / patients.length)
-    : 0;
+  // Statistics come from the server-side cohort aggregate
+  const totalPatients = stats?.total_patients ?? 0;
+  const highRiskPatients = stats?.risk_distribution?.High ?? 0;
+  const avgAdherence = Math.round(stats?.average_adherence ?? 0);
 
   return (
     <div className="p-8">
@@ -215,7 +296,7 @@ const DoctorInterface = () => {
               <div className="text-center">
                 <AlertCircle className="h-12 w-12 text-destructive mx-auto mb-4" />
                 <p className="text-destructive font-medium">{error}</p>
-                <Button onClick={fetchPatients} variant="outline" className="mt-4">
+                <Button onClick={() => { fetchPatients(); fetchStats(); }} variant="outline" className="mt-4">
                   Retry
                 </Button>
               </div>
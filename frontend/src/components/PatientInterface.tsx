@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useParams } from "react-router-dom";
 import { RefreshCw, History, Calendar, Check, X, AlertCircle, Clock, Pill, Copy, QrCode } from "lucide-react";
 import { Button } from "@/components/ui/button";
@@ -38,7 +38,8 @@ interface DoseLogResponse {
   dose_log_id: string;
   adherence_percent: number;
   risk_label: string;
-  feedback_message: string;
+  feedback_message: string | null;  // null when skipped under load
+  queued?: boolean;
 }
 
 interface PatientSummary {
@@ -98,6 +99,9 @@ const PatientInterface = () => {
   const [error, setError] = useState<string | null>(null);
   const [medicationSchedule, setMedicationSchedule] = useState<any[]>([]);
   const [nfcSupported, setNfcSupported] = useState<boolean>(false);
+  // One Idempotency-Key per dose (schedule item and status), so double taps and
+  // retries of the same dose are deduplicated by the backend
+  const doseKeys = useRef<Map<string, string>>(new Map());
 
   // Check NFC support
   useEffect(() => {
@@ -120,8 +124,8 @@ const PatientInterface = () => {
         try {
           const record = event.message.records[0];
           const url = new TextDecoder().decode(record.data);
-          if (url.includes("/patient/")) {
-            // Redirect to the patient dashboard URL
+          if (url.includes("/patient/") || url.includes("/p/")) {
+            // Redirect to the patient dashboard URL (short links redirect via the backend)
             window.location.href = url;
           }
         } catch (err) {
@@ -192,11 +196,20 @@ const PatientInterface = () => {
       return;
     }
     
+    const doseKey = `${scheduleItemId}:${status}`;
+    let idempotencyKey = doseKeys.current.get(doseKey);
+    if (!idempotencyKey) {
+      idempotencyKey = crypto.randomUUID();
+      doseKeys.current.set(doseKey, idempotencyKey);
+    }
+    
     try {
       const response = await fetch("http://localhost:8000/api/log_dose", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          // Lets the backend replay the original response if this request is repeated
+          "Idempotency-Key": idempotencyKey,
         },
         body: JSON.stringify({
           patient_id: id,
@@ -205,13 +218,24 @@ const PatientInterface = () => {
         }),
       });
       
+      if (response.status === 429) {
+        const retryAfter = response.headers.get("Retry-After") || "a few";
+        toast.error(`Server is busy, please try again in ${retryAfter} seconds`);
+        return;
+      }
+      
       const data = await response.json();
       
       if (data.success) {
         const doseData: DoseLogResponse = data.data;
-        setAdherencePercentage(doseData.adherence_percent);
-        setRiskLevel(doseData.risk_label);
-        setAiMessage(doseData.feedback_message);
+        // Queued doses (write-behind mode) are acknowledged before metrics are recalculated
+        if (!doseData.queued) {
+          setAdherencePercentage(doseData.adherence_percent);
+          setRiskLevel(doseData.risk_label);
+          if (doseData.feedback_message) {
+            setAiMessage(doseData.feedback_message);
+          }
+        }
         toast.success(`Medication marked as ${status.toLowerCase()}`);
         
         // Update the schedule item status
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Generate the monthly adherence report for every patient.
+
+Patients are read in pages by id; each page's dose logs for the month are
+fetched while worker processes summarize earlier pages. Rows are appended to
+the CSV, JSON and/or HTML files as pages complete, so memory stays bounded by
+the pages in flight. After every page a checkpoint records the last patient
+id and the size of each file; a run interrupted for any reason continues
+from there with --resume.
+
+Usage:
+    python generate_report.py                          # previous month, all formats
+    python generate_report.py --month 2025-03 --format csv --output reports/march
+    python generate_report.py --month 2025-03 --resume  # continue an interrupted run
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.cohort_report import (
+    REPORT_FORMATS, REPORT_PAGE_SIZE, add_totals, empty_totals, fetch_month_logs,
+    fetch_patient_page, month_label, parse_month, summarize_patients
+)
+
+def load_checkpoint(path, month, formats):
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint["month"] != month or sorted(checkpoint["offsets"]) != sorted(formats):
+        sys.exit(f"❌ {path} is for {checkpoint['month']} ({', '.join(checkpoint['offsets'])}), not this report")
+    return checkpoint
+
+def save_checkpoint(path, checkpoint):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+def open_outputs(prefix, formats, checkpoint, month):
+    """
+    Open the report files: fresh with their headers, or truncated back to the last checkpoint.
+    """
+    files = {}
+    for name in formats:
+        path = f"{prefix}.{REPORT_FORMATS[name].extension}"
+        if checkpoint:
+            f = open(path, "r+", encoding="utf-8", newline="")
+            # Drop rows written after the checkpoint by the interrupted run
+            f.truncate(checkpoint["offsets"][name])
+            f.seek(checkpoint["offsets"][name])
+        else:
+            f = open(path, "w", encoding="utf-8", newline="")
+            f.write(REPORT_FORMATS[name].header(month))
+        files[name] = f
+    return files
+
+def print_progress(done, total, started, resumed_from):
+    rate = (done - resumed_from) / max(time.perf_counter() - started, 1e-9)
+    eta = f", ~{(total - done) / rate:.0f}s left" if rate and total and done < total else ""
+    percent = f" ({done / total:.0%})" if total else ""
+    print(f"\r   {done}/{total or '?'} patients{percent}, {rate:.0f}/s{eta}   ", end="", flush=True)
+
+def run(supabase, start, end, prefix, formats, workers, page_size, resume):
+    month = month_label(start)
+    checkpoint_path = prefix + ".progress.json"
+    checkpoint = load_checkpoint(checkpoint_path, month, formats) if resume else None
+    if checkpoint is None:
+        checkpoint = {"month": month, "after": None, "totals": empty_totals(), "offsets": {}}
+        files = open_outputs(prefix, formats, None, month)
+    else:
+        files = open_outputs(prefix, formats, checkpoint, month)
+        print(f"↩️  Resuming after patient {checkpoint['after']} ({checkpoint['totals']['patients']} done)")
+    totals = checkpoint["totals"]
+
+    count_response = supabase.table("patients").select("id", count="exact").limit(1).execute()
+    total_patients = count_response.count
+    started, resumed_from = time.perf_counter(), totals["patients"]
+    print(f"📊 Adherence report {month} for {total_patients} patients, {workers} worker processes")
+
+    # Keep a few pages in flight so fetching overlaps summarizing, but memory stays bounded
+    in_flight, after, exhausted = deque(), checkpoint["after"], False
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < workers * 2:
+                patients = fetch_patient_page(supabase, after, page_size)
+                if patients:
+                    logs = fetch_month_logs(supabase, [patient["id"] for patient in patients], start, end)
+                    after = patients[-1]["id"]
+                    in_flight.append((after, pool.submit(summarize_patients, patients, logs, start, end)))
+                exhausted = len(patients) < page_size
+            if not in_flight:
+                break
+
+            # Pages are written in id order, so the checkpoint's last id covers everything before it
+            page_after, future = in_flight.popleft()
+            rows = future.result()
+            for name, f in files.items():
+                f.write(REPORT_FORMATS[name].rows(rows, totals["patients"]))
+                f.flush()
+                os.fsync(f.fileno())
+            add_totals(totals, rows)
+            checkpoint["after"] = page_after
+            checkpoint["offsets"] = {name: f.tell() for name, f in files.items()}
+            save_checkpoint(checkpoint_path, checkpoint)
+            print_progress(totals["patients"], total_patients, started, resumed_from)
+
+    for name, f in files.items():
+        f.write(REPORT_FORMATS[name].footer(totals))
+        f.close()
+        print(f"\n💾 {f.name}", end="")
+    os.remove(checkpoint_path)
+    adherence = totals["doses_taken"] / totals["doses_logged"] * 100 if totals["doses_logged"] else 0
+    print(f"\n✅ {totals['patients']} patients, cohort adherence {adherence:.1f}% "
+          f"({time.perf_counter() - started:.1f}s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the monthly adherence report for all patients")
+    parser.add_argument("--month", help="YYYY-MM (default: previous month)")
+    parser.add_argument("--format", nargs="+", choices=sorted(REPORT_FORMATS), default=sorted(REPORT_FORMATS))
+    parser.add_argument("--output", help="Path prefix of the report files (default: adherence-report-YYYY-MM)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--page-size", type=int, default=REPORT_PAGE_SIZE, help="Patients per page")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint")
+    args = parser.parse_args()
+
+    start, end = parse_month(args.month)
+    prefix = args.output or f"adherence-report-{month_label(start)}"
+    if os.path.dirname(prefix):
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+
+    from database import supabase
+    run(supabase, start, end, prefix, args.format, args.workers, args.page_size, args.resume)
+
+if __name__ == "__main__":
+    main()
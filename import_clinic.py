@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Import patients and prescriptions from another system's CSV or JSON export.
+
+The file is read record by record and written to Supabase in chunked bulk
+inserts. Rows failing validation or rejected by the database are reported and
+skipped; the rest of the file is still imported. The external id -> patient id
+map can be saved to reconcile records with the previous system.
+
+CSV files have one row per patient or prescription:
+
+    type,external_id,name,age,gender,condition,patient_external_id,medication,dosage,frequency,start_date,schedule_days
+    patient,P-1001,Jane Doe,54,Female,Diabetes,,,,,,
+    treatment,,,,,,P-1001,Metformin,500mg,Twice daily,2025-01-06,Monday;Thursday
+
+JSON files are an array (or JSON Lines) of the same records; patients may
+nest their prescriptions under "treatments".
+
+Usage:
+    python import_clinic.py clinic.csv
+    python import_clinic.py clinic.json --id-map id_map.csv --errors import_errors.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from routers.imports import IMPORT_CHUNK_SIZE, run_import
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import patients and prescriptions")
+    parser.add_argument("file", help="CSV or JSON export")
+    parser.add_argument("--format", choices=["csv", "json"], help="Default: from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="Rows per bulk insert")
+    parser.add_argument("--id-map", help="Write external_id,patient_id pairs to this CSV file")
+    parser.add_argument("--errors", help="Write the per-row errors to this JSON file")
+    args = parser.parse_args()
+
+    import_format = args.format or ("csv" if args.file.lower().endswith(".csv") else "json")
+    started = time.perf_counter()
+
+    def progress(importer):
+        print(f"\r   {importer.rows} rows read, {importer.patients_created} patients and "
+              f"{importer.treatments_created} prescriptions created, {importer.error_count} failed   ",
+              end="", flush=True)
+
+    print(f"📥 Importing {args.file} ({import_format}, {os.path.getsize(args.file)} bytes)")
+    with open(args.file, encoding="utf-8-sig", newline="") as f:
+        report = run_import(f, import_format, chunk_size=args.chunk_size, on_chunk=progress)
+    print(f"\n✅ {report['patients_created']} patients and {report['treatments_created']} prescriptions "
+          f"from {report['rows']} rows in {time.perf_counter() - started:.1f}s")
+
+    if args.id_map:
+        with open(args.id_map, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["external_id", "patient_id"])
+            writer.writerows(report["id_map"].items())
+        print(f"💾 Id map written to {args.id_map}")
+
+    if report["failed_rows"]:
+        print(f"⚠️  {report['failed_rows']} rows failed")
+        for error in report["errors"][:10]:
+            print(f"   row {error['row']}: {'; '.join(error['errors'])}")
+        if args.errors:
+            with open(args.errors, "w") as f:
+                json.dump(report["errors"], f, indent=2)
+            print(f"💾 Errors written to {args.errors}")
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,52 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import asyncio
+import logging
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Warnings and errors of the routers and background tasks (and the log reminder sink at INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 # Import routers
-from routers import patients, treatments, logs, summary
+from routers import patients, treatments, logs, summary, stats, events, links, imports, reminders
+
+from utils.response import FastJSONResponse
+from utils.compression import CompressionMiddleware
+from utils.admission import AdmissionControlMiddleware, admission_controller
+from utils.http_clients import http_clients, gemini_calls
+from utils.warmup import warmup
+from utils.reminders import REMINDERS_ENABLED
+from utils.round_trips import ROUND_TRIP_HEADERS, RoundTripMiddleware
+from utils.profiling import PROFILING_ENABLED, ProfilingMiddleware, profile_store, token_matches
 
 # Import database and AI modules
 from database import supabase
-from ai_model import generate_ai_feedback, create_and_save_risk_model
-import joblib
+from ai_model import generate_ai_feedback, risk_model_store, warm_up_risk_model, feedback_model
+
+app = FastAPI(
+    title="TheraLink Backend",
+    description="Medication adherence tracking with AI feedback",
+    default_response_class=FastJSONResponse
+)
+
+# Opt-in request profiling (X-Profile header or sampling); not installed unless enabled
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
 
-app = FastAPI(title="TheraLink Backend", description="Medication adherence tracking with AI feedback")
+# Debug mode: Supabase and Gemini round trips of each request in its response headers
+if ROUND_TRIP_HEADERS:
+    app.add_middleware(RoundTripMiddleware)
+
+# Compress large responses (brotli or gzip, negotiated per request)
+app.add_middleware(CompressionMiddleware)
+
+# Per route class concurrency limits; shed requests get 429 with Retry-After
+app.add_middleware(AdmissionControlMiddleware)
 
 # Add CORS middleware to allow frontend requests
 app.add_middleware(
@@ -23,6 +55,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Profile-Id", "X-Upstream-Calls", "Server-Timing"],
 )
 
 # Include routers
@@ -30,6 +63,12 @@ app.include_router(patients.router)
 app.include_router(treatments.router)
 app.include_router(logs.router)
 app.include_router(summary.router)
+app.include_router(stats.router)
+app.include_router(events.router)
+app.include_router(links.router)
+app.include_router(links.redirect_router)
+app.include_router(imports.router)
+app.include_router(reminders.router)
 
 @app.get("/health")
 async def health_check():
@@ -58,15 +97,10 @@ async def test_system():
         gemini_status = f"ERROR: {str(e)}"
     
     try:
-        # Test ML model
-        try:
-            # Try to load existing model
-            model = joblib.load('risk_model.pkl')
-            ml_status = "OK"
-        except FileNotFoundError:
-            # If model doesn't exist, create it
-            create_and_save_risk_model()
-            ml_status = "OK - Model created"
+        # Test ML model (created under the shared lock if it doesn't exist)
+        builds = risk_model_store.builds
+        risk_model_store.get()
+        ml_status = "OK - Model created" if risk_model_store.builds > builds else "OK"
     except Exception as e:
         ml_status = f"ERROR: {str(e)}"
     
@@ -77,16 +111,113 @@ async def test_system():
         "message": "System test completed"
     }
 
-# Create ML model on startup if it doesn't exist
+@app.get("/health/ready")
+async def readiness():
+    """
+    Readiness of this worker: 200 once warm-up has finished, 503 while it is still warming up.
+    """
+    report = warmup.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/health/model")
+async def model_health():
+    """
+    Risk model readiness and memory of this worker process.
+    """
+    return risk_model_store.metrics()
+
+@app.get("/health/admission")
+async def admission_health():
+    """
+    Admission control queue depth, shed and degraded counts per route class for this worker.
+    """
+    return admission_controller.metrics()
+
+@app.get("/health/clients")
+async def clients_health():
+    """
+    Connection pool usage of the upstream HTTP clients (Supabase) and Gemini call slots for this worker.
+    """
+    return {**http_clients.metrics(), "gemini": gemini_calls.metrics()}
+
+def require_profile_access(x_profile):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not token_matches(x_profile.encode() if x_profile else None):
+        raise HTTPException(status_code=403, detail="Missing or invalid X-Profile token")
+
+@app.get("/health/profiles")
+async def list_profiles(x_profile: str = Header(None)):
+    """
+    Recent request profiles of this worker. Requires the X-Profile token.
+    """
+    require_profile_access(x_profile)
+    return profile_store.list()
+
+@app.get("/health/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "json", x_profile: str = Header(None)):
+    """
+    One request profile: its summary and upstream calls (format=json) or collapsed
+    stacks for a flame graph (format=folded). Requires the X-Profile token.
+    """
+    require_profile_access(x_profile)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or folded")
+    return profile.summary()
+
+# Warm the worker up on startup
 @app.on_event("startup")
 async def startup_event():
     """
-    Create ML model on startup if it doesn't exist.
+    Start the warm-up (see GET /health/ready), the dose queue flusher and the reminder scheduler.
     """
-    try:
-        joblib.load('risk_model.pkl')
-    except FileNotFoundError:
-        create_and_save_risk_model()
+    app.state.warmup = asyncio.create_task(warmup.run(
+        # Only one worker trains a missing model; the others wait on the lock, then map it
+        [("risk_model", warm_up_risk_model, True)],
+        # The first query opens the pooled Supabase connection (TLS handshake) for the rest
+        [("supabase_connection", lambda: supabase.table("patients").select("id").limit(1).execute(), True),
+         ("search_index", patients.build_search_index, False),
+         ("cohort_stats", stats.refresh_cohort_stats, False),
+         ("recent_patients", patients.warm_recent_patients, False)],
+        [("gemini_client", feedback_model, False)]
+    ))
+    
+    # Start flushing queued doses when write-behind mode is enabled
+    if logs.dose_queue is not None:
+        app.state.dose_flusher = asyncio.create_task(logs.run_dose_flusher())
+    
+    # Send dose reminders through the REMINDER_SINK when enabled
+    if REMINDERS_ENABLED:
+        app.state.reminders = asyncio.create_task(reminders.run_reminder_scheduler())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Cancel an unfinished warm-up and the reminder scheduler, stop the dose queue flusher,
+    flush what is still queued and close the HTTP connection pools.
+    """
+    for name in ("warmup", "reminders"):
+        task = getattr(app.state, name, None)
+        if task is not None and not task.done():
+            task.cancel()
+    
+    flusher = getattr(app.state, "dose_flusher", None)
+    if flusher is not None:
+        flusher.cancel()
+        try:
+            await flusher
+        except asyncio.CancelledError:
+            pass
+        await logs.drain_dose_queue()
+        logs.dose_queue.close()
+    
+    # Last, so the queue drain above can still reach Supabase
+    http_clients.close()
 
 # Serve static files for NFC tag scanning
 @app.get("/")
@@ -1,105 +1,448 @@
 #!/usr/bin/env python3
 """
 NFC Writer Utility for TheraLink
-Writes patient dashboard URLs to NFC tags
+Writes short patient dashboard links to NFC tags
+
+Usage:
+    python nfc_writer.py                          # interactive, one patient
+    python nfc_writer.py --batch --condition Diabetes
+    python nfc_writer.py --batch --ids-file ward_3.csv --progress-log ward_3.jsonl
+    python nfc_writer.py --batch --all --simulate # dry run: simulated reader, placeholder short codes
 """
 
+import argparse
+import csv
+import json
 import nfc
+import ndef
 import os
-from supabase import create_client, Client
+import time
+from supabase import Client
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+from utils.short_links import create_short_link, generate_code, revoke_short_link, short_link_url, LINKS_TABLE
+from utils.http_clients import create_supabase_client
+from utils.cohort_report import fetch_all_patients
+
+# Full dashboard URL, only written with --full-urls; tags normally get a short link
+PATIENT_URL_TEMPLATE = os.getenv("PATIENT_URL_TEMPLATE", "http://localhost:8081/patient/{patient_id}")
+DEFAULT_PROGRESS_LOG = "nfc_batch_progress.jsonl"
+# Patient ids per request when listing the patients of an ids file, to keep the URL short
+IDS_CHUNK_SIZE = 100
+
+class TagWriteError(Exception):
+    """Raised when a tag could not be written or did not verify"""
+
 def get_supabase_client() -> Client:
     """Initialize Supabase client"""
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_SERVICE_KEY")
     if not url or not key:
         raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set in .env file")
-    return create_client(url, key)
+    return create_supabase_client(url, key)
+
+def get_patient_url(patient) -> str:
+    """Build the dashboard URL written to a patient's tag"""
+    return PATIENT_URL_TEMPLATE.format(patient_id=patient["id"])
 
-def write_nfc_tag(patient_url: str) -> bool:
+class ShortLinkIssuer:
     """
-    Write patient URL to NFC tag
+    Issues a separate short code for every tag, so a lost tag can be revoked
+    without rewriting the patient's other tags.
     """
-    try:
-        def on_connect(tag):
-            # Create NDEF message with URL
-            message = nfc.ndef.Message(nfc.ndef.UriRecord(patient_url))
-            tag.ndef.message = message
-            print(f"✅ NFC Tag written successfully!")
-            print(f"URL: {patient_url}")
-            return True
 
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def issue(self, patient):
+        """
+        Returns:
+            tuple: (code, short URL to write)
+        """
+        link = create_short_link(self.supabase, patient["id"])
+        return link["code"], short_link_url(link["code"])
+
+    def attach_tag(self, code, tag_id):
+        """Record which physical tag carries the code"""
+        self.supabase.table(LINKS_TABLE).update({"tag_id": tag_id}).eq("code", code).execute()
+
+    def discard(self, code):
+        """Revoke a code that never made it onto a tag"""
+        revoke_short_link(self.supabase, code)
+
+class SimulatedLinkIssuer:
+    """
+    Stand-in for ShortLinkIssuer in simulated runs: issues codes of the real
+    length without storing anything, so a dry run leaves Supabase untouched.
+    """
+
+    def __init__(self):
+        self.issued = {}
+
+    def issue(self, patient):
+        code = generate_code()
+        self.issued[code] = patient["id"]
+        return code, short_link_url(code)
+
+    def attach_tag(self, code, tag_id):
+        pass
+
+    def discard(self, code):
+        self.issued.pop(code, None)
+
+def simulated_progress_log_path(path):
+    """Separate progress log of simulated runs, so they never mark real tags as written"""
+    base, extension = os.path.splitext(path)
+    return f"{base}.simulated{extension}"
+
+def write_and_verify(tag, patient_url: str):
+    """
+    Write a URI record to a connected tag and read it back.
+    Returns the tag identifier as hex.
+    """
+    if tag.ndef is None:
+        raise TagWriteError("Tag is not NDEF formatted")
+    if not tag.ndef.is_writeable:
+        raise TagWriteError("Tag is write protected")
+
+    tag.ndef.records = [ndef.UriRecord(patient_url)]
+
+    # Re-read the tag; a change means it no longer holds what was written
+    if tag.ndef.has_changed or tag.ndef is None:
+        raise TagWriteError("Tag content changed after write")
+    records = tag.ndef.records
+    if not records or getattr(records[0], "iri", None) != patient_url:
+        raise TagWriteError("Verification failed: tag does not contain the written URL")
+    return tag.identifier.hex()
+
+class UsbTagWriter:
+    """
+    Keeps one NFC reader session open and writes tags back to back.
+
+    Before waiting for the next tag it waits for the previous one to leave the
+    reader, and it refuses to write the tag it wrote last, so a tag left on the
+    reader is never overwritten with the next patient's link.
+    """
+
+    def __init__(self, device="usb", timeout=30):
+        self.device = device
+        self.timeout = timeout
+        self.clf = None
+        self.last_tag = None
+        self.last_tag_id = None
+
+    def __enter__(self):
+        self.clf = nfc.ContactlessFrontend(self.device)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.clf.close()
+
+    def wait_for_removal(self):
+        """Block until the last written tag is taken off the reader"""
+        if self.last_tag is None:
+            return
+        started = time.time()
+        print("⬆️  Remove the tag from the reader...")
+        while True:
+            try:
+                present = self.last_tag.is_present
+            except (nfc.tag.TagCommandError, IOError):
+                present = False
+            if not present:
+                break
+            if time.time() - started > self.timeout:
+                raise TagWriteError(f"Previous tag still on the reader after {self.timeout}s, remove it")
+            time.sleep(0.1)
+        self.last_tag = None
+
+    def write_tag(self, patient_url: str) -> str:
+        """Wait for the next tag, write the URL and verify it"""
+        self.wait_for_removal()
+        started = time.time()
+        # Returning False from on-connect keeps the tag connected for writing
+        tag = self.clf.connect(
+            rdwr={'on-connect': lambda tag: False},
+            terminate=lambda: time.time() - started > self.timeout
+        )
+        if not tag:
+            raise TagWriteError(f"No tag presented within {self.timeout}s")
+        if tag.identifier.hex() == self.last_tag_id:
+            self.last_tag = tag
+            raise TagWriteError("This tag was already written for the previous patient, present a new tag")
+        try:
+            tag_id = write_and_verify(tag, patient_url)
+        except (nfc.tag.TagCommandError, IOError) as e:
+            raise TagWriteError(f"Tag removed or unreadable during write: {e}")
+
+        self.last_tag, self.last_tag_id = tag, tag_id
+        return tag_id
+
+class SimulatedTagWriter:
+    """
+    Stand-in for UsbTagWriter that writes to in-memory tags.
+
+    failures maps a 0-based write attempt number to an error message, to
+    simulate bad taps or verification failures.
+    """
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.tags = {}
+        self.attempts = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def write_tag(self, patient_url: str) -> str:
+        attempt = self.attempts
+        self.attempts += 1
+        if attempt in self.failures:
+            raise TagWriteError(self.failures[attempt])
+        tag_id = f"sim{attempt:06d}"
+        self.tags[tag_id] = patient_url
+        return tag_id
+
+class ProgressLog:
+    """
+    Append-only JSON lines log of batch results, used to resume a batch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def completed(self):
+        """Patient ids whose tag was written and verified"""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn final line from an interrupted run
+                if entry.get("status") == "written":
+                    done.add(entry["patient_id"])
+        return done
+
+    def record(self, patient, status, **fields):
+        entry = {"patient_id": patient["id"], "name": patient.get("name"), "status": status, "ts": time.time(), **fields}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def provision_batch(patients, writer, progress_log, max_attempts=3, links=None):
+    """
+    Write tags for a list of patients with one open reader session.
+
+    With a ShortLinkIssuer each tag gets its own short link, otherwise the full
+    dashboard URL is written. Patients already written according to the
+    progress log are skipped, so an interrupted batch continues where it
+    stopped. Returns a summary dict.
+    """
+    completed = progress_log.completed()
+    pending = [p for p in patients if p["id"] not in completed]
+    summary = {"total": len(patients), "skipped": len(patients) - len(pending), "written": 0, "failed": 0}
+
+    if summary["skipped"]:
+        print(f"⏭️  Skipping {summary['skipped']} patient(s) already written")
+
+    with writer:
+        for index, patient in enumerate(pending, 1):
+            code, patient_url = links.issue(patient) if links else (None, get_patient_url(patient))
+            print(f"\n[{index}/{len(pending)}] {patient.get('name')} → {patient_url}")
+            print("🔍 Tap the tag to write...")
+
+            last_error = None
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    tag_id = writer.write_tag(patient_url)
+                    if code:
+                        links.attach_tag(code, tag_id)
+                    progress_log.record(patient, "written", url=patient_url, code=code, tag_id=tag_id, attempts=attempt)
+                    summary["written"] += 1
+                    print(f"✅ Written and verified (tag {tag_id})")
+                    break
+                except TagWriteError as e:
+                    last_error = str(e)
+                    print(f"⚠️  Attempt {attempt}/{max_attempts} failed: {e}")
+            else:
+                if code:
+                    links.discard(code)
+                progress_log.record(patient, "failed", url=patient_url, error=last_error)
+                summary["failed"] += 1
+                print("❌ Giving up on this patient, moving to the next tag")
+
+    return summary
+
+def write_nfc_tag(patient_url: str):
+    """
+    Write patient URL to NFC tag. Returns the tag id, or None on failure.
+    """
+    try:
         # Connect to NFC reader
-        with nfc.ContactlessFrontend('usb') as clf:
+        with UsbTagWriter() as writer:
             print("🔍 Waiting for NFC tag... Tap the tag to write.")
-            clf.connect(rdwr={'on-connect': on_connect})
-            return True
-            
+            tag_id = writer.write_tag(patient_url)
+            print("✅ NFC Tag written successfully!")
+            print(f"URL: {patient_url} ({len(patient_url)} bytes)")
+            return tag_id
+
     except Exception as e:
         print(f"❌ Error writing NFC tag: {e}")
-        return False
+        return None
+
+def list_patients(supabase=None, condition=None, name_contains=None, ids=None):
+    """List patients from Supabase, optionally filtered or limited to `ids`, a page at a time"""
+    def where(query):
+        if condition:
+            query = query.eq("condition", condition)
+        if name_contains:
+            query = query.ilike("name", f"%{name_contains}%")
+        return query
 
-def list_patients():
-    """List all patients from Supabase"""
     try:
-        supabase = get_supabase_client()
-        response = supabase.table("patients").select("id, name").execute()
-        return response.data
+        supabase = supabase or get_supabase_client()
+        if ids is None:
+            return fetch_all_patients(supabase, columns="id, name, condition", where=where)
+        patients = []
+        for start in range(0, len(ids), IDS_CHUNK_SIZE):
+            chunk = ids[start:start + IDS_CHUNK_SIZE]
+            patients.extend(fetch_all_patients(
+                supabase, columns="id, name, condition", where=lambda query: where(query).in_("id", chunk)
+            ))
+        return patients
     except Exception as e:
         print(f"❌ Error fetching patients: {e}")
         return []
 
-def main():
+def load_patient_ids(path):
+    """Read patient ids from a CSV with an 'id' column or a file with one id per line"""
+    with open(path, newline="") as f:
+        first_line = f.readline()
+        f.seek(0)
+        if "," in first_line or first_line.strip() == "id":
+            return [row["id"].strip() for row in csv.DictReader(f) if row.get("id")]
+        return [line.strip() for line in f if line.strip()]
+
+def run_batch(args):
+    """Batch provisioning mode"""
+    print("📱 TheraLink NFC Writer Utility - Batch Mode")
+    print("=" * 40)
+
+    supabase = get_supabase_client()
+    wanted = load_patient_ids(args.ids_file) if args.ids_file else None
+    patients = list_patients(supabase, condition=args.condition, name_contains=args.name_contains, ids=wanted)
+    if args.ids_file:
+        by_id = {p["id"]: p for p in patients}
+        missing = [patient_id for patient_id in wanted if patient_id not in by_id]
+        if missing:
+            print(f"⚠️  {len(missing)} id(s) from {args.ids_file} not found, e.g. {missing[0]}")
+        patients = [by_id[patient_id] for patient_id in wanted if patient_id in by_id]
+    elif not (args.all or args.condition or args.name_contains):
+        print("❌ Choose patients with --ids-file, --condition, --name-contains or --all")
+        return
+
+    if not patients:
+        print("❌ No matching patients found")
+        return
+
+    # A simulated run stores no short links and keeps its own progress log
+    progress_log = simulated_progress_log_path(args.progress_log) if args.simulate else args.progress_log
+    print(f"📋 {len(patients)} patient(s) selected, progress log: {progress_log}")
+    if args.simulate:
+        writer, links = SimulatedTagWriter(), None if args.full_urls else SimulatedLinkIssuer()
+    else:
+        writer, links = UsbTagWriter(timeout=args.timeout), None if args.full_urls else ShortLinkIssuer(supabase)
+    try:
+        summary = provision_batch(patients, writer, ProgressLog(progress_log), max_attempts=args.max_attempts, links=links)
+    except KeyboardInterrupt:
+        print("\n\n⏸️  Batch interrupted. Run the same command again to resume.")
+        return
+
+    print("\n" + "=" * 40)
+    print(f"🎉 Batch complete: {summary['written']} written, {summary['failed']} failed, {summary['skipped']} skipped")
+    if summary["failed"]:
+        print("   Run the same command again to retry the failed tags.")
+
+def main(args):
     """Main NFC writer utility"""
     print("📱 TheraLink NFC Writer Utility")
     print("=" * 40)
-    
+
     # List patients
-    patients = list_patients()
+    supabase = get_supabase_client()
+    patients = list_patients(supabase)
     if not patients:
         print("❌ No patients found in database")
         return
-    
+
     print("\n📋 Available Patients:")
     for i, patient in enumerate(patients, 1):
         print(f"{i}. {patient['name']} (ID: {patient['id'][:8]}...)")
-    
+
     # Get user selection
     try:
         choice = int(input(f"\nSelect patient (1-{len(patients)}): ")) - 1
         if choice < 0 or choice >= len(patients):
             print("❌ Invalid selection")
             return
-        
+
         selected_patient = patients[choice]
-        # Use the frontend port (8081) for the patient dashboard URL
-        patient_url = f"http://localhost:8081/patient/{selected_patient['id']}"
-        
         print(f"\n📝 Selected Patient: {selected_patient['name']}")
-        print(f"🔗 URL to write: {patient_url}")
-        
+
         # Confirm before writing
-        confirm = input("\nWrite this URL to NFC tag? (y/N): ").lower()
+        confirm = input("\nWrite a link for this patient to an NFC tag? (y/N): ").lower()
         if confirm != 'y':
             print("❌ Operation cancelled")
             return
-        
+
+        links = None if args.full_urls else ShortLinkIssuer(supabase)
+        code, patient_url = links.issue(selected_patient) if links else (None, get_patient_url(selected_patient))
+        print(f"🔗 URL to write: {patient_url}")
+
         # Write to NFC tag
-        success = write_nfc_tag(patient_url)
-        if success:
+        tag_id = write_nfc_tag(patient_url)
+        if tag_id:
+            if code:
+                links.attach_tag(code, tag_id)
             print("\n🎉 NFC tag written successfully!")
             print("✅ Patient can now tap this tag to open their dashboard")
         else:
+            if code:
+                links.discard(code)
             print("\n❌ Failed to write NFC tag")
-            
+
     except ValueError:
         print("❌ Invalid input. Please enter a number.")
     except KeyboardInterrupt:
         print("\n\n👋 Goodbye!")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write TheraLink patient dashboard URLs to NFC tags")
+    parser.add_argument("--batch", action="store_true", help="Provision many tags in one reader session")
+    parser.add_argument("--ids-file", help="CSV with an 'id' column, or one patient id per line")
+    parser.add_argument("--condition", help="Only patients with this condition")
+    parser.add_argument("--name-contains", help="Only patients whose name contains this text")
+    parser.add_argument("--all", action="store_true", help="All patients")
+    parser.add_argument("--progress-log", default=DEFAULT_PROGRESS_LOG, help="Resumable progress log (JSON lines)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Write attempts per tag before skipping")
+    parser.add_argument("--timeout", type=int, default=30, help="Seconds to wait for each tag")
+    parser.add_argument("--simulate", action="store_true", help="Dry run: simulated reader, placeholder short codes and a separate progress log")
+    parser.add_argument("--full-urls", action="store_true", help="Write full dashboard URLs instead of short links")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.batch:
+        run_batch(args)
+    else:
+        main(args)
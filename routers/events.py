@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional, List
+from utils.response import success_response
+from utils.event_bus import event_broadcaster
+import asyncio
+import json
+import os
+
+router = APIRouter(prefix="/api/events", tags=["events"])
+
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+def format_sse(event):
+    return f"id: {event.get('id', '')}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+@router.get("/stream")
+async def stream_events(request: Request, patient_id: Optional[List[str]] = Query(None)):
+    """
+    Server-Sent Events stream of patient, treatment and dose changes.
+
+    Pass one or more patient_id query parameters to only receive events for those patients.
+    """
+    subscription = event_broadcaster.subscribe(patient_id)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            event_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/metrics")
+async def get_event_metrics():
+    """
+    Get live update subscriber and fan-out metrics.
+    """
+    return success_response(
+        data=event_broadcaster.metrics(),
+        message="Event metrics retrieved successfully"
+    )
@@ -0,0 +1,258 @@
+import asyncio
+import io
+import os
+import tempfile
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import ValidationError
+from database import supabase
+from utils.response import success_response
+from utils.bulk_import import iter_import_records, expand_record
+from utils.cohort_stats import cohort_stats_cache
+from utils.patient_search import patient_search_index
+from utils.adherence_bitmaps import adherence_bitmaps
+from utils.reminders import reminder_scheduler
+from utils.event_bus import event_broadcaster
+from utils.http_clients import is_permanent_error
+from routers.patients import PatientCreate
+from routers.treatments import TreatmentCreate, treatment_row
+
+router = APIRouter(prefix="/api/import", tags=["import"])
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+# Errors listed in the response; the counts always cover every row
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+
+def validation_messages(error: ValidationError):
+    return [f"{'.'.join(str(part) for part in e['loc']) or 'record'}: {e['msg']}" for e in error.errors()]
+
+class StoreUnavailable(Exception):
+    """
+    A chunk insert failed without the database rejecting it, so it may or may not have been stored.
+    """
+
+    def __init__(self, first_row, last_row, error):
+        super().__init__(f"rows {first_row}-{last_row} may or may not have been stored: {error}")
+        self.first_row = first_row
+
+class BulkImporter:
+    """
+    Import patients and prescriptions in chunked bulk inserts.
+
+    Rows are validated against PatientCreate and TreatmentCreate as they are
+    read and buffered until a chunk is full. Patients are always flushed before
+    prescriptions, so a prescription can refer to a patient earlier in the file
+    by its external id. A chunk the database rejects with a data or integrity
+    error is retried row by row to find the failing rows; every failure is
+    recorded against its row number and the import carries on. Any other error
+    (a timeout, a dropped connection) stops the import instead, since the chunk
+    may have been stored and retrying it would insert it twice.
+    """
+
+    def __init__(self, client, chunk_size=IMPORT_CHUNK_SIZE, on_chunk=None):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+        self.id_map = {}
+        self.errors = []
+        self.error_count = 0
+        self.rows = 0
+        self.patients_created = 0
+        self.treatments_created = 0
+        self._patients = []
+        self._treatments = []
+        self._pending_external_ids = set()
+
+    def fail(self, row, messages, external_id=None):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "external_id": external_id, "errors": messages})
+
+    def add(self, row, record):
+        self.rows += 1
+        for kind, fields in expand_record(record, row):
+            if kind == "patient":
+                self.add_patient(row, fields)
+            elif kind == "treatment":
+                self.add_treatment(row, fields)
+            else:
+                self.fail(row, [f"type: unknown record type {kind!r}"], fields.get("external_id"))
+
+    def add_patient(self, row, fields):
+        external_id = fields.get("external_id")
+        if external_id is not None:
+            external_id = str(external_id)
+            if external_id in self.id_map or external_id in self._pending_external_ids:
+                self.fail(row, ["external_id: duplicate in this import"], external_id)
+                return
+        try:
+            patient = PatientCreate(**{key: fields.get(key) for key in PatientCreate.model_fields if key in fields})
+        except ValidationError as e:
+            self.fail(row, validation_messages(e), external_id)
+            return
+        if external_id is not None:
+            self._pending_external_ids.add(external_id)
+        self._patients.append((row, external_id, {
+            "name": patient.name,
+            "age": patient.age,
+            "gender": patient.gender,
+            "condition": patient.condition
+        }))
+        if len(self._patients) >= self.chunk_size:
+            self.flush_patients()
+
+    def add_treatment(self, row, fields):
+        patient_ref = fields.get("patient_id") or fields.get("patient_external_id")
+        if patient_ref is None:
+            self.fail(row, ["patient_id: give patient_id or patient_external_id"])
+            return
+        try:
+            # The patient id of a patient in this import is only known once it is inserted
+            treatment = TreatmentCreate(**{**fields, "patient_id": str(patient_ref)})
+        except ValidationError as e:
+            self.fail(row, validation_messages(e))
+            return
+        self._treatments.append((row, "patient_id" not in fields, treatment))
+        if len(self._treatments) >= self.chunk_size:
+            self.flush_treatments()
+
+    def _insert(self, table, batch):
+        """
+        Insert (row, values) pairs; returns (row, created record) for the rows stored.
+        """
+        if not batch:
+            return []
+        try:
+            created = self.client.table(table).insert([values for _, values in batch]).execute().data or []
+            # PostgREST returns the inserted rows in the order they were sent
+            return [(row, record) for (row, _), record in zip(batch, created)]
+        except Exception as e:
+            if not is_permanent_error(e):
+                raise StoreUnavailable(batch[0][0], batch[-1][0], e) from e
+        # The statement was rolled back; isolate the rows the database rejects
+        stored = []
+        for row, values in batch:
+            try:
+                response = self.client.table(table).insert(values).execute()
+                stored.append((row, response.data[0]))
+            except Exception as e:
+                if not is_permanent_error(e):
+                    raise StoreUnavailable(row, row, e) from e
+                self.fail(row, [str(e)])
+        return stored
+
+    def flush_patients(self):
+        if not self._patients:
+            return
+        batch, self._patients = self._patients, []
+        external_ids = {row: external_id for row, external_id, _ in batch}
+        self._pending_external_ids.difference_update(external_ids.values())
+        stored = self._insert("patients", [(row, values) for row, _, values in batch])
+        for row, patient in stored:
+            if external_ids[row] is not None:
+                self.id_map[external_ids[row]] = patient["id"]
+            patient_search_index.add(patient)
+        self.patients_created += len(stored)
+        if stored:
+            cohort_stats_cache.invalidate()
+        if self.on_chunk:
+            self.on_chunk(self)
+
+    def flush_treatments(self):
+        self.flush_patients()
+        if not self._treatments:
+            return
+        batch, self._treatments = self._treatments, []
+        resolved = []
+        for row, by_external_id, treatment in batch:
+            if by_external_id:
+                patient_id = self.id_map.get(treatment.patient_id)
+                if patient_id is None:
+                    self.fail(row, [f"patient_external_id: no imported patient {treatment.patient_id!r}"])
+                    continue
+                treatment = treatment.model_copy(update={"patient_id": patient_id})
+            resolved.append((row, treatment_row(treatment)))
+        stored = self._insert("treatments", resolved)
+        for _, treatment in stored:
+            adherence_bitmaps.forget(treatment["patient_id"])
+            reminder_scheduler.add_treatment(treatment)
+        self.treatments_created += len(stored)
+        if self.on_chunk:
+            self.on_chunk(self)
+
+    def finish(self):
+        self.flush_treatments()
+        return self.report()
+
+    def report(self):
+        return {
+            "rows": self.rows,
+            "patients_created": self.patients_created,
+            "treatments_created": self.treatments_created,
+            "failed_rows": self.error_count,
+            "errors": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+            "id_map": self.id_map
+        }
+
+def run_import(text_file, import_format, client=None, chunk_size=IMPORT_CHUNK_SIZE, on_chunk=None):
+    """
+    Import every record of a CSV or JSON file.
+
+    Returns:
+        dict: Row and creation counts, per-row errors and the external id -> patient id map
+    """
+    importer = BulkImporter(client or supabase, chunk_size, on_chunk)
+    try:
+        try:
+            for row, record in iter_import_records(text_file, import_format):
+                importer.add(row, record)
+        except ValueError as e:
+            # Malformed JSON can't be resynchronized; keep what was imported and report where it stopped
+            importer.fail(importer.rows + 1, [f"Unreadable input, import stopped: {e}"])
+        return importer.finish()
+    except StoreUnavailable as e:
+        # Don't retry a chunk that may already be stored; check these rows before importing the rest again
+        importer.fail(e.first_row, [f"Store unavailable, import stopped: {e}"])
+        return importer.report()
+
+@router.post("")
+async def import_records(request: Request, format: Optional[str] = None, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """
+    Import patients and prescriptions from a CSV or JSON (array or JSON Lines) request body.
+
+    Patients may carry an `external_id` from the previous system; prescriptions
+    refer to them with `patient_external_id` (or to existing patients with
+    `patient_id`). The response maps external ids to the created patient ids.
+    """
+    import_format = format or ("csv" if "csv" in request.headers.get("content-type", "") else "json")
+    if import_format not in ("csv", "json"):
+        raise HTTPException(status_code=400, detail="format must be csv or json")
+    if chunk_size < 1:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive")
+
+    # Spool the upload to disk as it arrives, so large files are never held in memory
+    upload = tempfile.TemporaryFile()
+    try:
+        async for chunk in request.stream():
+            upload.write(chunk)
+        upload.seek(0)
+        text_file = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+        report = await asyncio.to_thread(run_import, text_file, import_format, supabase, chunk_size)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importing records: {str(e)}")
+    finally:
+        upload.close()
+
+    # Published back on the event loop; subscriber queues are not thread-safe
+    if report["patients_created"] or report["treatments_created"]:
+        event_broadcaster.publish(
+            "patients_imported",
+            patients_created=report["patients_created"],
+            treatments_created=report["treatments_created"]
+        )
+
+    return success_response(
+        data=report,
+        message=f"Imported {report['patients_created']} patients and {report['treatments_created']} prescriptions"
+    )
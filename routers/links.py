@@ -0,0 +1,109 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import RedirectResponse
+from pydantic import BaseModel
+from typing import Optional
+from database import supabase
+from utils.response import success_response
+from utils.short_links import (
+    LINKS_TABLE, REVOKED, short_link_resolver, create_short_link, revoke_short_link,
+    load_short_link, is_valid_code, short_link_url, dashboard_url
+)
+
+router = APIRouter(prefix="/api/links", tags=["links"])
+# Short URLs written to NFC tags, kept outside /api so they stay compact
+redirect_router = APIRouter(tags=["links"])
+
+class ShortLinkCreate(BaseModel):
+    patient_id: str
+    tag_id: Optional[str] = None
+
+def resolve_code(code: str):
+    """
+    Resolve a short code to a patient id, raising 404 for unknown and 410 for revoked codes.
+    """
+    if not is_valid_code(code):
+        raise HTTPException(status_code=404, detail="Unknown link")
+    try:
+        patient_id, reason = short_link_resolver.resolve(code, lambda c: load_short_link(supabase, c))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error resolving link: {str(e)}")
+    if reason == REVOKED:
+        raise HTTPException(status_code=410, detail="This link has been revoked")
+    if patient_id is None:
+        raise HTTPException(status_code=404, detail="Unknown link")
+    return patient_id
+
+@router.post("/new")
+async def create_link(link_data: ShortLinkCreate):
+    """
+    Issue a short code for a patient's dashboard, e.g. for a new NFC tag.
+    """
+    try:
+        link = create_short_link(supabase, link_data.patient_id, tag_id=link_data.tag_id)
+        short_link_resolver.remember(link["code"], link_data.patient_id)
+        return success_response(
+            data={**link, "url": short_link_url(link["code"])},
+            message="Short link created successfully"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating short link: {str(e)}")
+
+@router.get("/patient/{patient_id}")
+async def get_patient_links(patient_id: str):
+    """
+    List the short codes issued for a patient, including revoked ones.
+    """
+    try:
+        response = supabase.table(LINKS_TABLE).select("*").eq("patient_id", patient_id).execute()
+        links = [{**link, "url": short_link_url(link["code"])} for link in response.data or []]
+        return success_response(
+            data={"links": links},
+            message="Short links retrieved successfully"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching short links: {str(e)}")
+
+@router.post("/{code}/revoke")
+async def revoke_link(code: str):
+    """
+    Revoke a single code, e.g. for a lost tag. Other tags for the patient keep working.
+    """
+    try:
+        link = revoke_short_link(supabase, code)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error revoking short link: {str(e)}")
+    if not link:
+        raise HTTPException(status_code=404, detail="Unknown link")
+    short_link_resolver.revoke(code)
+    return success_response(
+        data=link,
+        message="Short link revoked successfully"
+    )
+
+@router.get("/metrics")
+async def get_link_metrics():
+    """
+    Get short link resolver cache metrics.
+    """
+    return success_response(
+        data=short_link_resolver.metrics(),
+        message="Short link metrics retrieved successfully"
+    )
+
+@router.get("/resolve/{code}")
+async def resolve_link(code: str):
+    """
+    Resolve a short code to the patient id and dashboard URL.
+    """
+    patient_id = resolve_code(code)
+    return success_response(
+        data={"code": code, "patient_id": patient_id, "dashboard_url": dashboard_url(patient_id)},
+        message="Short link resolved successfully"
+    )
+
+@redirect_router.get("/p/{code}", include_in_schema=False)
+async def follow_link(code: str):
+    """
+    Redirect a tapped tag to the patient's dashboard.
+    """
+    return RedirectResponse(dashboard_url(resolve_code(code)), status_code=302)
@@ -1,14 +1,56 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Response
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from database import supabase
-from utils.response import success_response, error_response
+from utils.response import success_response, error_response, fast_success_response
 from utils.adherence import calculate_adherence, count_missed_doses
+from utils.rolling_adherence import rolling_adherence
+from utils.feature_store import behavior_features
+from utils.adherence_bitmaps import adherence_bitmaps
+from utils.dose_rollups import fetch_patient_history, fetch_rollups
+from utils.reminders import reminder_scheduler
+from utils.cohort_stats import cohort_stats_cache
+from utils.ttl_cache import TTLCache
+from utils.dose_queue import claim_dose_queue
+from utils.http_clients import is_permanent_error
+from utils.event_bus import event_broadcaster
+from utils.patient_locks import patient_locks
+from utils.admission import admission_controller
 from ai_model import predict_risk, generate_ai_feedback
+import asyncio
+import logging
+import os
+import time
 import uuid
 from datetime import datetime
 
 router = APIRouter(prefix="/api", tags=["logs"])
+logger = logging.getLogger(__name__)
+
+# Responses of recent dose logs, replayed for repeated Idempotency-Keys and
+# for identical doses (patient, medication, date, status) within the dedupe window
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+DOSE_DEDUPE_WINDOW_SECONDS = float(os.getenv("DOSE_DEDUPE_WINDOW_SECONDS", "10"))
+
+idempotency_store = TTLCache(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL_SECONDS)
+dose_dedupe_store = TTLCache(IDEMPOTENCY_MAX_KEYS, DOSE_DEDUPE_WINDOW_SECONDS)
+# (marker, (dose key, future of the response)) of doses being logged, by ("key", Idempotency-Key) and ("dose", dose key)
+in_flight_doses = {}
+
+# Optional write-behind mode: doses are appended to a local durable queue,
+# acknowledged at once and inserted in batches by a background flusher
+DOSE_WRITE_BEHIND = os.getenv("DOSE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+DOSE_QUEUE_PATH = os.getenv("DOSE_QUEUE_PATH", "dose_queue.log")
+DOSE_FLUSH_BATCH_SIZE = int(os.getenv("DOSE_FLUSH_BATCH_SIZE", "200"))
+DOSE_FLUSH_INTERVAL_SECONDS = float(os.getenv("DOSE_FLUSH_INTERVAL_SECONDS", "0.5"))
+DOSE_FLUSH_MAX_BACKOFF_SECONDS = float(os.getenv("DOSE_FLUSH_MAX_BACKOFF_SECONDS", "30"))
+
+# Each worker process claims its own queue file (dose_queue.log, dose_queue.1.log, ...)
+dose_queue = claim_dose_queue(DOSE_QUEUE_PATH) if DOSE_WRITE_BEHIND else None
+
+# Metric recomputations per dose when other server processes keep logging doses for the same patient
+METRICS_MAX_ATTEMPTS = int(os.getenv("METRICS_MAX_ATTEMPTS", "3"))
 
 class DoseLogCreate(BaseModel):
     patient_id: str
@@ -16,77 +58,393 @@ class DoseLogCreate(BaseModel):
     status: str  # Taken, Missed, Inconsistent
     date: Optional[str] = None  # ISO format date, defaults to today if not provided
 
+class DoseLogListData(BaseModel):
+    dose_logs: List[Dict[str, Any]]
+    monthly_rollups: List[Dict[str, Any]] = []
+
+class DoseLogListResponse(BaseModel):
+    success: bool
+    message: str
+    data: DoseLogListData
+
+def find_replayed_dose(dose_key, idempotency_key=None):
+    """
+    Get the stored response for a repeated dose log, a future of it while the
+    original request is still logging the dose, or None.
+    """
+    if idempotency_key:
+        stored = in_flight_doses.get(("key", idempotency_key)) or idempotency_store.get(idempotency_key)
+        if stored is not None:
+            stored_dose_key, result = stored
+            if stored_dose_key != dose_key:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different dose")
+            return result
+    if DOSE_DEDUPE_WINDOW_SECONDS > 0:
+        in_flight = in_flight_doses.get(("dose", dose_key))
+        return in_flight[1] if in_flight else dose_dedupe_store.get(dose_key)
+    return None
+
+def reserve_dose(dose_key, idempotency_key=None):
+    """
+    Mark a dose as being logged, so repeats arriving meanwhile wait for its response.
+    
+    Returns:
+        asyncio.Future: Resolved with the response, or None if logging fails
+    """
+    pending = asyncio.get_running_loop().create_future()
+    if idempotency_key:
+        in_flight_doses[("key", idempotency_key)] = (dose_key, pending)
+    if DOSE_DEDUPE_WINDOW_SECONDS > 0:
+        in_flight_doses[("dose", dose_key)] = (dose_key, pending)
+    return pending
+
+def release_dose(dose_key, idempotency_key, pending, result=None):
+    """
+    Drop a dose's in-flight markers and hand its response (None on failure) to waiting repeats.
+    """
+    for marker in (("key", idempotency_key), ("dose", dose_key)):
+        if in_flight_doses.get(marker, (None, None))[1] is pending:
+            del in_flight_doses[marker]
+    if not pending.done():
+        pending.set_result(result)
+
+def remember_dose(dose_key, result, idempotency_key=None, pending=None):
+    """
+    Store the response of a logged dose for replay.
+    """
+    if idempotency_key:
+        idempotency_store.set(idempotency_key, (dose_key, result))
+    if DOSE_DEDUPE_WINDOW_SECONDS > 0:
+        dose_dedupe_store.set(dose_key, result)
+    if pending is not None:
+        release_dose(dose_key, idempotency_key, pending, result)
+
+def count_patient_dose_logs(patient_id):
+    response = supabase.table("dose_logs").select("id", count="exact").eq("patient_id", patient_id).limit(1).execute()
+    return response.count
+
+def update_patient_metrics(patient_id, dose_logs):
+    """
+    Recalculate adherence and risk for a patient and store them on the patient record.
+    
+    Returns:
+        tuple: (adherence_percent, rolling adherence windows, risk_label)
+    """
+    # Calculate adherence metrics
+    adherence_percent = calculate_adherence(dose_logs)
+    missed_doses = count_missed_doses(dose_logs)
+    windows = rolling_adherence.windows(patient_id)
+    
+    # Predict risk using ML model
+    risk_label = predict_risk(
+        adherence_percent, missed_doses, windows["7d"], windows["30d"],
+        behavior=behavior_features.features(patient_id)
+    )
+    
+    # Update patient record with new metrics (only columns that exist)
+    update_data = {
+        "adherence_percent": adherence_percent,
+        "risk_label": risk_label
+    }
+    
+    supabase.table("patients").update(update_data).eq("id", patient_id).execute()
+    cohort_stats_cache.invalidate()
+    
+    return adherence_percent, windows, risk_label
+
+def refresh_patient_metrics(patient_id, new_dose=None):
+    """
+    Recompute a patient's metrics from their full dose history (raw logs and
+    monthly rollups of compacted ones) and store them.
+    
+    Callers hold the patient's lock, so within this process metrics are stored
+    in log order. Another server process may still store metrics computed from
+    an older snapshot after ours; the dose log count is checked after writing
+    and the metrics are recomputed if doses arrived in between. The last writer
+    then always saw every dose.
+    
+    Args:
+        new_dose: (medication, status, date) just inserted, recorded into the
+            rolling windows, behavioral features and adherence calendars
+            incrementally instead of reloading them
+    
+    Returns:
+        tuple: (adherence_percent, rolling adherence windows, risk_label)
+    """
+    for attempt in range(METRICS_MAX_ATTEMPTS):
+        dose_logs, raw_count = fetch_patient_history(supabase, patient_id)
+        incremental = attempt == 0 and new_dose
+        if incremental and rolling_adherence.is_loaded(patient_id):
+            rolling_adherence.record(patient_id, *new_dose)
+        else:
+            rolling_adherence.load(patient_id, dose_logs)
+        # Out-of-order doses can't be applied incrementally and reload the patient
+        if not (incremental and behavior_features.record(patient_id, *new_dose)):
+            behavior_features.load(patient_id, dose_logs)
+        # Calendars also need the treatments; drop them to be reloaded on the next read
+        if incremental:
+            adherence_bitmaps.record(patient_id, *new_dose)
+        else:
+            adherence_bitmaps.forget(patient_id)
+        
+        metrics = update_patient_metrics(patient_id, dose_logs)
+        if count_patient_dose_logs(patient_id) == raw_count:
+            break
+    return metrics
+
+def insert_dose_log(dose_data, log_date):
+    insert_response = supabase.table("dose_logs").insert({
+        "patient_id": dose_data.patient_id,
+        "medication": dose_data.medication,
+        "status": dose_data.status,
+        "date": log_date  # Include date in log
+    }).execute()
+    return insert_response.data[0] if insert_response.data else None
+
+async def queue_dose(dose_data, log_date):
+    """
+    Append a dose to the write-behind queue and build its acknowledgement.
+    """
+    entry_id = str(uuid.uuid4())
+    # The append waits for fsync, so keep it off the event loop
+    await asyncio.to_thread(dose_queue.append, {
+        "id": entry_id,
+        "patient_id": dose_data.patient_id,
+        "medication": dose_data.medication,
+        "status": dose_data.status,
+        "date": log_date
+    })
+    
+    # Keep rolling windows current until the flusher reloads them from the store
+    windows = None
+    if rolling_adherence.is_loaded(dose_data.patient_id):
+        rolling_adherence.record(dose_data.patient_id, dose_data.medication, dose_data.status, log_date)
+        windows = rolling_adherence.windows(dose_data.patient_id)
+    adherence_bitmaps.record(dose_data.patient_id, dose_data.medication, dose_data.status, log_date)
+    reminder_scheduler.dose_logged(dose_data.patient_id, dose_data.medication, log_date)
+    
+    event_broadcaster.publish(
+        "dose_queued",
+        patient_id=dose_data.patient_id,
+        medication=dose_data.medication,
+        status=dose_data.status,
+        date=log_date
+    )
+    
+    return success_response(
+        data={
+            "dose_log_id": entry_id,
+            "queued": True,
+            "rolling_adherence": windows
+        },
+        message="Dose accepted"
+    )
+
+def insert_dose_rows(rows):
+    # Upsert on the queue-assigned id so retried batches never insert duplicates
+    supabase.table("dose_logs").upsert(rows, on_conflict="id", ignore_duplicates=True).execute()
+
+async def flush_dose_queue():
+    """
+    Insert the oldest batch of queued doses and refresh the affected patients.
+    
+    Batches preserve queue order, so doses of a patient are stored in the order
+    they were accepted. Transient errors propagate and leave the batch queued;
+    rows failing with permanent errors are moved to the dead-letter file.
+    
+    Returns:
+        int: Number of queue entries removed
+    """
+    batch = dose_queue.peek_batch(DOSE_FLUSH_BATCH_SIZE)
+    if not batch:
+        return 0
+    
+    rows = [
+        {key: entry[key] for key in ("id", "patient_id", "medication", "status", "date")}
+        for entry in batch
+    ]
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(insert_dose_rows, rows)
+        dose_queue.commit(len(rows), time.perf_counter() - started)
+    except Exception as e:
+        dose_queue.flush_failures += 1
+        if not is_permanent_error(e):
+            raise
+        # Isolate the bad rows one at a time, still in queue order
+        for row in rows:
+            try:
+                await asyncio.to_thread(insert_dose_rows, [row])
+                dose_queue.commit(1, time.perf_counter() - started)
+            except Exception as row_error:
+                if not is_permanent_error(row_error):
+                    raise
+                dose_queue.dead_letter(1, str(row_error))
+    
+    # Recalculate metrics once per patient in the batch
+    for patient_id in dict.fromkeys(row["patient_id"] for row in rows):
+        try:
+            async with patient_locks.hold(patient_id):
+                adherence_percent, windows, risk_label = await asyncio.to_thread(refresh_patient_metrics, patient_id)
+            event_broadcaster.publish(
+                "patient_metrics_updated",
+                patient_id=patient_id,
+                adherence_percent=adherence_percent,
+                rolling_adherence=windows,
+                risk_label=risk_label
+            )
+        except Exception:
+            logger.exception("Failed to refresh metrics for patient %s", patient_id)
+    
+    return len(rows)
+
+async def run_dose_flusher():
+    """
+    Background task flushing the write-behind queue, backing off on failures.
+    """
+    failures = 0
+    while True:
+        try:
+            flushed = await flush_dose_queue()
+            failures = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            failures += 1
+            flushed = 0
+            logger.warning("Dose queue flush failed (attempt %d)", failures, exc_info=True)
+        
+        if failures:
+            await asyncio.sleep(min(DOSE_FLUSH_INTERVAL_SECONDS * 2 ** failures, DOSE_FLUSH_MAX_BACKOFF_SECONDS))
+        elif not flushed:
+            await asyncio.sleep(DOSE_FLUSH_INTERVAL_SECONDS)
+
+async def drain_dose_queue():
+    """
+    Flush queued doses until the queue is empty or the store fails (used on shutdown).
+    """
+    try:
+        while len(dose_queue) and await flush_dose_queue():
+            pass
+    except Exception:
+        logger.exception("Dose queue not fully drained, %d entries kept on disk", len(dose_queue))
+
 @router.post("/log_dose")
-async def log_dose(dose_data: DoseLogCreate):
+async def log_dose(dose_data: DoseLogCreate, response: Response, idempotency_key: Optional[str] = Header(None)):
     """
     Log a medication dose and update patient adherence metrics.
+    
+    Repeats with the same Idempotency-Key header, or of the same dose within the
+    dedupe window, return the original response without logging again.
     """
+    # Use provided date or default to today
+    log_date = dose_data.date or datetime.now().strftime("%Y-%m-%d")
+    dose_key = (dose_data.patient_id, dose_data.medication, log_date, dose_data.status)
+    
+    pending = None
     try:
-        # Use provided date or default to today
-        log_date = dose_data.date or datetime.now().strftime("%Y-%m-%d")
-        
-        # Insert dose log into Supabase
-        response = supabase.table("dose_logs").insert({
-            "patient_id": dose_data.patient_id,
-            "medication": dose_data.medication,
-            "status": dose_data.status,
-            "date": log_date  # Include date in log
-        }).execute()
-        
-        # Get the inserted dose log
-        dose_log = response.data[0] if response.data else None
-        
-        if not dose_log:
-            raise HTTPException(status_code=500, detail="Failed to log dose")
-        
-        # Fetch all dose logs for this patient to recalculate adherence
-        logs_response = supabase.table("dose_logs").select("*").eq("patient_id", dose_data.patient_id).execute()
-        dose_logs = logs_response.data if logs_response.data else []
+        # Doses of one patient are inserted and recalculated one at a time, so a
+        # slower request can't overwrite newer metrics; other patients run in parallel
+        async with patient_locks.hold(dose_data.patient_id):
+            # Checked and reserved under the lock, so a repeat sent while this dose
+            # is being logged waits for its response instead of logging it again
+            replayed = find_replayed_dose(dose_key, idempotency_key)
+            if replayed is None:
+                pending = reserve_dose(dose_key, idempotency_key)
+                
+                # In write-behind mode acknowledge once the dose is in the durable queue
+                if dose_queue is not None:
+                    result = await queue_dose(dose_data, log_date)
+                else:
+                    # Insert dose log into Supabase
+                    dose_log = await asyncio.to_thread(insert_dose_log, dose_data, log_date)
+                    
+                    if not dose_log:
+                        raise HTTPException(status_code=500, detail="Failed to log dose")
+                    # The dose's reminder (if still pending today) is no longer sent
+                    reminder_scheduler.dose_logged(dose_data.patient_id, dose_data.medication, log_date)
+                    
+                    # Recalculate adherence from all dose logs (rolling windows are updated incrementally)
+                    adherence_percent, windows, risk_label = await asyncio.to_thread(
+                        refresh_patient_metrics,
+                        dose_data.patient_id,
+                        (dose_data.medication, dose_data.status, log_date)
+                    )
         
-        # Calculate adherence metrics
-        adherence_percent = calculate_adherence(dose_logs)
-        missed_doses = count_missed_doses(dose_logs)
+        if pending is None:
+            if isinstance(replayed, asyncio.Future):
+                replayed = await asyncio.shield(replayed)
+                if replayed is None:
+                    raise HTTPException(status_code=409, detail="The original request for this dose failed, retry it")
+            response.headers["Idempotent-Replayed"] = "true"
+            return replayed
         
-        # Predict risk using ML model
-        risk_label = predict_risk(adherence_percent, missed_doses)
+        if dose_queue is None:
+            # Generate AI feedback, skipped while dose requests are queueing for a slot
+            degraded = admission_controller.should_degrade("dose_write")
+            feedback_message = None if degraded else await asyncio.to_thread(generate_ai_feedback, adherence_percent, risk_label)
+            
+            event_broadcaster.publish(
+                "dose_logged",
+                patient_id=dose_data.patient_id,
+                medication=dose_data.medication,
+                status=dose_data.status,
+                date=log_date,
+                adherence_percent=adherence_percent,
+                rolling_adherence=windows,
+                risk_label=risk_label
+            )
+            
+            result = success_response(
+                data={
+                    "dose_log_id": dose_log["id"],
+                    "adherence_percent": adherence_percent,
+                    "rolling_adherence": windows,
+                    "risk_label": risk_label,
+                    "feedback_message": feedback_message,
+                    "degraded": degraded
+                },
+                message="Dose logged successfully"
+            )
+        remember_dose(dose_key, result, idempotency_key, pending)
         
-        # Generate AI feedback
-        feedback_message = generate_ai_feedback(adherence_percent, risk_label)
-        
-        # Update patient record with new metrics (only columns that exist)
-        update_data = {
-            "adherence_percent": adherence_percent,
-            "risk_label": risk_label
-        }
-        
-        supabase.table("patients").update(update_data).eq("id", dose_data.patient_id).execute()
-        
-        return success_response(
-            data={
-                "dose_log_id": dose_log["id"],
-                "adherence_percent": adherence_percent,
-                "risk_label": risk_label,
-                "feedback_message": feedback_message
-            },
-            message="Dose logged successfully"
-        )
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error logging dose: {str(e)}")
+    finally:
+        # On failure, let waiting repeats know the dose was not logged
+        if pending is not None:
+            release_dose(dose_key, idempotency_key, pending)
+
+@router.get("/dose_queue/metrics")
+async def get_dose_queue_metrics():
+    """
+    Get write-behind queue depth and flush latency metrics.
+    """
+    return success_response(
+        data={"enabled": dose_queue is not None, **(dose_queue.metrics() if dose_queue is not None else {})},
+        message="Dose queue metrics retrieved successfully"
+    )
 
 # Add endpoint to fetch dose logs by patient ID
-@router.get("/dose_logs/patient/{patient_id}")
+@router.get("/dose_logs/patient/{patient_id}", responses={200: {"model": DoseLogListResponse}})
 async def get_patient_dose_logs(patient_id: str):
     """
-    Get all dose logs for a specific patient.
+    Get all dose logs for a specific patient: the raw logs kept for the retention
+    period and monthly rollups of older ones.
     """
     try:
         # Fetch dose logs for this patient
         logs_response = supabase.table("dose_logs").select("*").eq("patient_id", patient_id).execute()
         dose_logs = logs_response.data if logs_response.data else []
+        rollups = fetch_rollups(supabase, [patient_id]).get(patient_id, [])
         
-        return success_response(
-            data={"dose_logs": dose_logs},
+        # Rows are JSON-native, so serialize directly and skip jsonable_encoder
+        return fast_success_response(
+            data={"dose_logs": dose_logs, "monthly_rollups": rollups},
             message="Dose logs retrieved successfully"
         )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching dose logs: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error fetching dose logs: {str(e)}")
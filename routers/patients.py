@@ -1,10 +1,35 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 from database import supabase
-from utils.response import success_response, error_response
+from utils.response import success_response, error_response, fast_success_response
+from utils.rolling_adherence import HORIZON_DAYS, rolling_adherence
+from utils.feature_store import behavior_features
+from utils.adherence_bitmaps import adherence_bitmaps
+from utils.dose_rollups import ROLLUPS_TABLE, combine_history, fetch_rollups
+from utils.cohort_report import fetch_all_patients
+from utils.cohort_stats import cohort_stats_cache
+from utils.patient_search import patient_search_index
+from utils.event_bus import event_broadcaster
+from utils.etag import patient_validators, is_not_modified
+from utils.short_links import LINKS_TABLE, short_link_resolver
+from utils.reminders import reminder_scheduler
 
 router = APIRouter(prefix="/api/patient", tags=["patients"])
+logger = logging.getLogger(__name__)
+
+# Patients preloaded at startup: the most recently active within the last days
+WARMUP_RECENT_PATIENTS = int(os.getenv("WARMUP_RECENT_PATIENTS", "200"))
+WARMUP_RECENT_DAYS = int(os.getenv("WARMUP_RECENT_DAYS", "7"))
+# Patient ids per dose log request when seeding rolling windows, to keep the URL short
+SEED_CHUNK_SIZE = 100
+
+# Search index build running in a worker thread, shared by the searches waiting for it
+search_index_build = None
 
 class PatientCreate(BaseModel):
     name: str
@@ -19,6 +44,24 @@ class PatientResponse(BaseModel):
     gender: str
     condition: str
 
+class PatientListItem(BaseModel):
+    id: str
+    name: str
+    age: int
+    gender: str
+    condition: str
+    adherence_percent: Optional[float] = 0
+    rolling_adherence: Dict[str, Optional[float]] = {}  # "7d", "30d", "90d"
+    risk_label: Optional[str] = "Unknown"
+
+class PatientListData(BaseModel):
+    patients: List[PatientListItem]
+
+class PatientListResponse(BaseModel):
+    success: bool
+    message: str
+    data: PatientListData
+
 class TreatmentResponse(BaseModel):
     id: str
     patient_id: str
@@ -46,6 +89,17 @@ async def create_patient(patient_data: PatientCreate):
         
         if not patient:
             raise HTTPException(status_code=500, detail="Failed to create patient")
+        
+        cohort_stats_cache.invalidate()
+        patient_search_index.add(patient)
+        event_broadcaster.publish(
+            "patient_created",
+            patient_id=patient["id"],
+            name=patient["name"],
+            age=patient["age"],
+            gender=patient["gender"],
+            condition=patient["condition"]
+        )
             
         return success_response(
             data={
@@ -60,6 +114,14 @@ async def create_patient(patient_data: PatientCreate):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating patient: {str(e)}")
 
+def forget_short_links(*patient_ids: str):
+    """
+    Delete the short links of one or more patients and drop them from the resolver cache.
+    """
+    response = supabase.table(LINKS_TABLE).delete().in_("patient_id", list(patient_ids)).execute()
+    for link in response.data or []:
+        short_link_resolver.revoke(link["code"])
+
 @router.delete("/{patient_id}")
 async def delete_patient(patient_id: str):
     """
@@ -69,14 +131,26 @@ async def delete_patient(patient_id: str):
         # First delete all treatments associated with this patient
         supabase.table("treatments").delete().eq("patient_id", patient_id).execute()
         
-        # Then delete all dose logs associated with this patient
+        # Then delete all dose logs associated with this patient, and rollups of compacted ones
         supabase.table("dose_logs").delete().eq("patient_id", patient_id).execute()
+        supabase.table(ROLLUPS_TABLE).delete().eq("patient_id", patient_id).execute()
+        
+        # Stop the patient's NFC short links from resolving
+        forget_short_links(patient_id)
         
         # Finally delete the patient record
         response = supabase.table("patients").delete().eq("id", patient_id).execute()
+        rolling_adherence.forget(patient_id)
+        behavior_features.forget(patient_id)
+        adherence_bitmaps.forget(patient_id)
+        reminder_scheduler.forget_patient(patient_id)
+        patient_search_index.remove(patient_id)
+        cohort_stats_cache.invalidate()
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Patient not found")
+        
+        event_broadcaster.publish("patient_deleted", patient_id=patient_id)
             
         return success_response(
             data={"id": patient_id},
@@ -95,19 +169,27 @@ async def delete_patient_by_name(patient_name: str):
         patient_response = supabase.table("patients").select("id").eq("name", patient_name).execute()
         patients_to_delete = patient_response.data if patient_response.data else []
         
-        deleted_count = 0
-        for patient in patients_to_delete:
-            patient_id = patient["id"]
-            
-            # Delete all treatments associated with this patient
-            supabase.table("treatments").delete().eq("patient_id", patient_id).execute()
-            
-            # Delete all dose logs associated with this patient
-            supabase.table("dose_logs").delete().eq("patient_id", patient_id).execute()
-            
-            # Delete the patient record
-            supabase.table("patients").delete().eq("id", patient_id).execute()
-            deleted_count += 1
+        patient_ids = [patient["id"] for patient in patients_to_delete]
+        deleted_count = len(patient_ids)
+        
+        # One statement per table for all matching patients, instead of one per patient
+        if patient_ids:
+            supabase.table("treatments").delete().in_("patient_id", patient_ids).execute()
+            supabase.table("dose_logs").delete().in_("patient_id", patient_ids).execute()
+            supabase.table(ROLLUPS_TABLE).delete().in_("patient_id", patient_ids).execute()
+            forget_short_links(*patient_ids)
+            supabase.table("patients").delete().in_("id", patient_ids).execute()
+        
+        for patient_id in patient_ids:
+            rolling_adherence.forget(patient_id)
+            behavior_features.forget(patient_id)
+            adherence_bitmaps.forget(patient_id)
+            reminder_scheduler.forget_patient(patient_id)
+            patient_search_index.remove(patient_id)
+            event_broadcaster.publish("patient_deleted", patient_id=patient_id)
+        
+        if deleted_count:
+            cohort_stats_cache.invalidate()
             
         return success_response(
             data={"deleted_count": deleted_count},
@@ -116,15 +198,52 @@ async def delete_patient_by_name(patient_name: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting patients: {str(e)}")
 
-@router.get("/all")
+def seed_rolling_adherence(patient_ids, page_size=1000, versions=None):
+    """
+    Load the rolling adherence windows of patients from their dose logs of the last HORIZON_DAYS.
+    
+    Patient ids are sent in chunks so the request URL stays short, and each
+    chunk is paged, so no patient is loaded with a history cut off by the row cap.
+    `versions` maps patient ids to the stored version of the patient rows, read
+    before the logs.
+    """
+    since = (datetime.now() - timedelta(days=HORIZON_DAYS)).strftime("%Y-%m-%d")
+    logs_by_patient = {patient_id: [] for patient_id in patient_ids}
+    for first in range(0, len(patient_ids), SEED_CHUNK_SIZE):
+        chunk = patient_ids[first:first + SEED_CHUNK_SIZE]
+        start = 0
+        while True:
+            page = supabase.table("dose_logs").select("patient_id, medication, status, date").in_(
+                "patient_id", chunk
+            ).gte("date", since).order("id").range(start, start + page_size - 1).execute().data or []
+            for log in page:
+                logs_by_patient[log["patient_id"]].append(log)
+            if len(page) < page_size:
+                break
+            start += page_size
+    versions = versions or {}
+    for patient_id, dose_logs in logs_by_patient.items():
+        rolling_adherence.load(patient_id, dose_logs, versions.get(patient_id))
+
+@router.get("/all", responses={200: {"model": PatientListResponse}})
 async def get_all_patients():
     """
     Get all patients.
     """
     try:
-        # Fetch all patients from Supabase
-        response = supabase.table("patients").select("*").execute()
-        patients_data = response.data if response.data else []
+        # Fetch all patients from Supabase, a page at a time
+        patients_data = fetch_all_patients(supabase, columns="*")
+        
+        # Seed rolling-window adherence for patients not tracked yet, or written to since
+        # (through any worker: every write bumps the stored patient version). Without
+        # the version column writes elsewhere can't be told apart, and rereading the whole
+        # cohort's dose logs on every list would not scale, so only untracked patients are seeded
+        versions = {p["id"]: p.get("version") for p in patients_data}
+        stale_ids = [patient_id for patient_id, version in versions.items()
+                     if not (rolling_adherence.is_current(patient_id, version)
+                             or version is None and rolling_adherence.is_loaded(patient_id))]
+        if stale_ids:
+            seed_rolling_adherence(stale_ids, versions=versions)
         
         # Format the response
         patients_list = []
@@ -136,19 +255,121 @@ async def get_all_patients():
                 "gender": patient["gender"],
                 "condition": patient["condition"],
                 "adherence_percent": patient.get("adherence_percent", 0),
+                "rolling_adherence": rolling_adherence.windows(patient["id"]),
                 "risk_label": patient.get("risk_label", "Unknown")
             }
             patients_list.append(patient_info)
         
-        return success_response(
+        # Rows are JSON-native, so serialize directly and skip jsonable_encoder
+        return fast_success_response(
             data={"patients": patients_list},
             message="Patients retrieved successfully"
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching patients: {str(e)}")
 
+def warm_recent_patients(days=WARMUP_RECENT_DAYS, limit=WARMUP_RECENT_PATIENTS, page_size=1000):
+    """
+    Load rolling adherence, behavioral features and adherence calendars of the patients
+    who logged doses most recently, so their first summary or dose log needs no history reload.
+    
+    Returns:
+        int: Number of patients loaded
+    """
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    recent = supabase.table("dose_logs").select("patient_id").gte("date", since).order(
+        "date", desc=True
+    ).limit(limit * 20).execute()
+    patient_ids = list(dict.fromkeys(log["patient_id"] for log in recent.data or []))[:limit]
+    if not patient_ids:
+        return 0
+    
+    # Versions first, so a write made while loading only makes them older
+    # ("*" still works without the version column; patients are then never current)
+    versions = {
+        patient["id"]: patient.get("version")
+        for patient in supabase.table("patients").select("*").in_("id", patient_ids).execute().data or []
+    }
+    logs_by_patient = {patient_id: [] for patient_id in patient_ids}
+    start = 0
+    while True:
+        page = supabase.table("dose_logs").select("*").in_("patient_id", patient_ids).order("id").range(
+            start, start + page_size - 1
+        ).execute().data or []
+        for log in page:
+            logs_by_patient[log["patient_id"]].append(log)
+        if len(page) < page_size:
+            break
+        start += page_size
+    # After the raw logs, so logs compacted in between are counted once (see combine_history)
+    rollups_by_patient = fetch_rollups(supabase, patient_ids)
+    treatments_by_patient = {patient_id: [] for patient_id in patient_ids}
+    treatments = supabase.table("treatments").select("*").in_("patient_id", patient_ids).execute()
+    for treatment in treatments.data or []:
+        treatments_by_patient[treatment["patient_id"]].append(treatment)
+    
+    for patient_id, raw_logs in logs_by_patient.items():
+        dose_logs = combine_history(raw_logs, rollups_by_patient.get(patient_id, []))
+        rolling_adherence.load(patient_id, dose_logs, versions.get(patient_id))
+        behavior_features.load(patient_id, dose_logs)
+        adherence_bitmaps.load(patient_id, dose_logs, treatments_by_patient[patient_id], versions.get(patient_id))
+    return len(patient_ids)
+
+def build_search_index():
+    """
+    Build the in-memory patient search index from the patients table, a page at a time.
+    """
+    patient_search_index.begin_build()
+    patient_search_index.build(fetch_all_patients(supabase, columns="id, name, condition"))
+
+def start_search_index_build():
+    """
+    Build the search index in a worker thread, unless a build is already running.
+
+    Returns:
+        asyncio.Future: The build in flight
+    """
+    global search_index_build
+    if search_index_build is None:
+        search_index_build = asyncio.ensure_future(asyncio.to_thread(build_search_index))
+        search_index_build.add_done_callback(search_index_built)
+    return search_index_build
+
+def search_index_built(build):
+    global search_index_build
+    if search_index_build is build:
+        search_index_build = None
+    if not build.cancelled() and build.exception() is not None:
+        logger.error("Patient search index build failed", exc_info=build.exception())
+
+@router.get("/search")
+async def search_patients(q: str = "", limit: int = 20, fuzzy: bool = True):
+    """
+    Search patients by name or condition prefix, tolerating small typos.
+
+    Each worker keeps its own index. Patients created or deleted through this
+    worker are applied at once; changes through other workers show up when the
+    index is rebuilt in the background, SEARCH_INDEX_MAX_AGE_SECONDS after the last build.
+    """
+    try:
+        if not patient_search_index.built:
+            # A search arriving before the warm-up built the index waits for one shared build
+            await asyncio.shield(start_search_index_build())
+        elif patient_search_index.is_stale():
+            # Answer from the current index meanwhile
+            start_search_index_build()
+        
+        results = patient_search_index.search(q, limit=max(1, min(limit, 100)), fuzzy=fuzzy)
+        
+        return success_response(
+            data={"patients": results},
+            message="Patients retrieved successfully"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching patients: {str(e)}")
+
 @router.get("/{patient_id}")
-async def get_patient_with_treatments(patient_id: str):
+async def get_patient_with_treatments(patient_id: str, request: Request, response: Response):
     """
     Get patient details along with their prescriptions.
     """
@@ -160,6 +381,12 @@ async def get_patient_with_treatments(patient_id: str):
         if not patient_data:
             raise HTTPException(status_code=404, detail="Patient not found")
         
+        # Answer conditional requests from the stored patient version before reading treatments
+        validators = patient_validators("patient", patient_data)
+        if is_not_modified(request.headers, validators):
+            return Response(status_code=304, headers=validators)
+        response.headers.update(validators or {})
+        
         # Fetch treatments for this patient using the new endpoint
         treatments_response = supabase.table("treatments").select("*").eq("patient_id", patient_id).execute()
         treatments_data = treatments_response.data if treatments_response.data else []
@@ -0,0 +1,148 @@
+from fastapi import APIRouter
+from database import supabase
+from utils.response import success_response
+from utils.reminders import (
+    reminder_scheduler, REMINDER_TICK_SECONDS, REMINDERS_ENABLED,
+    REMINDER_LOCK_PATH, REMINDER_STANDBY_SECONDS, REMINDER_RELOAD_SECONDS
+)
+from utils.file_lock import FileLock
+from utils.warmup import WARMUP_RETRY_SECONDS
+from collections import Counter
+from datetime import datetime
+import asyncio
+import time
+
+router = APIRouter(prefix="/api/reminders", tags=["reminders"])
+
+# Patient ids per store query when checking due reminders
+CONFIRM_CHUNK_SIZE = 100
+
+def fetch_all_rows(build_query, page_size=1000):
+    rows, start = [], 0
+    while True:
+        page = build_query().range(start, start + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        start += page_size
+
+def load_reminders(now=None):
+    """
+    Schedule the reminders of every treatment, seeding the doses already logged today.
+
+    Returns:
+        int: Number of scheduled medications
+    """
+    treatments = fetch_all_rows(
+        lambda: supabase.table("treatments").select("id, patient_id, medication, dosage, frequency, start_date").order("id")
+    )
+    today = datetime.now().strftime("%Y-%m-%d")
+    dose_logs = fetch_all_rows(
+        lambda: supabase.table("dose_logs").select("patient_id, medication, date").eq("date", today).order("id")
+    )
+    reminder_scheduler.load(treatments, dose_logs, now)
+    return len(reminder_scheduler)
+
+def fetch_logged_doses(due):
+    """
+    Doses logged on the due reminders' days, through any worker, and which of their patients still exist.
+
+    Returns:
+        tuple: (dose counts by (patient_id, medication, date), set of existing patient ids)
+    """
+    patient_ids = sorted({reminder["patient_id"] for reminder in due})
+    days = sorted({reminder["due_at"][:10] for reminder in due})
+    logged, existing = Counter(), set()
+    for start in range(0, len(patient_ids), CONFIRM_CHUNK_SIZE):
+        chunk = patient_ids[start:start + CONFIRM_CHUNK_SIZE]
+        dose_logs = fetch_all_rows(
+            lambda: supabase.table("dose_logs").select("patient_id, medication, date")
+            .in_("patient_id", chunk).in_("date", days).order("id")
+        )
+        logged.update((log["patient_id"], log["medication"], str(log["date"])[:10]) for log in dose_logs)
+        patients = supabase.table("patients").select("id").in_("id", chunk).execute().data or []
+        existing.update(patient["id"] for patient in patients)
+    return logged, existing
+
+async def send_due_reminders():
+    """
+    Send the reminders due now, unless the store shows their doses logged or their patient deleted.
+
+    Returns:
+        float: The timestamp the reminders were due by
+    """
+    now = time.time()
+    due = reminder_scheduler.take_due(now)
+    if due:
+        try:
+            due = reminder_scheduler.confirm(due, *await asyncio.to_thread(fetch_logged_doses, due))
+        except Exception as e:
+            # A reminder too many beats a missed dose
+            print(f"Checking logged doses failed, sending {len(due)} reminders unchecked: {e}")
+        await reminder_scheduler.deliver(due)
+    return now
+
+async def run_reminder_scheduler():
+    """
+    Background task: elect this worker to send reminders, load the schedules,
+    then send reminders as they come due.
+
+    Only the worker holding REMINDER_LOCK_PATH sends reminders; the others
+    stand by and take over if it exits. The loop sleeps until the earliest due
+    time in the heap (at most REMINDER_TICK_SECONDS), so idle ticks cost nothing
+    however many reminders are scheduled. The schedules are reloaded every
+    REMINDER_RELOAD_SECONDS for treatments created through other workers.
+    """
+    lock = FileLock(REMINDER_LOCK_PATH)
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(REMINDER_STANDBY_SECONDS)
+    try:
+        # Treatments created while loading are scheduled by create_treatment
+        reminder_scheduler.start()
+        while True:
+            try:
+                scheduled = await asyncio.to_thread(load_reminders)
+                print(f"Reminders scheduled for {scheduled} medications")
+                break
+            except Exception as e:
+                print(f"Loading reminder schedules failed, retrying in {WARMUP_RETRY_SECONDS}s: {e}")
+                await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+        sent_until = loaded_at = time.time()
+        while True:
+            try:
+                sent_until = await send_due_reminders()
+            except Exception as e:
+                print(f"Sending reminders failed: {e}")
+            if time.time() - loaded_at >= REMINDER_RELOAD_SECONDS:
+                loaded_at = time.time()
+                try:
+                    # Reschedule from the last tick, so doses due during the reload are still sent
+                    await asyncio.to_thread(load_reminders, sent_until)
+                except Exception as e:
+                    print(f"Reloading reminder schedules failed: {e}")
+            next_due = reminder_scheduler.next_due_at()
+            delay = REMINDER_TICK_SECONDS if next_due is None else next_due - time.time()
+            await asyncio.sleep(min(max(delay, 0.01), REMINDER_TICK_SECONDS))
+    finally:
+        lock.release()
+
+@router.get("/metrics")
+async def get_reminder_metrics():
+    """
+    Get scheduled medications, heap size and sent or skipped reminder counts.
+    """
+    return success_response(
+        data={"enabled": REMINDERS_ENABLED, **reminder_scheduler.metrics()},
+        message="Reminder metrics retrieved successfully"
+    )
+
+@router.get("/patient/{patient_id}")
+async def get_patient_reminders(patient_id: str):
+    """
+    Get the next reminder of each of a patient's medications.
+    """
+    return success_response(
+        data={"patient_id": patient_id, "reminders": reminder_scheduler.upcoming(patient_id)},
+        message="Reminders retrieved successfully"
+    )
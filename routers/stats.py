@@ -0,0 +1,79 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from database import supabase
+from utils.response import success_response
+from utils.cohort_stats import compute_cohort_stats, cohort_stats_cache
+from utils.cohort_report import REPORT_FORMATS, fetch_all_patients, parse_month, month_label, stream_report
+
+router = APIRouter(prefix="/api/stats", tags=["stats"])
+
+def compute_current_cohort_stats():
+    """
+    Compute the cohort statistics from the patients table.
+    """
+    # Fetch only the columns needed for the aggregate, a page at a time
+    return compute_cohort_stats(fetch_all_patients(supabase))
+
+def refresh_cohort_stats():
+    """
+    Compute the cohort statistics from the patients table and cache them.
+    """
+    generation = cohort_stats_cache.generation
+    stats = compute_current_cohort_stats()
+    cohort_stats_cache.set(stats, generation)
+    return stats
+
+@router.get("/cohort")
+async def get_cohort_stats():
+    """
+    Get aggregated cohort statistics for the doctor dashboard.
+    """
+    try:
+        # Concurrent requests after a write share one recomputation, off the event loop
+        stats, cached = await cohort_stats_cache.refresh(compute_current_cohort_stats)
+
+        return success_response(
+            data={**stats, "cached": cached},
+            message="Cohort statistics retrieved successfully"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching cohort statistics: {str(e)}")
+
+@router.get("/forecast/slipping")
+async def get_slipping_patients(limit: int = 20):
+    """
+    Get the patients whose adherence is forecast to drop the most next week.
+    """
+    try:
+        response = supabase.table("adherence_forecasts").select(
+            "patient_id, forecast_7d, change_7d, trend, generated_on"
+        ).lt("change_7d", 0).order("change_7d").limit(limit).execute()
+        return success_response(
+            data={"patients": response.data or []},
+            message="Forecast retrieved successfully"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching forecast: {str(e)}")
+
+@router.get("/report")
+async def get_adherence_report(month: Optional[str] = None, format: str = "csv"):
+    """
+    Stream the monthly adherence report of all patients as CSV, JSON or printable HTML.
+    For very large clinics, generate_report.py writes the same report with worker processes.
+    """
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(REPORT_FORMATS)}")
+    try:
+        start, end = parse_month(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    
+    report = REPORT_FORMATS[format]
+    filename = f"adherence-report-{month_label(start)}.{report.extension}"
+    # A plain generator: Starlette iterates it in a worker thread, one page of patients at a time
+    return StreamingResponse(
+        stream_report(supabase, format, start, end),
+        media_type=report.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,13 +1,19 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from database import supabase
 from utils.response import success_response, error_response
-from datetime import datetime, timedelta
-from collections import defaultdict
+from utils.rolling_adherence import rolling_adherence
+from utils.adherence_bitmaps import adherence_bitmaps, HEATMAP_LEGEND, days_in_year, popcount
+from utils.etag import patient_validators, is_not_modified
+from utils.dose_rollups import fetch_patient_history
+from datetime import date, datetime, timedelta
+from typing import Optional
+import logging
 
 router = APIRouter(prefix="/api/summary", tags=["summary"])
+logger = logging.getLogger(__name__)
 
 @router.get("/{patient_id}")
-async def get_patient_summary(patient_id: str):
+async def get_patient_summary(patient_id: str, request: Request, response: Response):
     """
     Fetch patient summary including adherence, risk label, and detailed missed days information.
     """
@@ -19,13 +25,25 @@ async def get_patient_summary(patient_id: str):
         if not patient_data:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        # Fetch all dose logs for this patient
-        logs_response = supabase.table("dose_logs").select("*").eq("patient_id", patient_id).execute()
-        dose_logs = logs_response.data if logs_response.data else []
+        # Answer conditional requests from the stored patient version before reading anything else
+        # (rolling windows slide daily, so the day is part of the validator)
+        validators = patient_validators(f"summary-{datetime.now().strftime('%Y%m%d')}", patient_data)
+        if is_not_modified(request.headers, validators):
+            return Response(status_code=304, headers=validators)
+        response.headers.update(validators or {})
         
-        # Fetch treatments for this patient
-        treatments_response = supabase.table("treatments").select("*").eq("patient_id", patient_id).execute()
-        treatments_data = treatments_response.data if treatments_response.data else []
+        # Dose logs and treatments only seed the in-memory calendars and windows,
+        # so they are not fetched again while both match the stored patient version
+        version = patient_data.get("version")
+        rolling_current = rolling_adherence.is_current(patient_id, version)
+        calendars_current = adherence_bitmaps.is_current(patient_id, version)
+        dose_logs, treatments_data = [], []
+        if not (calendars_current and rolling_current):
+            # Recent raw logs, and monthly rollups of the compacted ones
+            dose_logs, _ = fetch_patient_history(supabase, patient_id)
+            
+            treatments_response = supabase.table("treatments").select("*").eq("patient_id", patient_id).execute()
+            treatments_data = treatments_response.data if treatments_response.data else []
         
         # Get adherence and risk data
         adherence = patient_data.get("adherence_percent", 0)
@@ -39,14 +57,26 @@ async def get_patient_summary(patient_id: str):
         else:
             feedback = "It's important to take your medication regularly. Consider setting reminders."
         
-        # Process dose logs to get missed days information
-        missed_days_info = process_missed_days(dose_logs, treatments_data)
+        # Missed days per medication, from the adherence calendars, reloaded from the fetched logs when written to since
+        if not calendars_current:
+            adherence_bitmaps.load(patient_id, dose_logs, treatments_data, version)
+        missed_days_info = adherence_bitmaps.missed_days_by_medication(patient_id)
+        
+        # Rolling-window adherence, reloaded from the fetched logs when written to since
+        if not rolling_current:
+            rolling_adherence.load(patient_id, dose_logs, version)
+        
+        # Next-week forecast stored by the nightly forecast_adherence.py job
+        forecast = fetch_adherence_forecast(patient_id)
         
         return success_response(
             data={
                 "name": patient_data["name"],
                 "adherence": adherence,
+                "rolling_adherence": rolling_adherence.windows(patient_id),
+                "rolling_adherence_by_medication": rolling_adherence.windows_by_medication(patient_id),
                 "risk_label": risk_label,
+                "forecast": forecast,
                 "feedback": feedback,
                 "missed_days": missed_days_info
             },
@@ -55,50 +85,73 @@ async def get_patient_summary(patient_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching summary: {str(e)}")
 
-def process_missed_days(dose_logs, treatments):
+def fetch_adherence_forecast(patient_id):
     """
-    Process dose logs to identify which days were missed for each medication.
+    Get the stored 7-day adherence forecast of a patient, None if not forecast yet.
     """
-    # Group dose logs by medication
-    logs_by_medication = defaultdict(list)
-    for log in dose_logs:
-        logs_by_medication[log["medication"]].append(log)
-    
-    # Group treatments by medication
-    treatments_by_medication = defaultdict(list)
-    for treatment in treatments:
-        treatments_by_medication[treatment["medication"]].append(treatment)
+    try:
+        response = supabase.table("adherence_forecasts").select(
+            "forecast_7d, daily_forecast, trend, change_7d, generated_on"
+        ).eq("patient_id", patient_id).execute()
+        return response.data[0] if response.data else None
+    except Exception:
+        # The summary stays available when the forecasts table has not been created yet
+        logger.warning("Could not fetch adherence forecast for patient %s", patient_id, exc_info=True)
+        return None
+
+@router.get("/{patient_id}/calendar")
+async def get_adherence_calendar(
+    patient_id: str,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    medication: Optional[str] = None
+):
+    """
+    Adherence calendar of a patient for a year or a month: a heatmap with one level
+    per day, the missed days and streaks, optionally for a single medication.
+    """
+    today = date.today()
+    year = year or today.year
+    if month is not None and not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="month must be between 1 and 12")
+    if month is None:
+        start = date(year, 1, 1).toordinal()
+        end = start + days_in_year(year) - 1
+    else:
+        start = date(year, month, 1).toordinal()
+        end = (date(year + month // 12, month % 12 + 1, 1)).toordinal() - 1
     
-    # Process each medication
-    missed_info = {}
-    for medication, logs in logs_by_medication.items():
-        # Get scheduled days for this medication
-        scheduled_days = set()
-        treatments_for_med = treatments_by_medication.get(medication, [])
-        for treatment in treatments_for_med:
-            if "schedule_days" in treatment and treatment["schedule_days"]:
-                scheduled_days.update(treatment["schedule_days"])
-        
-        # Group logs by date
-        logs_by_date = defaultdict(list)
-        for log in logs:
-            if "date" in log:
-                logs_by_date[log["date"]].append(log)
+    try:
+        # The stored patient version tells whether doses were logged through other workers
+        # since the calendars were loaded ("*" still works without the version column)
+        patient_response = supabase.table("patients").select("*").eq("id", patient_id).execute()
+        version = patient_response.data[0].get("version") if patient_response.data else None
+        if not adherence_bitmaps.is_current(patient_id, version):
+            dose_logs, _ = fetch_patient_history(supabase, patient_id, "medication, status, date")
+            treatments_response = supabase.table("treatments").select("medication, frequency, start_date").eq("patient_id", patient_id).execute()
+            adherence_bitmaps.load(patient_id, dose_logs, treatments_response.data or [], version)
         
-        # Identify missed days
-        missed_days = []
-        for date_str, date_logs in logs_by_date.items():
-            # Check if any log for this date was "Missed"
-            if any(log["status"] == "Missed" for log in date_logs):
-                missed_days.append({
-                    "date": date_str,
-                    "medication": medication
-                })
+        if medication is not None and medication not in adherence_bitmaps.medications(patient_id):
+            raise HTTPException(status_code=404, detail="No doses or treatment for this medication")
         
-        missed_info[medication] = {
-            "scheduled_days": list(scheduled_days),
-            "missed_days": missed_days,
-            "total_missed": len(missed_days)
-        }
-    
-    return missed_info
\ No newline at end of file
+        days = adherence_bitmaps.span(patient_id, start, end, medication)
+        return success_response(
+            data={
+                "patient_id": patient_id,
+                "medication": medication,
+                "start": date.fromordinal(start).isoformat(),
+                "end": date.fromordinal(end).isoformat(),
+                "heatmap": adherence_bitmaps.heatmap(patient_id, start, end, medication, today.toordinal()),
+                "legend": HEATMAP_LEGEND,
+                "days_taken": popcount(days["complete"]),
+                "days_missed": popcount(days["missed"]),
+                "missed_days": adherence_bitmaps.missed_days(patient_id, start, end, medication),
+                "streaks": adherence_bitmaps.streaks(patient_id, start, end, medication),
+                "medications": adherence_bitmaps.medications(patient_id)
+            },
+            message="Adherence calendar retrieved successfully"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching adherence calendar: {str(e)}")
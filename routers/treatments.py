@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
 from database import supabase
 from utils.response import success_response, error_response
+from utils.event_bus import event_broadcaster
+from utils.etag import patient_validators, is_not_modified
+from utils.adherence_bitmaps import adherence_bitmaps
+from utils.reminders import reminder_scheduler
 
 router = APIRouter(prefix="/api/treatment", tags=["treatments"])
 
@@ -14,32 +18,40 @@ class TreatmentCreate(BaseModel):
     start_date: str  # ISO format date
     schedule_days: List[str] = []  # List of days of week (e.g., ["Monday", "Wednesday", "Friday"])
 
+def treatment_row(treatment_data: TreatmentCreate):
+    """
+    Build the treatments table row for a prescription.
+    """
+    # Store schedule information in frequency field as a workaround
+    frequency_with_schedule = treatment_data.frequency
+    if treatment_data.schedule_days:
+        frequency_with_schedule = f"{treatment_data.frequency} (Schedule: {', '.join(treatment_data.schedule_days)})"
+    return {
+        "patient_id": treatment_data.patient_id,
+        "medication": treatment_data.medication,
+        "dosage": treatment_data.dosage,
+        "frequency": frequency_with_schedule,
+        "start_date": treatment_data.start_date
+    }
+
 @router.post("/new")
 async def create_treatment(treatment_data: TreatmentCreate):
     """
     Create a new treatment prescription.
     """
     try:
-        # Prepare treatment data for insertion
-        # Store schedule information in frequency field as a workaround
-        frequency_with_schedule = treatment_data.frequency
-        if treatment_data.schedule_days:
-            frequency_with_schedule = f"{treatment_data.frequency} (Schedule: {', '.join(treatment_data.schedule_days)})"
-        
         # Insert treatment into Supabase
-        response = supabase.table("treatments").insert({
-            "patient_id": treatment_data.patient_id,
-            "medication": treatment_data.medication,
-            "dosage": treatment_data.dosage,
-            "frequency": frequency_with_schedule,
-            "start_date": treatment_data.start_date
-        }).execute()
+        response = supabase.table("treatments").insert(treatment_row(treatment_data)).execute()
         
         # Get the inserted treatment data
         treatment = response.data[0] if response.data else None
         
         if not treatment:
             raise HTTPException(status_code=500, detail="Failed to create treatment")
+        
+        # The schedule changed; calendars are rebuilt with it on the next read
+        adherence_bitmaps.forget(treatment["patient_id"])
+        reminder_scheduler.add_treatment(treatment)
             
         # Extract schedule information from frequency field
         schedule_days = []
@@ -50,6 +62,14 @@ async def create_treatment(treatment_data: TreatmentCreate):
             schedule_str = freq_parts[1].rstrip(")")
             schedule_days = schedule_str.split(", ") if schedule_str else []
         
+        event_broadcaster.publish(
+            "treatment_created",
+            patient_id=treatment["patient_id"],
+            treatment_id=treatment["id"],
+            medication=treatment["medication"],
+            schedule_days=schedule_days
+        )
+        
         return success_response(
             data={
                 "id": treatment["id"],
@@ -67,11 +87,20 @@ async def create_treatment(treatment_data: TreatmentCreate):
 
 # Add endpoint to get treatments with schedule information
 @router.get("/patient/{patient_id}")
-async def get_patient_treatments(patient_id: str):
+async def get_patient_treatments(patient_id: str, request: Request, response: Response):
     """
     Get all treatments for a patient including schedule information.
     """
     try:
+        # Answer conditional requests from the stored patient version before reading treatments
+        # ("*", so the endpoint still answers in full without the version column)
+        version_response = supabase.table("patients").select("*").eq("id", patient_id).execute()
+        if version_response.data:
+            validators = patient_validators("treatments", version_response.data[0])
+            if is_not_modified(request.headers, validators):
+                return Response(status_code=304, headers=validators)
+            response.headers.update(validators or {})
+        
         # Fetch treatments for this patient
         treatments_response = supabase.table("treatments").select("*").eq("patient_id", patient_id).execute()
         treatments_data = treatments_response.data if treatments_response.data else []
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test the per-medication adherence bitmaps behind the calendar views
+"""
+
+from datetime import date
+
+import pytest
+from conftest import FakeSupabase
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers import summary
+from utils.adherence_bitmaps import AdherenceBitmapStore, longest_run, trailing_run
+from utils.rolling_adherence import RollingAdherenceTracker
+
+def iso(year, month, day):
+    return date(year, month, day).isoformat()
+
+def march(day):
+    return date(2025, 3, day).toordinal()
+
+def test_range_queries():
+    """Test missed days in a month and streaks, across medications"""
+    print("Testing range queries...")
+    store = AdherenceBitmapStore()
+    logs = [{"medication": "A", "status": "Taken", "date": iso(2025, 3, d)} for d in range(1, 21)]
+    logs += [{"medication": "B", "status": "Taken", "date": iso(2025, 3, d)} for d in range(1, 21)]
+    logs[4]["status"] = "Missed"                                        # A missed on March 5
+    logs.append({"medication": "B", "status": "Missed", "date": iso(2025, 2, 27)})
+    store.load("p1", logs)
+
+    assert store.missed_days("p1", march(1), march(31)) == ["2025-03-05"]
+    assert store.missed_days("p1", march(1), march(31), medication="B") == []
+    assert store.missed_days("p1", march(1) - 31, march(31)) == ["2025-02-27", "2025-03-05"]
+    # March 5 breaks the patient's streak but not medication B's
+    assert store.streaks("p1", march(1), march(31)) == {"longest": 15, "current": 15}
+    assert store.streaks("p1", march(1), march(31), medication="B")["longest"] == 20
+
+    assert store.record("p1", "A", "Missed", iso(2025, 3, 21))
+    assert store.streaks("p1", march(1), march(31))["current"] == 0
+    assert not store.record("unknown", "A", "Taken", iso(2025, 3, 21))
+    print("✅ Range queries")
+
+def test_heatmap_and_schedule():
+    """Test calendar levels with a weekday schedule, across a year boundary"""
+    print("Testing heatmap...")
+    store = AdherenceBitmapStore()
+    treatments = [{"medication": "A", "frequency": "Once daily (Schedule: Monday, Thursday)", "start_date": iso(2024, 12, 1)}]
+    logs = [
+        {"medication": "A", "status": "Taken", "date": iso(2024, 12, 30)},   # Monday
+        {"medication": "A", "status": "Taken", "date": iso(2025, 1, 2)},     # Thursday
+        {"medication": "A", "status": "Missed", "date": iso(2025, 1, 2)},
+    ]
+    store.load("p1", logs, treatments)
+
+    start = date(2024, 12, 29).toordinal()
+    heatmap = store.heatmap("p1", start, start + 13, today=date(2025, 1, 6).toordinal())
+    # Dec 29 .. Jan 11: Mon taken, Thu partial, Mon Jan 6 unlogged, Thu Jan 9 in the future
+    assert heatmap == "04003000100000", heatmap
+
+    info = store.missed_days_by_medication("p1")
+    assert info["A"]["scheduled_days"] == ["Monday", "Thursday"]
+    assert info["A"]["missed_days"] == [{"date": "2025-01-02", "medication": "A"}]
+    print("✅ Heatmap")
+
+def test_bit_helpers_and_size():
+    """Test run helpers and the memory per medication-year"""
+    print("Testing bit helpers...")
+    assert longest_run(0b1110111100) == 4 and longest_run(0) == 0
+    assert trailing_run(0b0111, 3) == 3 and trailing_run(0b0110, 3) == 2 and trailing_run(0b011, 3) == 0
+
+    store = AdherenceBitmapStore()
+    store.load("p1", [{"medication": "A", "status": "Taken", "date": iso(2025, 12, 31)}],
+               [{"medication": "A", "frequency": "Daily", "start_date": iso(2025, 1, 1)}])
+    metrics = store.metrics()
+    assert metrics["medication_years"] == 1 and metrics["payload_bytes"] <= 3 * 46
+    assert metrics["bytes_per_medication_year"] < 400
+    print(f"✅ {metrics['bytes_per_medication_year']} bytes per medication-year")
+
+def test_reload_on_version_change(fake_supabase, monkeypatch):
+    """Test that summaries and calendars show doses logged through another worker"""
+    print("Testing calendar reloads...")
+    fake = fake_supabase
+    fake.tables.update({
+        "patients": [{"id": "p1", "name": "Ann", "adherence_percent": 100, "risk_label": "Low", "version": 1}],
+        "treatments": [{"patient_id": "p1", "medication": "A", "frequency": "Daily", "start_date": iso(2025, 3, 1)}],
+        "dose_logs": [{"patient_id": "p1", "medication": "A", "status": "Taken", "date": iso(2025, 3, 1)}],
+    })
+    monkeypatch.setattr(summary, "supabase", fake)
+    monkeypatch.setattr(summary, "adherence_bitmaps", AdherenceBitmapStore())
+    monkeypatch.setattr(summary, "rolling_adherence", RollingAdherenceTracker())
+    app = FastAPI()
+    app.include_router(summary.router)
+    client = TestClient(app)
+
+    def missed_days():
+        return client.get("/api/summary/p1").json()["data"]["missed_days"]["A"]["missed_days"]
+
+    def calendar():
+        return client.get("/api/summary/p1/calendar?year=2025&month=3").json()["data"]["missed_days"]
+
+    assert missed_days() == [] and calendar() == []
+    fake.requests.clear()
+    assert calendar() == []
+    assert fake.requests == ["patients"]
+
+    # Another worker logs a missed dose, and the trigger bumps the stored version
+    fake.tables["dose_logs"].append({"patient_id": "p1", "medication": "A", "status": "Missed", "date": iso(2025, 3, 2)})
+    fake.tables["patients"][0]["version"] = 2
+    assert missed_days() == [{"date": iso(2025, 3, 2), "medication": "A"}]
+
+    fake.tables["dose_logs"].append({"patient_id": "p1", "medication": "A", "status": "Missed", "date": iso(2025, 3, 3)})
+    fake.tables["patients"][0]["version"] = 3
+    assert calendar() == [iso(2025, 3, 2), iso(2025, 3, 3)]
+    print("✅ Calendars reloaded when the stored version changes")
+
+if __name__ == "__main__":
+    test_range_queries()
+    test_heatmap_and_schedule()
+    test_bit_helpers_and_size()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_reload_on_version_change(FakeSupabase(), monkeypatch)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Test the batched adherence forecast
+"""
+
+from datetime import date
+from utils.adherence_forecast import build_daily_counts, forecast_adherence, forecast_rows
+
+TODAY = date(2025, 3, 31).toordinal()
+
+def daily_logs(patient_id, pattern):
+    """One log per day ending today; pattern holds True (taken) / False (missed)"""
+    start = TODAY - len(pattern) + 1
+    return [
+        {"patient_id": patient_id, "status": "Taken" if taken else "Missed", "date": date.fromordinal(start + day).isoformat()}
+        for day, taken in enumerate(pattern)
+    ]
+
+def test_forecast_cohort():
+    """Test that steady, slipping and silent patients are forecast in one batch"""
+    print("Testing cohort forecast...")
+    patients = ["steady", "slipping", "silent"]
+    logs = daily_logs("steady", [True] * 30) + daily_logs("slipping", [True] * 20 + [False] * 10)
+    taken, total = build_daily_counts(patients, logs, TODAY, days=30)
+    assert taken.shape == total.shape == (3, 30)
+    assert total.sum() == 60 and taken[1].sum() == 20
+
+    forecast = forecast_adherence(taken, total)
+    assert forecast["daily"].shape == (3, 7)
+    assert abs(forecast["forecast"][0] - 100) < 0.01
+    assert forecast["forecast"][1] < 20 and forecast["trend"][1] < 0
+
+    rows = forecast_rows(patients, forecast, "2025-03-31")
+    assert [row["patient_id"] for row in rows] == ["steady", "slipping"]
+    assert rows[0]["change_7d"] == 0 and rows[1]["forecast_7d"] < 20
+    print("✅ Cohort forecast")
+
+def test_logs_outside_lookback_ignored():
+    """Test that logs older than the lookback or for unknown patients are skipped"""
+    taken, total = build_daily_counts(["a"], daily_logs("a", [True] * 40) + daily_logs("b", [True]), TODAY, days=30)
+    assert total.sum() == 30
+
+if __name__ == "__main__":
+    test_forecast_cohort()
+    test_logs_outside_lookback_ignored()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test admission control limits, queueing and load shedding
+"""
+
+import asyncio
+from utils.admission import AdmissionLimiter, AdmissionController, Overloaded
+
+async def hold_slot(limiter, seconds, order, name):
+    await limiter.acquire()
+    order.append(name)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        limiter.release(seconds)
+
+async def try_hold(limiter, seconds, order, name):
+    try:
+        await hold_slot(limiter, seconds, order, name)
+        return None
+    except Overloaded as e:
+        return e.retry_after
+
+def test_queue_and_shed():
+    """Test that excess requests queue in order and a full queue sheds"""
+    print("Testing queueing and shedding...")
+
+    async def run():
+        limiter, order = AdmissionLimiter("dose_write", max_concurrent=2, max_queue=2, queue_timeout=5), []
+        results = await asyncio.gather(*(try_hold(limiter, 0.05, order, n) for n in range(6)))
+        return limiter, order, results
+
+    limiter, order, results = asyncio.run(run())
+    assert order == [0, 1, 2, 3]
+    assert results[:4] == [None] * 4 and all(r and r >= 1 for r in results[4:])
+    metrics = limiter.metrics()
+    assert metrics["shed"] == 2 and metrics["peak_queue_depth"] == 2
+    assert metrics["active"] == 0 and metrics["queue_depth"] == 0
+    print("✅ Two requests queued, two shed with Retry-After")
+
+def test_queue_timeout():
+    """Test that a request waiting past the queue timeout is shed"""
+    print("Testing queue timeout...")
+
+    async def run():
+        limiter, order = AdmissionLimiter("write", max_concurrent=1, max_queue=10, queue_timeout=0.05), []
+        results = await asyncio.gather(try_hold(limiter, 0.2, order, "slow"), try_hold(limiter, 0, order, "waiting"))
+        return limiter, results
+
+    limiter, results = asyncio.run(run())
+    assert results[0] is None and results[1] is not None
+    assert limiter.metrics()["timed_out"] == 1 and limiter.active == 0
+    print("✅ Timed out request shed")
+
+def test_degrade_while_queueing():
+    """Test that optional work is skipped only while requests are queueing"""
+    print("Testing degradation...")
+    controller = AdmissionController({"dose_write": (1, 5)})
+
+    async def run():
+        limiter = controller.limiters["dose_write"]
+        idle = controller.should_degrade("dose_write")
+        tasks = [asyncio.create_task(hold_slot(limiter, 0.05, [], n)) for n in range(2)]
+        await asyncio.sleep(0.01)
+        busy = controller.should_degrade("dose_write")
+        await asyncio.gather(*tasks)
+        return idle, busy
+
+    assert asyncio.run(run()) == (False, True)
+    assert controller.metrics()["dose_write"]["degraded"] == 1
+    print("✅ Degraded under load only")
+
+def test_classify():
+    controller = AdmissionController()
+    assert controller.classify("POST", "/api/log_dose") == "dose_write"
+    assert controller.classify("POST", "/api/patient/new") == "write"
+    assert controller.classify("GET", "/api/patient/all") == "read"
+    assert controller.classify("GET", "/api/events/stream") is None
+    assert controller.classify("GET", "/health") is None
+
+if __name__ == "__main__":
+    test_queue_and_shed()
+    test_queue_timeout()
+    test_degrade_while_queueing()
+    test_classify()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test bulk patient and prescription import from CSV and JSON
+"""
+
+import io
+import json
+
+from conftest import FakeSupabase
+
+class FakeAPIError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+class ImportSupabase(FakeSupabase):
+    """Rejects patients with condition REJECT, and can lose the responses of committed inserts"""
+    def __init__(self):
+        super().__init__()
+        self.timeouts = 0
+
+    def execute(self, query):
+        # Like a database constraint, one bad row fails the whole statement
+        if any(row.get("condition") == "REJECT" for row in query.payload):
+            self.requests.append(query.table)
+            raise FakeAPIError("new row violates check constraint", "23514")
+        response = super().execute(query)
+        if self.timeouts:
+            # The statement committed but the response never arrived
+            self.timeouts -= 1
+            raise TimeoutError("The read operation timed out")
+        return response
+
+import asyncio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers import imports
+from routers.imports import run_import
+from utils.bulk_import import iter_json_records
+
+CSV_EXPORT = """type,external_id,name,age,gender,condition,patient_external_id,medication,dosage,frequency,start_date,schedule_days
+patient,P-1,Ann,54,Female,Diabetes,,,,,,
+patient,P-2,Bob,not a number,Male,Asthma,,,,,,
+patient,P-3,Cy,40,Male,REJECT,,,,,,
+patient,P-4,Di,33,Female,Asthma,,,,,,
+treatment,,,,,,P-1,Metformin,500mg,Twice daily,2025-01-06,Monday;Thursday
+treatment,,,,,,P-2,Inhaler,2 puffs,Daily,2025-01-06,
+treatment,,,,,,P-4,Inhaler,2 puffs,Daily,2025-01-06,
+"""
+
+def test_csv_import_reports_row_errors():
+    """Test that invalid and rejected rows are reported while the rest is imported"""
+    print("Testing CSV import...")
+    client = ImportSupabase()
+    report = run_import(io.StringIO(CSV_EXPORT), "csv", client, chunk_size=2)
+
+    assert report["rows"] == 7
+    assert report["patients_created"] == 2 and report["treatments_created"] == 2
+    assert set(report["id_map"]) == {"P-1", "P-4"}
+    failed = {error["row"]: error["errors"][0] for error in report["errors"]}
+    assert set(failed) == {2, 3, 6}
+    assert failed[2].startswith("age:") and "constraint" in failed[3] and "P-2" in failed[6]
+
+    metformin = next(t for t in client.tables["treatments"] if t["medication"] == "Metformin")
+    assert metformin["patient_id"] == report["id_map"]["P-1"]
+    assert metformin["frequency"] == "Twice daily (Schedule: Monday, Thursday)"
+    print(f"✅ CSV import ({len(client.requests)} insert calls)")
+
+def test_json_import_nested_and_chunked():
+    """Test nested prescriptions in a JSON array and that inserts are batched"""
+    print("Testing JSON import...")
+    records = [
+        {"external_id": f"E{n}", "name": f"Patient {n}", "age": 30 + n % 40, "gender": "Female", "condition": "Asthma",
+         "treatments": [{"medication": "Inhaler", "dosage": "1", "frequency": "Daily", "start_date": "2025-01-01"}]}
+        for n in range(250)
+    ]
+    client = ImportSupabase()
+    report = run_import(io.StringIO(json.dumps(records)), "json", client, chunk_size=100)
+
+    assert report["failed_rows"] == 0 and report["patients_created"] == 250 and report["treatments_created"] == 250
+    assert len(client.requests) <= 6  # 3 patient chunks and 3 prescription chunks instead of 500 single inserts
+    print(f"✅ JSON import ({len(client.requests)} insert calls)")
+
+def test_incremental_json_parsing():
+    """Test that JSON arrays and JSON Lines decode across read boundaries"""
+    print("Testing incremental JSON parsing...")
+    records = [{"name": "A" * n, "age": n} for n in range(1, 30)]
+    for text in (json.dumps(records, indent=2), "\n".join(json.dumps(r) for r in records) + "\n"):
+        parsed = [record for _, record in iter_json_records(io.StringIO(text), chunk_size=7)]
+        assert parsed == records
+
+    client = ImportSupabase()
+    report = run_import(io.StringIO('[{"name": "Ann", "age": 1, "gender": "F", "condition": "X"}, {"name": '), "json", client)
+    assert report["patients_created"] == 1 and report["failed_rows"] == 1
+    print("✅ Incremental JSON parsing")
+
+def test_timeout_stops_without_duplicates():
+    """Test that a chunk that timed out is not retried row by row, which would store it twice"""
+    print("Testing a timed out chunk...")
+    client = ImportSupabase()
+    client.timeouts = 1
+    records = [{"name": f"P{n}", "age": 40, "gender": "Male", "condition": "Asthma"} for n in range(5)]
+    report = run_import(io.StringIO(json.dumps(records)), "json", client, chunk_size=2)
+
+    assert len(client.tables["patients"]) == 2 and len(client.requests) == 1
+    assert report["patients_created"] == 0 and report["failed_rows"] == 1
+    error = report["errors"][0]
+    assert error["row"] == 1 and "rows 1-2 may or may not have been stored" in error["errors"][0]
+    print("✅ Import stopped at the timed out chunk")
+
+def test_import_event_published_on_loop():
+    """Test that the import event is published from the event loop, not the import thread"""
+    print("Testing the patients_imported event...")
+    published = []
+
+    class LoopOnlyBroadcaster:
+        def publish(self, event_type, **data):
+            asyncio.get_running_loop()  # raises in a worker thread
+            published.append((event_type, data))
+
+    saved = imports.supabase, imports.event_broadcaster
+    imports.supabase, imports.event_broadcaster = ImportSupabase(), LoopOnlyBroadcaster()
+    try:
+        app = FastAPI()
+        app.include_router(imports.router)
+        response = TestClient(app).post("/api/import?format=csv", content=CSV_EXPORT)
+    finally:
+        imports.supabase, imports.event_broadcaster = saved
+    assert response.status_code == 200
+    assert published == [("patients_imported", {"patients_created": 2, "treatments_created": 2})]
+    print("✅ Event published on the loop")
+
+if __name__ == "__main__":
+    test_csv_import_reports_row_errors()
+    test_json_import_nested_and_chunked()
+    test_incremental_json_parsing()
+    test_timeout_stops_without_duplicates()
+    test_import_event_published_on_loop()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test streaming, resumable cohort report generation
+"""
+
+import csv
+import json
+import os
+import tempfile
+from datetime import date
+
+import generate_report
+from conftest import FakeSupabase
+from utils.cohort_report import parse_month, stream_report, summarize_patients
+
+START, END = parse_month("2025-03")
+
+def clinic(patients=25):
+    tables = {"patients": [], "dose_logs": []}
+    for n in range(patients):
+        patient_id = f"patient-{n:03d}"
+        tables["patients"].append({"id": patient_id, "name": f"Patient <{n}>", "condition": "Asthma",
+                                   "adherence_percent": 75.0, "risk_label": ["Low", "High"][n % 2]})
+        for day in range(1, n % 10 + 1):
+            tables["dose_logs"].append({"id": len(tables["dose_logs"]), "patient_id": patient_id, "medication": "A",
+                                        "status": "Missed" if day == 3 else "Taken", "date": f"2025-03-{day:02d}"})
+        # Outside the month
+        tables["dose_logs"].append({"id": len(tables["dose_logs"]), "patient_id": patient_id, "medication": "A",
+                                    "status": "Missed", "date": "2025-04-01"})
+    return FakeSupabase(tables)
+
+def test_summarize_page():
+    """Test the month's figures of one page of patients"""
+    print("Testing report rows...")
+    assert (START, END) == (date(2025, 3, 1).toordinal(), date(2025, 3, 31).toordinal())
+    supabase = clinic(10)
+    march = [log for log in supabase.tables["dose_logs"] if log["date"].startswith("2025-03")]
+    rows = summarize_patients(supabase.tables["patients"], march, START, END)
+    by_id = {row["patient_id"]: row for row in rows}
+    assert by_id["patient-000"]["doses_logged"] == 0 and by_id["patient-000"]["adherence_month"] is None
+    assert by_id["patient-005"]["doses_logged"] == 5 and by_id["patient-005"]["days_missed"] == 1
+    assert by_id["patient-005"]["longest_streak"] == 2 and by_id["patient-005"]["adherence_month"] == 80.0
+    print("✅ Report rows")
+
+def test_stream_pages():
+    """Test that a streamed JSON report is one valid document across pages"""
+    print("Testing streamed report...")
+    document = json.loads("".join(stream_report(clinic(), "json", START, END, page_size=4)))
+    assert [row["patient_id"] for row in document["patients"]] == [f"patient-{n:03d}" for n in range(25)]
+    assert document["totals"]["patients"] == 25 and document["totals"]["risk_distribution"]["High"] == 12
+    print("✅ Streamed report")
+
+def test_resume_after_interruption():
+    """Test that an interrupted run resumes from its checkpoint without duplicate rows"""
+    print("Testing resumable report...")
+    supabase = clinic()
+    fetch_page = generate_report.fetch_patient_page
+    with tempfile.TemporaryDirectory() as directory:
+        prefix = os.path.join(directory, "report")
+
+        def failing_fetch(client, after=None, page_size=5):
+            if after is not None and after >= "patient-014":
+                raise ConnectionError("connection lost")
+            return fetch_page(client, after, page_size)
+
+        generate_report.fetch_patient_page = failing_fetch
+        try:
+            generate_report.run(supabase, START, END, prefix, ["csv", "json", "html"], 1, 5, resume=False)
+            assert False, "the run should have been interrupted"
+        except ConnectionError:
+            pass
+        finally:
+            generate_report.fetch_patient_page = fetch_page
+        assert os.path.exists(prefix + ".progress.json")
+
+        generate_report.run(supabase, START, END, prefix, ["csv", "json", "html"], 1, 5, resume=True)
+        assert not os.path.exists(prefix + ".progress.json")
+        with open(prefix + ".csv", newline="") as f:
+            ids = [row["patient_id"] for row in csv.DictReader(f)]
+        assert ids == [f"patient-{n:03d}" for n in range(25)]
+        with open(prefix + ".json") as f:
+            assert len(json.load(f)["patients"]) == 25
+        with open(prefix + ".html") as f:
+            page = f.read()
+        assert page.count("<tr class=") == 25 and "Patient &lt;3&gt;" in page and page.endswith("</html>\n")
+    print("✅ Resumed report")
+
+if __name__ == "__main__":
+    test_summarize_page()
+    test_stream_pages()
+    test_resume_after_interruption()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test cohort statistics aggregation, caching and paging over large cohorts
+"""
+
+import asyncio
+import time
+
+from conftest import FakeSupabase
+from utils.cohort_stats import CohortStatsCache, compute_cohort_stats
+
+def test_aggregation():
+    """Test counts, averages, risk distribution, histogram and patients needing attention"""
+    print("Testing cohort aggregation...")
+    stats = compute_cohort_stats([
+        {"id": "a", "name": "Ann", "condition": "Asthma", "adherence_percent": 95, "risk_label": "Low"},
+        {"id": "b", "name": "Ben", "condition": "Asthma", "adherence_percent": 40, "risk_label": "Medium"},
+        {"id": "c", "name": "Cal", "condition": "Diabetes", "adherence_percent": 100, "risk_label": "High"},
+        {"id": "d", "name": "Dee", "condition": None, "adherence_percent": None, "risk_label": "Bogus"},
+    ])
+    assert stats["total_patients"] == 4
+    assert stats["average_adherence"] == (95 + 40 + 100) / 4
+    assert stats["risk_distribution"] == {"Low": 1, "Medium": 1, "High": 1, "Unknown": 1}
+    histogram = {bucket["range"]: bucket["count"] for bucket in stats["adherence_histogram"]}
+    assert histogram["90-100"] == 2 and histogram["40-50"] == 1 and histogram["0-10"] == 1
+    # High risk or below 60%, lowest adherence first
+    assert [p["id"] for p in stats["needs_attention"]["patients"]] == ["d", "b", "c"]
+    assert stats["by_condition"]["Asthma"] == {
+        "count": 2, "average_adherence": 67.5,
+        "risk_distribution": {"Low": 1, "Medium": 1, "High": 0, "Unknown": 0}
+    }
+    assert stats["by_condition"]["Unknown"]["count"] == 1
+
+    empty = compute_cohort_stats([])
+    assert empty["total_patients"] == 0 and empty["average_adherence"] == 0.0
+    print("✅ Cohort statistics aggregated correctly")
+
+def test_cache_invalidation():
+    """Test that cached statistics expire with the TTL and on invalidation"""
+    print("Testing cohort statistics cache...")
+    cache = CohortStatsCache(ttl_seconds=0.05)
+    assert cache.get() is None
+    cache.set({"total_patients": 1})
+    assert cache.get() == {"total_patients": 1}
+    cache.invalidate()
+    assert cache.get() is None
+
+    cache.set({"total_patients": 2})
+    time.sleep(0.06)
+    assert cache.get() is None
+    print("✅ Cache expires and invalidates")
+
+def test_concurrent_requests_share_refresh():
+    """Test that requests after an invalidation share one recomputation, and a write during it starts another"""
+    print("Testing concurrent cohort statistics requests...")
+    cache = CohortStatsCache()
+    computed = []
+
+    def compute():
+        computed.append(cache.generation)
+        run = len(computed)
+        time.sleep(0.05)
+        return {"total_patients": run}
+
+    async def scenario():
+        results = await asyncio.gather(*(cache.refresh(compute) for _ in range(10)))
+        assert len(computed) == 1 and all(result == ({"total_patients": 1}, False) for result in results)
+        assert await cache.refresh(compute) == ({"total_patients": 1}, True)
+
+        # A dose is logged while the statistics are recomputed
+        cache.invalidate()
+        before = asyncio.ensure_future(cache.refresh(compute))
+        await asyncio.sleep(0.01)
+        cache.invalidate()
+        after = await cache.refresh(compute)
+        assert (await before)[0] == {"total_patients": 2} and after[0] == {"total_patients": 3}
+        # Only the statistics read after the write were cached
+        assert cache.get() == {"total_patients": 3}
+
+    asyncio.run(scenario())
+    print(f"✅ {len(computed)} recomputations")
+
+def test_refresh_covers_whole_cohort(fake_supabase):
+    """Test that refreshing the statistics pages past the per-request row cap"""
+    print("Testing cohort statistics over 2500 patients...")
+    rows = [
+        {"id": f"p{n:05d}", "name": f"P{n}", "condition": "X", "adherence_percent": 50, "risk_label": "Low"}
+        for n in range(2500)
+    ]
+    fake = fake_supabase
+    fake.tables["patients"], fake.max_rows = rows, 1000
+    from routers import stats
+    stats.supabase = fake
+
+    result = stats.refresh_cohort_stats()
+    assert result["total_patients"] == 2500
+    # Keyset pages after the last id of the previous page
+    assert [[value for _, _, value in query.filters] for query in fake.queries] == [[], ["p00999"], ["p01999"]]
+    assert stats.cohort_stats_cache.get() is result
+    print(f"✅ {result['total_patients']} patients in {len(fake.requests)} pages")
+
+if __name__ == "__main__":
+    test_aggregation()
+    test_cache_invalidation()
+    test_concurrent_requests_share_refresh()
+    test_refresh_covers_whole_cohort(FakeSupabase())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Test response compression negotiation and the orjson default response class
+"""
+
+import gzip
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from utils import compression
+from utils.compression import CompressionMiddleware, choose_encoding
+from utils.response import FastJSONResponse, dumps_json, fast_success_response
+
+PATIENTS = [{"id": f"p{n}", "name": "Test Patient", "adherence_percent": 90.0} for n in range(50)]
+
+def make_client():
+    app = FastAPI(default_response_class=FastJSONResponse)
+
+    @app.get("/patients")
+    def all_patients():
+        return {"success": True, "data": PATIENTS}
+
+    @app.get("/patient")
+    def one_patient():
+        return PATIENTS[0]
+
+    @app.get("/risk")
+    def risk():
+        return fast_success_response({"risk_score": np.float32(0.25), "features": np.array([3, 1, 2]), "age": np.int64(42)})
+
+    @app.get("/events")
+    def events():
+        chunks = (f"data: {'x' * 2000}\n\n" for _ in range(3))
+        return StreamingResponse(chunks, media_type="text/event-stream")
+
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+def test_q_values():
+    """Test that the client's preferences, wildcard and refusals pick the coding"""
+    print("Testing Accept-Encoding negotiation...")
+    assert choose_encoding("gzip, deflate, br") == ("br" if compression.brotli else "gzip")
+    assert choose_encoding("br;q=0.1, gzip;q=1") == "gzip"
+    assert choose_encoding("br;q=1.0, gzip;q=0.5") == ("br" if compression.brotli else "gzip")
+    assert choose_encoding("gzip;q=0, br;q=0") is None
+    assert choose_encoding("identity") is None
+    assert choose_encoding("") is None
+    assert choose_encoding("*") == ("br" if compression.brotli else "gzip")
+    assert choose_encoding("br;q=0, *;q=0.5") == "gzip"
+    assert choose_encoding("gzip;q=0.2, *;q=0.8") == ("br" if compression.brotli else "gzip")
+    assert choose_encoding("*;q=0") is None
+    assert choose_encoding("GZIP ; Q=0.5") == "gzip"
+    print("✅ Negotiation follows q-values")
+
+def test_size_threshold_and_headers():
+    """Test that only responses past the threshold are compressed, with the right headers"""
+    print("Testing compression threshold...")
+    client = make_client()
+
+    large = client.get("/patients", headers={"Accept-Encoding": "gzip"})
+    assert large.headers["Content-Encoding"] == "gzip"
+    assert large.headers["Vary"] == "Accept-Encoding"
+    assert large.json()["data"] == PATIENTS  # TestClient decodes the body
+    assert int(large.headers["Content-Length"]) < len(dumps_json({"success": True, "data": PATIENTS}))
+
+    small = client.get("/patient", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers and small.json() == PATIENTS[0]
+
+    refused = client.get("/patients", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in refused.headers
+    assert int(refused.headers["Content-Length"]) == len(dumps_json({"success": True, "data": PATIENTS}))
+    print("✅ Large responses compressed, small ones untouched")
+
+def test_gzip_body():
+    """Test that the compressed body is valid gzip of the original JSON"""
+    print("Testing the compressed body...")
+    client = make_client()
+    with client.stream("GET", "/patients", headers={"Accept-Encoding": "gzip"}) as response:
+        body = b"".join(response.iter_raw())
+    assert gzip.decompress(body) == dumps_json({"success": True, "data": PATIENTS})
+    print("✅ Valid gzip")
+
+def test_streaming_passes_through():
+    """Test that Server-Sent Events are streamed uncompressed"""
+    print("Testing streaming pass-through...")
+    client = make_client()
+    with client.stream("GET", "/events", headers={"Accept-Encoding": "gzip, br"}) as response:
+        assert "Content-Encoding" not in response.headers
+        assert response.headers["Content-Type"].startswith("text/event-stream")
+        body = b"".join(response.iter_raw())
+    assert body.count(b"data: ") == 3
+    print("✅ Events streamed as sent")
+
+def test_default_response_class():
+    """Test that endpoints returning plain content are rendered with the compact serializer"""
+    print("Testing the default response class...")
+    client = make_client()
+    response = client.get("/patient")
+    assert response.headers["Content-Type"] == "application/json"
+    assert response.content == dumps_json(PATIENTS[0])
+    print("✅ Rendered compactly")
+
+def test_numpy_values():
+    """Test that numpy scalars and arrays from the risk model serialize as numbers and lists"""
+    print("Testing numpy values...")
+    client = make_client()
+    response = client.get("/risk")
+    assert response.status_code == 200
+    assert response.json()["data"] == {"risk_score": 0.25, "features": [3, 1, 2], "age": 42}
+    print("✅ numpy values serialized")
+
+if __name__ == "__main__":
+    test_q_values()
+    test_size_threshold_and_headers()
+    test_gzip_body()
+    test_streaming_passes_through()
+    test_default_response_class()
+    test_numpy_values()
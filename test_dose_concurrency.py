@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Stress test concurrent dose logging for lost patient metric updates
+"""
+
+import asyncio
+import time
+
+import pytest
+from conftest import FakeSupabase
+from fastapi import Response
+from routers import logs
+from utils.adherence import calculate_adherence
+
+PATIENTS = [f"patient-{i}" for i in range(4)]
+
+def offline_store(monkeypatch, **options):
+    """Point routers.logs at a fresh fake store, without the AI feedback, risk model or dedupe window"""
+    store = FakeSupabase(latency=options.pop("latency", 0.002), **options)
+    monkeypatch.setattr(logs, "supabase", store)
+    monkeypatch.setattr(logs, "generate_ai_feedback", lambda adherence_percent, risk_label: "Keep going")
+    monkeypatch.setattr(logs, "predict_risk", lambda *features, **behavior: "Low")
+    monkeypatch.setattr(logs, "DOSE_DEDUPE_WINDOW_SECONDS", 0)
+    return store
+
+@pytest.fixture
+def store(monkeypatch):
+    return offline_store(monkeypatch)
+
+def stored_adherence(store, patient_id):
+    return next(p for p in store.tables["patients"] if p["id"] == patient_id)["adherence_percent"]
+
+def expected_adherence(store, patient_id):
+    return calculate_adherence([log for log in store.tables["dose_logs"] if log["patient_id"] == patient_id])
+
+def dose(patient_id, n):
+    status = "Taken" if n % 3 else "Missed"
+    return logs.DoseLogCreate(patient_id=patient_id, medication="Metformin", status=status, date=f"2025-01-{n % 28 + 1:02d}")
+
+async def log_doses(doses_per_patient):
+    requests = [
+        logs.log_dose(dose(patient_id, n), Response(), idempotency_key=None)
+        for n in range(doses_per_patient)
+        for patient_id in PATIENTS
+    ]
+    return await asyncio.gather(*requests)
+
+def test_no_lost_updates(store):
+    """Test that concurrent doses for the same patients leave correct metrics"""
+    print("Testing concurrent dose logging...")
+    store.tables = {"patients": [{"id": patient_id} for patient_id in PATIENTS], "dose_logs": []}
+    results = asyncio.run(log_doses(25))
+
+    assert all(result["success"] for result in results)
+    assert len(store.tables["dose_logs"]) == 25 * len(PATIENTS)
+    for patient_id in PATIENTS:
+        assert stored_adherence(store, patient_id) == expected_adherence(store, patient_id)
+    print("✅ No lost updates")
+
+def test_patients_processed_in_parallel(store):
+    """Test that doses for different patients do not wait on each other"""
+    print("Testing parallelism across patients...")
+    store.tables = {"patients": [{"id": patient_id} for patient_id in PATIENTS], "dose_logs": []}
+    started = time.perf_counter()
+    asyncio.run(log_doses(5))
+    elapsed = time.perf_counter() - started
+
+    # Each dose makes 5 store calls; fully serialized this would take 4 patients x 5 doses x 5 calls
+    serialized = len(PATIENTS) * 5 * 5 * store.latency
+    assert elapsed < serialized * 0.6, f"{elapsed:.3f}s vs {serialized:.3f}s serialized"
+    print(f"✅ {elapsed:.3f}s for work that takes {serialized:.3f}s serialized")
+
+def test_concurrent_writer_in_other_process(store, monkeypatch):
+    """Test that metrics are recomputed when another process logs a dose mid-update"""
+    print("Testing a concurrent writer in another process...")
+    patient_id = PATIENTS[0]
+    store.tables = {"patients": [{"id": patient_id}], "dose_logs": [{"id": "1", "patient_id": patient_id, "status": "Taken", "date": "2025-01-01"}]}
+
+    original_update = logs.update_patient_metrics
+    calls = []
+
+    def update_then_other_worker_inserts(pid, dose_logs):
+        result = original_update(pid, dose_logs)
+        if not calls:
+            store.tables["dose_logs"].append({"id": "2", "patient_id": pid, "status": "Missed", "date": "2025-01-02"})
+        calls.append(len(dose_logs))
+        return result
+
+    monkeypatch.setattr(logs, "update_patient_metrics", update_then_other_worker_inserts)
+    logs.refresh_patient_metrics(patient_id)
+
+    assert calls == [1, 2]
+    assert stored_adherence(store, patient_id) == 50.0
+    print("✅ Stale metrics recomputed")
+
+def test_history_past_row_cap(monkeypatch):
+    """Test that a patient with more logs than a response holds converges in one recompute"""
+    print("Testing metrics of a long dose history...")
+    store = offline_store(monkeypatch, latency=0, max_rows=1000)
+    patient_id = PATIENTS[0]
+    store.tables = {"patients": [{"id": patient_id}], "dose_logs": [
+        {"id": f"{n:04d}", "patient_id": patient_id, "medication": "Metformin",
+         "status": "Missed" if n % 4 == 0 else "Taken", "date": "2024-12-01"}
+        for n in range(1200)
+    ]}
+    asyncio.run(logs.log_dose(dose(patient_id, 1), Response(), idempotency_key=None))
+
+    # Metrics were stored once, from all 1201 logs
+    assert [query.action for query in store.queries if query.table == "patients"].count("update") == 1
+    assert stored_adherence(store, patient_id) == expected_adherence(store, patient_id)
+    assert len(store.tables["dose_logs"]) == 1201
+    print(f"✅ Converged in {len(store.requests)} calls")
+
+if __name__ == "__main__":
+    for test in (test_no_lost_updates, test_patients_processed_in_parallel):
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test(offline_store(monkeypatch))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_concurrent_writer_in_other_process(offline_store(monkeypatch), monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_history_past_row_cap(monkeypatch)
@@ -0,0 +1,233 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+import pytest
+from conftest import FakeSupabase
+from routers import logs
+from utils.adherence import calculate_adherence
+from utils.dose_queue import DurableDoseQueue, claim_dose_queue
+
+def make_queue_path():
+    return os.path.join(tempfile.mkdtemp(), "dose_queue.log")
+
+class StoreError(Exception):
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+class FlakyStore(FakeSupabase):
+    """
+    Store whose dose inserts time out `outages` times (after being written, the
+    response is lost) and reject doses of `unknown` patients with a foreign key error.
+    """
+    def __init__(self, tables, outages=0, unknown=()):
+        super().__init__(tables)
+        self.outages, self.unknown = outages, set(unknown)
+
+    def execute(self, query):
+        if query.table == "dose_logs" and query.action == "upsert":
+            if any(row["patient_id"] in self.unknown for row in query.payload):
+                raise StoreError("insert or update on table dose_logs violates foreign key constraint", code="23503")
+            if self.outages:
+                self.outages -= 1
+                super().execute(query)
+                raise StoreError("timed out")
+        return super().execute(query)
+
+def offline_flusher(monkeypatch, store, **settings):
+    """Point routers.logs' write-behind queue and store at fresh offline ones"""
+    queue = DurableDoseQueue(make_queue_path(), fsync=False)
+    monkeypatch.setattr(logs, "dose_queue", queue)
+    monkeypatch.setattr(logs, "supabase", store)
+    monkeypatch.setattr(logs, "predict_risk", lambda *features, **behavior: "Low")
+    for name, value in settings.items():
+        monkeypatch.setattr(logs, name, value)
+    return queue
+
+def queue_doses(queue, *patient_ids):
+    for n, patient_id in enumerate(patient_ids):
+        queue.append({"id": f"{patient_id}-{n}", "patient_id": patient_id, "medication": "Metformin",
+                      "status": "Missed" if n % 3 == 0 else "Taken", "date": f"2025-02-{n + 1:02d}"})
+
+def patient_updates(store):
+    return [dict((column, value) for column, _, value in query.filters)["id"]
+            for query in store.queries if query.table == "patients" and query.action == "update"]
+
+def test_queue_recovery():
+    """Test that unflushed doses survive a restart in order"""
+    print("Testing dose queue recovery...")
+    path = make_queue_path()
+    queue = DurableDoseQueue(path)
+    for i in range(5):
+        queue.append({"id": str(i), "patient_id": "p1", "status": "Taken"})
+    queue.commit(2, flush_seconds=0.01)
+
+    # Simulate a crash in the middle of an append
+    with open(path, "ab") as f:
+        f.write(b'{"id": "torn"')
+
+    recovered = DurableDoseQueue(path)
+    assert [entry["id"] for entry in recovered.peek_batch(10)] == ["2", "3", "4"]
+    recovered.append({"id": "5", "patient_id": "p1", "status": "Missed"})
+    assert [entry["id"] for entry in DurableDoseQueue(path).peek_batch(10)] == ["2", "3", "4", "5"]
+    print("✅ Pending doses recovered in order")
+
+def test_queue_compaction_and_dead_letter():
+    """Test that a fully flushed queue starts over and bad rows are set aside"""
+    print("Testing dose queue compaction...")
+    path = make_queue_path()
+    queue = DurableDoseQueue(path)
+    for i in range(3):
+        queue.append({"id": str(i), "patient_id": "p1", "status": "Taken"})
+    queue.dead_letter(1, "foreign key violation")
+    queue.commit(2, flush_seconds=0.02)
+
+    assert len(queue) == 0
+    assert os.path.getsize(path) == 0
+    assert len(DurableDoseQueue(path)) == 0
+    with open(queue.dead_letter_path) as f:
+        assert '"id": "0"' in f.read()
+    metrics = queue.metrics()
+    assert metrics["flushed"] == 2 and metrics["dead_lettered"] == 1
+    print("✅ Queue compacted and dead letters kept")
+
+def test_workers_claim_separate_files():
+    """Test that each worker gets its own queue file and one worker's flush keeps the others' doses"""
+    print("Testing dose queue files per worker...")
+    path = make_queue_path()
+    first, second = claim_dose_queue(path, fsync=False), claim_dose_queue(path, fsync=False)
+    assert first.path == path and second.path.endswith("dose_queue.1.log")
+
+    first.append({"id": "a", "patient_id": "p1", "status": "Taken"})
+    second.append({"id": "b", "patient_id": "p2", "status": "Taken"})
+    # The first worker flushes everything it has and starts its file over
+    first.commit(1)
+    assert os.path.getsize(path) == 0
+
+    # A restarted second worker claims the free file and recovers its dose
+    second.close()
+    restarted = claim_dose_queue(path, fsync=False)
+    assert restarted.path == second.path
+    assert [entry["id"] for entry in restarted.peek_batch(10)] == ["b"]
+    first.close()
+    restarted.close()
+    print("✅ Separate queue files per worker")
+
+def test_appends_while_flushing():
+    """Test that doses appended from threads while the flusher commits are all kept"""
+    print("Testing appends during flushes...")
+    path = make_queue_path()
+    queue = DurableDoseQueue(path, fsync=False)
+    flushed = []
+
+    def append(worker):
+        for i in range(300):
+            queue.append({"id": f"{worker}-{i}", "patient_id": "p1", "status": "Taken"})
+
+    threads = [threading.Thread(target=append, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads) or len(queue):
+        batch = queue.peek_batch(50)
+        flushed.extend(entry["id"] for entry in batch)
+        queue.commit(len(batch))
+
+    assert len(flushed) == len(set(flushed)) == 1200
+    assert len(DurableDoseQueue(path)) == 0
+    print("✅ No dose lost while flushing")
+
+def test_flusher_backs_off_and_retries(monkeypatch):
+    """Test that store outages are retried with growing delays and never insert a dose twice"""
+    print("Testing flusher backoff...")
+    store = FlakyStore({"patients": [{"id": "flush-p1"}], "dose_logs": []}, outages=3)
+    queue = offline_flusher(monkeypatch, store, DOSE_FLUSH_INTERVAL_SECONDS=0.01, DOSE_FLUSH_MAX_BACKOFF_SECONDS=0.05)
+    queue_doses(queue, "flush-p1", "flush-p1")
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def run():
+        idle = asyncio.Event()
+
+        async def sleep(seconds):
+            delays.append(seconds)
+            # Sleeping the plain interval means the flusher found the queue empty
+            if seconds == logs.DOSE_FLUSH_INTERVAL_SECONDS:
+                idle.set()
+            await real_sleep(0)
+
+        monkeypatch.setattr(logs.asyncio, "sleep", sleep)
+        flusher = asyncio.create_task(logs.run_dose_flusher())
+        await asyncio.wait_for(idle.wait(), timeout=5)
+        flusher.cancel()
+
+    asyncio.run(run())
+    assert delays[:4] == [0.02, 0.04, 0.05, 0.01]
+    # Every timed out attempt had written the batch; the retries left it as is
+    assert sorted(row["id"] for row in store.tables["dose_logs"]) == ["flush-p1-0", "flush-p1-1"]
+    assert len(queue) == 0 and queue.metrics()["flushed"] == 2
+    assert patient_updates(store) == ["flush-p1"]
+    print(f"✅ Flushed after {len(delays) - 1} backoffs")
+
+def test_poison_row_dead_lettered(monkeypatch):
+    """Test that a row failing permanently is set aside while the rows around it are inserted"""
+    print("Testing dead-lettering of a bad row...")
+    store = FlakyStore({"patients": [{"id": "flush-p1"}, {"id": "flush-p2"}], "dose_logs": []}, unknown={"ghost"})
+    queue = offline_flusher(monkeypatch, store)
+    queue_doses(queue, "flush-p1", "ghost", "flush-p2", "flush-p1")
+
+    assert asyncio.run(logs.flush_dose_queue()) == 4
+    assert [row["id"] for row in store.tables["dose_logs"]] == ["flush-p1-0", "flush-p2-2", "flush-p1-3"]
+    assert len(queue) == 0
+    metrics = queue.metrics()
+    assert metrics["flushed"] == 3 and metrics["dead_lettered"] == 1 and metrics["flush_failures"] == 1
+    with open(queue.dead_letter_path) as f:
+        dead = f.read()
+    assert '"ghost-1"' in dead and "foreign key" in dead and "flush-p1" not in dead
+    print("✅ Bad row dead-lettered, good rows stored")
+
+def test_metrics_refreshed_once_per_patient(monkeypatch):
+    """Test that a flushed batch recomputes each of its patients' metrics once"""
+    print("Testing metric refreshes after a flush...")
+    patient_ids = ["flush-p1", "flush-p2"]
+    store = FlakyStore({"patients": [{"id": patient_id} for patient_id in patient_ids], "dose_logs": []})
+    queue = offline_flusher(monkeypatch, store)
+    queue_doses(queue, "flush-p1", "flush-p2", "flush-p1", "flush-p1", "flush-p2", "flush-p1")
+
+    assert asyncio.run(logs.flush_dose_queue()) == 6
+    assert [query.action for query in store.queries if query.table == "dose_logs"].count("upsert") == 1
+    assert patient_updates(store) == patient_ids
+    for patient in store.tables["patients"]:
+        patient_logs = [row for row in store.tables["dose_logs"] if row["patient_id"] == patient["id"]]
+        assert patient["adherence_percent"] == calculate_adherence(patient_logs)
+    print("✅ One refresh per patient")
+
+def test_drain_on_shutdown(monkeypatch):
+    """Test that shutdown flushes every queued batch and keeps the doses on disk when the store is down"""
+    print("Testing queue drain on shutdown...")
+    store = FlakyStore({"patients": [{"id": "flush-p1"}], "dose_logs": []})
+    queue = offline_flusher(monkeypatch, store, DOSE_FLUSH_BATCH_SIZE=2)
+    queue_doses(queue, *["flush-p1"] * 5)
+
+    asyncio.run(logs.drain_dose_queue())
+    assert len(queue) == 0 and len(store.tables["dose_logs"]) == 5
+    assert [query.action for query in store.queries if query.table == "dose_logs"].count("upsert") == 3
+
+    # The store goes down for good: drain gives up without raising and the doses wait for the next start
+    queue_doses(queue, "flush-p1", "flush-p1")
+    store.outages = 10 ** 6
+    asyncio.run(logs.drain_dose_queue())
+    queue.close()
+    assert len(DurableDoseQueue(queue.path)) == 2
+    print("✅ Queue drained, undelivered doses kept")
+
+if __name__ == "__main__":
+    test_queue_recovery()
+    test_queue_compaction_and_dead_letter()
+    test_workers_claim_separate_files()
+    test_appends_while_flushing()
+    for test in (test_flusher_backs_off_and_retries, test_poison_row_dead_lettered,
+                 test_metrics_refreshed_once_per_patient, test_drain_on_shutdown):
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test(monkeypatch)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Test dose log compaction into monthly rollups and reading history back from them
+"""
+
+import gzip
+import json
+import os
+import random
+import tempfile
+from datetime import date, timedelta
+
+import compact_dose_logs
+from conftest import FakeSupabase
+from utils.adherence import calculate_adherence, count_missed_doses
+from utils.adherence_bitmaps import AdherenceBitmapStore
+from utils.dose_rollups import ROLLUPS_TABLE, combine_history, compaction_cutoff, fetch_patient_history, fetch_rollups
+from utils.feature_store import BehaviorFeatureStore
+from utils.rolling_adherence import RollingAdherenceTracker
+
+class FlakySupabase(FakeSupabase):
+    """Fails the next `fail_deletes` deletes, as if the connection dropped"""
+    def __init__(self, tables):
+        super().__init__(tables)
+        self.fail_deletes = 0
+
+    def execute(self, query):
+        if query.action == "delete" and self.fail_deletes:
+            self.fail_deletes -= 1
+            raise ConnectionError("connection reset")
+        return super().execute(query)
+
+TODAY = date(2025, 6, 15)
+
+def clinic(patients=6, days=700):
+    rng = random.Random(7)
+    tables = {"patients": [], "dose_logs": []}
+    for n in range(patients):
+        patient_id = f"patient-{n}"
+        tables["patients"].append({"id": patient_id, "name": f"Patient {n}"})
+        for offset in range(days):
+            for medication, doses in (("A", 2), ("B", 1)):
+                for _ in range(doses):
+                    if rng.random() < 0.8:
+                        status = rng.choice(["Taken", "Taken", "Taken", "Missed", "Inconsistent"])
+                        tables["dose_logs"].append({
+                            "id": len(tables["dose_logs"]), "patient_id": patient_id, "medication": medication,
+                            "status": status, "date": (TODAY - timedelta(days=offset)).isoformat()
+                        })
+    return FlakySupabase(tables)
+
+def describe(patient_id, dose_logs):
+    """Every metric the server derives from a patient's dose history"""
+    today = TODAY.toordinal()
+    rolling, features, calendars = RollingAdherenceTracker(), BehaviorFeatureStore(), AdherenceBitmapStore()
+    rolling.load(patient_id, dose_logs)
+    features.load(patient_id, dose_logs)
+    calendars.load(patient_id, dose_logs)
+    return {
+        "adherence": round(calculate_adherence(dose_logs), 6),
+        "missed": count_missed_doses(dose_logs),
+        "rolling": rolling.windows_by_medication(patient_id, today),
+        "features": {name: round(float(value), 4) for name, value in features.features(patient_id, today).items()},
+        "missed_days": calendars.missed_days(patient_id, today - 700, today),
+        "heatmap": calendars.heatmap(patient_id, today - 700, today, "A", today),
+        "streaks": calendars.streaks(patient_id, today - 700, today)
+    }
+
+def history(supabase, patient_id):
+    raw = [log for log in supabase.tables["dose_logs"] if log["patient_id"] == patient_id]
+    return combine_history(raw, fetch_rollups(supabase, [patient_id]).get(patient_id, []))
+
+def test_compaction_preserves_metrics():
+    """Test that metrics from rollups plus recent logs equal those from the full history"""
+    print("Testing compaction...")
+    supabase = clinic()
+    before = {p["id"]: describe(p["id"], history(supabase, p["id"])) for p in supabase.tables["patients"]}
+    logs_before = len(supabase.tables["dose_logs"])
+    cutoff = compaction_cutoff(TODAY.toordinal(), 365)
+
+    with tempfile.TemporaryDirectory() as directory:
+        totals = compact_dose_logs.run(supabase, cutoff, directory, page_size=4)
+        archived = []
+        for path in totals["archives"]:
+            with gzip.open(path, "rt") as f:
+                archived.extend(json.loads(line) for line in f)
+
+    remaining = supabase.tables["dose_logs"]
+    assert all(date.fromisoformat(log["date"]).toordinal() >= cutoff for log in remaining)
+    assert len(archived) == totals["logs"] == logs_before - len(remaining)
+    # About 12 months x 2 medications per patient instead of ~1000 rows
+    assert len(supabase.tables[ROLLUPS_TABLE]) == totals["rollups"] <= 6 * 2 * 14
+    for patient_id, metrics in before.items():
+        assert describe(patient_id, history(supabase, patient_id)) == metrics, patient_id
+    print(f"✅ {totals['logs']} logs into {totals['rollups']} rollups, metrics unchanged")
+
+def test_interrupted_run_and_late_logs():
+    """Test that a run failing after its journal is finished by the next, and late logs are merged"""
+    print("Testing interrupted compaction...")
+    supabase = clinic(patients=2, days=500)
+    cutoff = compaction_cutoff(TODAY.toordinal(), 365)
+    expected = {p["id"]: describe(p["id"], history(supabase, p["id"])) for p in supabase.tables["patients"]}
+
+    with tempfile.TemporaryDirectory() as directory:
+        supabase.fail_deletes = 1
+        try:
+            compact_dose_logs.run(supabase, cutoff, directory)
+            assert False, "the delete should have failed"
+        except ConnectionError:
+            pass
+        assert os.path.exists(os.path.join(directory, "compaction.pending.json"))
+        # Rollups are stored but the raw rows are still there: readers must not count them twice
+        assert describe("patient-0", history(supabase, "patient-0")) == expected["patient-0"]
+
+        compact_dose_logs.run(supabase, cutoff, directory)
+        assert not os.path.exists(os.path.join(directory, "compaction.pending.json"))
+        for patient_id, metrics in expected.items():
+            assert describe(patient_id, history(supabase, patient_id)) == metrics
+
+        # A dose logged late for a compacted month is folded into its rollup by the next run
+        late = {"id": 10 ** 6, "patient_id": "patient-0", "medication": "B", "status": "Missed", "date": "2024-02-10"}
+        supabase.tables["dose_logs"].append(late)
+        compact_dose_logs.run(supabase, cutoff, directory)
+        rollup = next(r for r in supabase.tables[ROLLUPS_TABLE]
+                      if r["patient_id"] == "patient-0" and r["medication"] == "B" and r["month"] == "2024-02-01")
+        assert rollup["daily"]["10"][1] >= 1
+        assert count_missed_doses(history(supabase, "patient-0")) == expected["patient-0"]["missed"] + 1
+    print("✅ Interrupted run finished from its journal, late dose merged")
+
+def test_history_pages_past_row_cap():
+    """Test that a patient's history is read whole when it has more raw logs than a response holds"""
+    print("Testing history paging...")
+    logs = [{"id": n, "patient_id": "patient-0", "medication": "A", "status": "Taken" if n % 4 else "Missed",
+             "date": (TODAY - timedelta(days=n % 300)).isoformat()} for n in range(1200)]
+    supabase = FakeSupabase({"dose_logs": logs, ROLLUPS_TABLE: []}, max_rows=1000)
+    history, raw_count = fetch_patient_history(supabase, "patient-0")
+    assert raw_count == 1200 and len(history) == 1200
+    assert count_missed_doses(history) == 300
+    assert supabase.requests.count("dose_logs") == 2
+    print("✅ 1200 logs read in 2 pages")
+
+if __name__ == "__main__":
+    test_compaction_preserves_metrics()
+    test_interrupted_run_and_late_logs()
+    test_history_pages_past_row_cap()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test conditional GETs validated by the stored patient version
+"""
+
+from conftest import FakeSupabase
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers import patients, treatments
+from utils.etag import is_not_modified, patient_validators
+
+def test_validators():
+    """Test ETag and Last-Modified derived from the patient row"""
+    print("Testing patient validators...")
+    patient = {"id": "p1", "version": 7, "updated_at": "2025-03-01T10:00:00.123+00:00"}
+    validators = patient_validators("patient", patient)
+    assert validators["ETag"] == 'W/"patient-7"'
+    assert validators["Last-Modified"] == "Sat, 01 Mar 2025 10:00:00 GMT"
+
+    assert is_not_modified({"if-none-match": '"patient-7"'}, validators)
+    assert not is_not_modified({"if-none-match": 'W/"patient-6"'}, validators)
+    assert is_not_modified({"if-modified-since": "Sat, 01 Mar 2025 10:00:00 GMT"}, validators)
+    assert not is_not_modified({"if-modified-since": "Sat, 01 Mar 2025 09:59:59 GMT"}, validators)
+    # Without a version column conditional requests are answered in full
+    assert patient_validators("patient", {"id": "p1"}) is None
+    assert not is_not_modified({"if-none-match": "*"}, None)
+    print("✅ Validators follow the stored version")
+
+def test_write_through_another_worker(fake_supabase):
+    """Test that a write made through another worker invalidates the ETag this worker sent"""
+    print("Testing conditional GETs across workers...")
+    supabase = fake_supabase
+    supabase.tables.update({
+        "patients": [{"id": "p1", "name": "Ann", "age": 30, "gender": "F", "condition": "Asthma",
+                      "version": 1, "updated_at": "2025-03-01T10:00:00+00:00"}],
+        "treatments": [{"id": "t1", "patient_id": "p1", "medication": "Inhaler", "dosage": "2 puffs",
+                        "frequency": "Once daily", "start_date": "2025-03-01"}]
+    })
+    patients.supabase = treatments.supabase = supabase
+    app = FastAPI()
+    app.include_router(patients.router)
+    app.include_router(treatments.router)
+    client = TestClient(app)
+
+    for path in ("/api/patient/p1", "/api/treatment/patient/p1"):
+        first = client.get(path)
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+
+        supabase.requests.clear()
+        repeat = client.get(path, headers={"If-None-Match": etag})
+        assert repeat.status_code == 304 and repeat.headers["ETag"] == etag
+        # Only the patient row was read
+        assert supabase.requests == ["patients"]
+
+        # Another worker adds a treatment; the trigger bumps the stored version
+        supabase.tables["patients"][0]["version"] += 1
+        changed = client.get(path, headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    print("✅ Stale ETags revalidated after writes on other workers")
+
+class UnmigratedSupabase(FakeSupabase):
+    """Patients table without the version columns: like PostgREST, selecting them fails"""
+    def execute(self, query):
+        if query.table == "patients" and query.columns != "*" and "version" in query.columns:
+            raise Exception('column patients.version does not exist')
+        return super().execute(query)
+
+def test_without_version_columns():
+    """Test that patient and treatment reads still answer in full before the version migration"""
+    print("Testing reads without the version columns...")
+    supabase = UnmigratedSupabase({
+        "patients": [{"id": "p1", "name": "Ann", "age": 30, "gender": "F", "condition": "Asthma"}],
+        "treatments": [{"id": "t1", "patient_id": "p1", "medication": "Inhaler", "dosage": "2 puffs",
+                        "frequency": "Once daily", "start_date": "2025-03-01"}],
+        "dose_logs": [{"id": 1, "patient_id": "p1", "medication": "Inhaler", "status": "Taken", "date": "2025-03-01"}]
+    })
+    saved = patients.supabase, treatments.supabase
+    patients.supabase = treatments.supabase = supabase
+    try:
+        app = FastAPI()
+        app.include_router(patients.router)
+        app.include_router(treatments.router)
+        client = TestClient(app)
+        for path in ("/api/patient/p1", "/api/treatment/patient/p1"):
+            response = client.get(path, headers={"If-None-Match": "*"})
+            assert response.status_code == 200 and "ETag" not in response.headers, path
+        assert patients.warm_recent_patients(days=10 ** 4) == 1
+    finally:
+        patients.supabase, treatments.supabase = saved
+    print("✅ Full answers without validators")
+
+if __name__ == "__main__":
+    test_validators()
+    test_write_through_another_worker(FakeSupabase())
+    test_without_version_columns()
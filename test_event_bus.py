@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test live event fan-out to SSE subscribers
+"""
+
+import asyncio
+import json
+import sys
+import types
+
+from utils.event_bus import EventBroadcaster, Subscription
+
+sys.modules.setdefault("database", types.ModuleType("database")).supabase = None
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+def drain(subscription):
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait())
+    return events
+
+def test_fan_out_and_filters():
+    """Test that events reach every subscriber, filtered by patient where asked"""
+    print("Testing event fan-out...")
+
+    async def scenario():
+        broadcaster = EventBroadcaster()
+        everyone = broadcaster.subscribe()
+        patient_one = broadcaster.subscribe(["p1"])
+        broadcaster.publish("dose_logged", patient_id="p1", status="Taken")
+        broadcaster.publish("patient_created", patient_id="p2")
+        broadcaster.unsubscribe(patient_one)
+        broadcaster.publish("dose_logged", patient_id="p1", status="Missed")
+        return broadcaster, drain(everyone), drain(patient_one)
+
+    broadcaster, everyone, patient_one = asyncio.run(scenario())
+    assert [event["type"] for event in everyone] == ["dose_logged", "patient_created", "dose_logged"]
+    assert [event["id"] for event in everyone] == [1, 2, 3]
+    assert [(event["patient_id"], event["status"]) for event in patient_one] == [("p1", "Taken")]
+    assert broadcaster.metrics() == {"subscribers": 1, "published": 3, "dropped": 0}
+    print("✅ Events fanned out and filtered")
+
+def test_slow_consumer_gets_resync():
+    """Test that a subscriber a full buffer behind loses its backlog for one resync event"""
+    print("Testing slow subscribers...")
+
+    async def scenario():
+        broadcaster = EventBroadcaster()
+        slow = Subscription(buffer_size=3)
+        broadcaster._subscriptions.add(slow)
+        for n in range(4):
+            broadcaster.publish("dose_logged", patient_id="p1", n=n)
+        return broadcaster, drain(slow)
+
+    broadcaster, events = asyncio.run(scenario())
+    assert [event["type"] for event in events] == ["resync"]
+    assert broadcaster.dropped == 3
+    print("✅ Slow subscriber resynced instead of blocking the publisher")
+
+def test_stream_unsubscribes_on_disconnect():
+    """Test that the SSE stream delivers events and unsubscribes once the client disconnects"""
+    print("Testing the SSE stream...")
+    from routers import events
+
+    async def scenario():
+        request = FakeRequest()
+        response = await events.stream_events(request, patient_id=["p1"])
+        stream = response.body_iterator
+        assert (await stream.__anext__()).startswith("retry:")
+        subscribers = events.event_broadcaster.metrics()["subscribers"]
+
+        events.event_broadcaster.publish("dose_logged", patient_id="p1", status="Taken")
+        chunk = await stream.__anext__()
+        request.disconnected = True
+        try:
+            await stream.__anext__()
+            ended = False
+        except StopAsyncIteration:
+            ended = True
+        return subscribers, chunk, ended, events.event_broadcaster.metrics()["subscribers"]
+
+    subscribers_before = events.event_broadcaster.metrics()["subscribers"]
+    subscribers, chunk, ended, subscribers_after = asyncio.run(scenario())
+    assert subscribers == subscribers_before + 1
+    assert chunk.startswith("id: ") and "event: dose_logged" in chunk
+    assert json.loads(chunk.split("data: ", 1)[1])["status"] == "Taken"
+    assert ended and subscribers_after == subscribers_before
+    print("✅ Stream delivered the event and unsubscribed on disconnect")
+
+if __name__ == "__main__":
+    test_fan_out_and_filters()
+    test_slow_consumer_gets_resync()
+    test_stream_unsubscribes_on_disconnect()
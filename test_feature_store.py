@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test the incremental behavioral feature store
+"""
+
+import random
+from datetime import date
+import numpy as np
+from utils.feature_store import BehaviorFeatureStore, BEHAVIOR_FEATURES
+
+TODAY = date(2025, 3, 31).toordinal()
+
+def day(offset):
+    return date.fromordinal(TODAY - offset).isoformat()
+
+def test_streaks_and_silence():
+    """Test streaks, days since last log and per-medication adherence"""
+    print("Testing streak features...")
+    store = BehaviorFeatureStore()
+    logs = [{"medication": "A", "status": "Taken", "date": day(d)} for d in range(10, 2, -1)]
+    logs[2]["status"] = "Missed"  # breaks the streak 8 days ago
+    logs.append({"medication": "B", "status": "Missed", "date": day(3)})
+    store.load("p1", logs)
+
+    features = store.features("p1", TODAY)
+    assert features["current_streak"] == 0  # the latest day has a missed dose
+    assert features["longest_streak"] == 4
+    assert features["days_since_last_log"] == 3
+    assert features["min_medication_adherence"] == 0
+    assert features["medication_count"] == 2
+
+    assert store.record("p1", "B", "Taken", day(2))
+    assert store.features("p1", TODAY)["current_streak"] == 1
+    assert not store.record("p1", "A", "Taken", day(20))  # out of order, needs a reload
+    print("✅ Streak features")
+
+def test_incremental_matches_reload():
+    """Test that recording doses one by one gives the same features as a full load"""
+    print("Testing incremental updates...")
+    rng = random.Random(7)
+    logs = sorted(
+        ({"medication": rng.choice("ABC"), "status": rng.choice(["Taken", "Taken", "Missed"]), "date": day(rng.randint(0, 40))} for _ in range(200)),
+        key=lambda log: log["date"]
+    )
+    incremental, loaded = BehaviorFeatureStore(capacity=1), BehaviorFeatureStore()
+    incremental.load("p1", [])
+    for log in logs:
+        assert incremental.record("p1", log["medication"], log["status"], log["date"])
+    loaded.load("p1", list(reversed(logs)))
+
+    np.testing.assert_allclose(incremental.matrix(["p1"], TODAY), loaded.matrix(["p1"], TODAY), rtol=1e-5)
+    print("✅ Incremental equals reload")
+
+def test_dense_matrix():
+    """Test the cohort matrix, unknown patients and row reuse"""
+    print("Testing dense matrix...")
+    store = BehaviorFeatureStore(capacity=2)
+    for n in range(5):
+        store.load(f"p{n}", [{"medication": "A", "status": "Taken", "date": day(0)}])
+    store.forget("p1")
+    store.load("p5", [{"medication": "A", "status": "Missed", "date": day(1)}])
+
+    matrix = store.matrix(["p0", "p5", "unknown"], TODAY)
+    assert matrix.shape == (3, len(BEHAVIOR_FEATURES)) and matrix.dtype == np.float32
+    assert matrix[0, 0] == 1 and matrix[1, 2] == 1 and not matrix[2].any()
+    assert len(store) == 5
+    print("✅ Dense matrix")
+
+if __name__ == "__main__":
+    test_streaks_and_silence()
+    test_incremental_matches_reload()
+    test_dense_matrix()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test connection reuse and pool saturation metrics of the pooled HTTP clients
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from utils.http_clients import CallLimiter, HttpClients, create_supabase_client, http_clients
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    connections = set()
+    delay = 0
+
+    def do_GET(self):
+        Handler.connections.add(self.client_address)
+        time.sleep(Handler.delay)
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_supabase_requests_reuse_connections():
+    """Test that sequential Supabase queries share one kept-alive connection"""
+    print("Testing keep-alive...")
+    server = serve()
+    Handler.connections.clear()
+    try:
+        supabase = create_supabase_client(f"http://127.0.0.1:{server.server_port}", "x" * 40)
+        for _ in range(20):
+            supabase.table("patients").select("id").execute()
+        metrics = http_clients.metrics()["supabase"]
+        assert len(Handler.connections) == 1
+        assert metrics["requests"] >= 20 and metrics["open_connections"] == 1 and metrics["idle_connections"] == 1
+        print(f"✅ 20 queries over {len(Handler.connections)} connection")
+    finally:
+        server.shutdown()
+        http_clients.close()
+
+def test_pool_saturation():
+    """Test that waits beyond the pool timeout are counted"""
+    print("Testing pool saturation...")
+    server = serve()
+    Handler.delay = 0.5
+    clients = HttpClients()
+    try:
+        client = clients.client("slow", max_connections=1, max_keepalive_connections=1, read_timeout=5)
+        url = f"http://127.0.0.1:{server.server_port}/"
+        client.timeout = httpx.Timeout(5, pool=0.1)
+        results = []
+
+        def get():
+            try:
+                results.append(client.get(url).status_code)
+            except httpx.PoolTimeout:
+                results.append("pool timeout")
+
+        threads = [threading.Thread(target=get) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        assert clients.metrics()["slow"]["saturation"] >= 1
+        for thread in threads:
+            thread.join()
+        metrics = clients.metrics()["slow"]
+        assert sorted(map(str, results)) == ["200", "pool timeout", "pool timeout"]
+        assert metrics["pool_timeouts"] == 2 and metrics["peak_in_flight"] == 3
+        print("✅ Pool saturation")
+    finally:
+        Handler.delay = 0
+        server.shutdown()
+        clients.close()
+
+def test_call_limiter():
+    """Test bounded concurrency for SDK calls"""
+    print("Testing call limiter...")
+    limiter = CallLimiter("test", 1, wait_timeout=0.05)
+    with limiter.slot():
+        try:
+            with limiter.slot():
+                assert False, "the second call should not get a slot"
+        except TimeoutError:
+            pass
+    metrics = limiter.metrics()
+    assert metrics["calls"] == 1 and metrics["saturated"] == 1 and metrics["in_flight"] == 0
+    print("✅ Call limiter")
+
+if __name__ == "__main__":
+    test_supabase_requests_reuse_connections()
+    test_pool_saturation()
+    test_call_limiter()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Test Idempotency-Key replay and dedupe of repeated dose logs
+"""
+
+import asyncio
+
+from conftest import FakeSupabase
+from fastapi import HTTPException, Response
+from routers import logs
+
+def log(status="Taken", key=None, medication="Metformin"):
+    response = Response()
+    dose = logs.DoseLogCreate(patient_id="patient-1", medication=medication, status=status, date="2025-01-10")
+    return response, logs.log_dose(dose, response, idempotency_key=key)
+
+def run_offline(test):
+    """Run a test against a fresh fake store with fresh replay caches"""
+    def wrapper():
+        store = FakeSupabase({"patients": [{"id": "patient-1"}], "dose_logs": []}, latency=0.002)
+        saved = (logs.supabase, logs.generate_ai_feedback, logs.predict_risk, logs.DOSE_DEDUPE_WINDOW_SECONDS)
+        logs.supabase = store
+        logs.generate_ai_feedback = lambda adherence_percent, risk_label: "Keep going"
+        logs.predict_risk = lambda *features, **behavior: "Low"
+        logs.idempotency_store.clear()
+        logs.dose_dedupe_store.clear()
+        try:
+            test(store)
+        finally:
+            logs.supabase, logs.generate_ai_feedback, logs.predict_risk, logs.DOSE_DEDUPE_WINDOW_SECONDS = saved
+    wrapper.__name__, wrapper.__doc__ = test.__name__, test.__doc__
+    return wrapper
+
+@run_offline
+def test_replay_with_same_key(store):
+    """Test that a repeated Idempotency-Key returns the original dose without logging it again"""
+    print("Testing Idempotency-Key replay...")
+    logs.DOSE_DEDUPE_WINDOW_SECONDS = 0
+
+    async def scenario():
+        first_response, first = log(key="K1")
+        first = await first
+        replay_response, replay = log(key="K1")
+        return first, first_response, await replay, replay_response
+
+    first, first_response, replay, replay_response = asyncio.run(scenario())
+    assert replay["data"]["dose_log_id"] == first["data"]["dose_log_id"]
+    assert "Idempotent-Replayed" not in first_response.headers
+    assert replay_response.headers["Idempotent-Replayed"] == "true"
+    assert len(store.tables["dose_logs"]) == 1
+    print("✅ Same key replayed the original dose")
+
+@run_offline
+def test_key_reused_for_different_dose(store):
+    """Test that reusing an Idempotency-Key for a different dose is rejected"""
+    print("Testing Idempotency-Key reuse with a different body...")
+    logs.DOSE_DEDUPE_WINDOW_SECONDS = 0
+
+    async def scenario():
+        await log(key="K2")[1]
+        try:
+            await log(status="Missed", key="K2")[1]
+        except HTTPException as e:
+            return e.status_code
+        return None
+
+    assert asyncio.run(scenario()) == 422
+    assert len(store.tables["dose_logs"]) == 1
+    print("✅ Reused key rejected with 422")
+
+@run_offline
+def test_dedupe_window(store):
+    """Test that an identical dose without a key is replayed within the dedupe window only"""
+    print("Testing dose dedupe window...")
+    logs.DOSE_DEDUPE_WINDOW_SECONDS = 10
+
+    async def scenario():
+        first = await log()[1]
+        repeat_response, repeat = log()
+        repeat = await repeat
+        other = await log(medication="Aspirin")[1]
+        return first, repeat, repeat_response, other
+
+    first, repeat, repeat_response, other = asyncio.run(scenario())
+    assert repeat["data"]["dose_log_id"] == first["data"]["dose_log_id"]
+    assert repeat_response.headers["Idempotent-Replayed"] == "true"
+    assert other["data"]["dose_log_id"] != first["data"]["dose_log_id"]
+    assert len(store.tables["dose_logs"]) == 2
+    print("✅ Double tap deduplicated, other medication logged")
+
+@run_offline
+def test_concurrent_repeats_log_once(store):
+    """Test that a repeat sent while the original is still being logged waits for it instead of logging again"""
+    print("Testing concurrent requests with the same Idempotency-Key...")
+    logs.DOSE_DEDUPE_WINDOW_SECONDS = 10
+
+    async def scenario():
+        (first_response, first), (repeat_response, repeat) = log(key="K"), log(key="K")
+        double_tap = log(medication="Aspirin")[1], log(medication="Aspirin")[1]
+        return first_response, repeat_response, await asyncio.gather(first, repeat, *double_tap)
+
+    first_response, repeat_response, (first, repeat, tap, second_tap) = asyncio.run(scenario())
+    assert repeat["data"]["dose_log_id"] == first["data"]["dose_log_id"]
+    assert second_tap["data"]["dose_log_id"] == tap["data"]["dose_log_id"]
+    assert repeat_response.headers["Idempotent-Replayed"] == "true"
+    assert len(store.tables["dose_logs"]) == 2
+    assert logs.in_flight_doses == {}
+    print("✅ Concurrent repeats logged once")
+
+@run_offline
+def test_concurrent_key_reuse_and_failure(store):
+    """Test that a key in flight rejects a different dose, and repeats of a failed dose can retry"""
+    print("Testing concurrent key reuse and failed originals...")
+    logs.DOSE_DEDUPE_WINDOW_SECONDS = 0
+    insert = logs.insert_dose_log
+    failures = []
+
+    def insert_failing_once(dose_data, log_date):
+        if not failures:
+            failures.append(log_date)
+            raise ConnectionError("connection reset")
+        return insert(dose_data, log_date)
+
+    async def outcome(request):
+        try:
+            return (await request)["data"]["dose_log_id"]
+        except HTTPException as e:
+            return e.status_code
+
+    async def scenario():
+        mismatch = await asyncio.gather(outcome(log(key="K3")[1]), outcome(log(status="Missed", key="K3")[1]))
+        logs.insert_dose_log = insert_failing_once
+        try:
+            failed = await asyncio.gather(outcome(log(key="K4")[1]), outcome(log(key="K4")[1]))
+        finally:
+            logs.insert_dose_log = insert
+        replayed = await outcome(log(key="K4")[1])
+        return mismatch, failed, replayed
+
+    mismatch, failed, replayed = asyncio.run(scenario())
+    assert mismatch[1] == 422 and isinstance(mismatch[0], str)
+    # The original failed and released the key, so the repeat waiting behind it logged the dose
+    assert failed[0] == 500 and isinstance(failed[1], str)
+    assert replayed == failed[1] and len(store.tables["dose_logs"]) == 2
+    assert logs.in_flight_doses == {}
+    print("✅ Reused key rejected, failed dose retried")
+
+if __name__ == "__main__":
+    test_replay_with_same_key()
+    test_key_reused_for_different_dose()
+    test_dedupe_window()
+    test_concurrent_repeats_log_once()
+    test_concurrent_key_reuse_and_failure()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test the shared, memory-mapped model store used by all uvicorn workers
+"""
+
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from utils.file_lock import FileLock
+from utils.model_store import SharedModelStore
+
+def train(n_features=4):
+    X = np.random.RandomState(0).uniform(0, 100, (200, n_features))
+    y = np.where(X[:, 0] > 50, "Low", "High")
+    return LogisticRegression().fit(X, y)
+
+def is_current(model):
+    return model.n_features_in_ == 4
+
+def load_in_worker(path, results):
+    store = SharedModelStore(path, build=train, is_current=is_current)
+    store.get()
+    results.put(store.metrics())
+
+def test_workers_build_once():
+    """Test that concurrent workers build a missing model once and all map it"""
+    print("Testing concurrent workers...")
+    path = os.path.join(tempfile.mkdtemp(), "risk_model.pkl")
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=load_in_worker, args=(path, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    metrics = [results.get() for _ in workers]
+
+    assert sum(m["builds_by_this_worker"] for m in metrics) == 1
+    assert all(m["ready"] and m["memory_mapped_arrays"] > 0 for m in metrics)
+    print("✅ Model built once and memory mapped by every worker")
+
+def test_outdated_model_rebuilt():
+    """Test that an artifact failing is_current is replaced and reloaded"""
+    print("Testing outdated artifact...")
+    path = os.path.join(tempfile.mkdtemp(), "risk_model.pkl")
+    store = SharedModelStore(path, build=lambda: train(2))
+    store.get()
+
+    store = SharedModelStore(path, build=train, is_current=is_current)
+    assert store.get().n_features_in_ == 4
+    assert store.builds == 1
+    print("✅ Outdated model retrained")
+
+def test_threads_share_the_lock():
+    """Test that threads rebuilding through one store take turns and leave the lock free"""
+    print("Testing concurrent rebuilds in one worker...")
+    path = os.path.join(tempfile.mkdtemp(), "risk_model.pkl")
+    building, overlaps = [], []
+
+    def slow_train():
+        building.append(threading.get_ident())
+        overlaps.append(len(building))
+        time.sleep(0.05)
+        building.pop()
+        return train()
+
+    store = SharedModelStore(path, build=slow_train, is_current=is_current)
+    threads = [threading.Thread(target=store.rebuild) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == [1, 1] and store.builds == 2
+    assert not store.lock.held
+    # Another worker can take the lock: no descriptor was leaked while locked
+    other = FileLock(path + ".lock")
+    assert other.acquire(blocking=False)
+    other.release()
+    print("✅ Rebuilds serialized and the lock released")
+
+if __name__ == "__main__":
+    test_workers_build_once()
+    test_outdated_model_rebuilt()
+    test_threads_share_the_lock()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Test batch NFC provisioning against a simulated reader
+"""
+
+import argparse
+import os
+import tempfile
+import nfc_writer
+from conftest import FakeSupabase
+from nfc_writer import provision_batch, ProgressLog, SimulatedTagWriter, TagWriteError, UsbTagWriter, get_patient_url
+
+class FakeLinkIssuer:
+    """Issues numbered codes and remembers what happened to them"""
+
+    def __init__(self):
+        self.issued, self.attached, self.discarded = 0, {}, []
+
+    def issue(self, patient):
+        self.issued += 1
+        code = f"code{self.issued}"
+        return code, f"http://t.example/p/{code}"
+
+    def attach_tag(self, code, tag_id):
+        self.attached[code] = tag_id
+
+    def discard(self, code):
+        self.discarded.append(code)
+
+class FakeNdef:
+    def __init__(self):
+        self.records, self.is_writeable, self.has_changed = [], True, False
+
+class FakeTag:
+    def __init__(self, reader, identifier):
+        self.reader, self.identifier, self.ndef = reader, identifier, FakeNdef()
+
+    @property
+    def is_present(self):
+        self.reader.polls += 1
+        return self.reader.tag is self
+
+class FakeReader:
+    """Reader holding one tag at a time, as placed by the operator"""
+    def __init__(self):
+        self.tag, self.polls = None, 0
+
+    def connect(self, rdwr, terminate):
+        return self.tag
+
+class FakeReaderTagWriter(UsbTagWriter):
+    """UsbTagWriter on a fake reader instead of a USB session"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+PATIENTS = [{"id": f"patient-{i}", "name": f"Patient {i}"} for i in range(5)]
+
+def test_batch_with_retries():
+    """Test that failed taps are retried and persistent failures are logged"""
+    print("Testing batch provisioning...")
+    progress_log = ProgressLog(os.path.join(tempfile.mkdtemp(), "progress.jsonl"))
+
+    # Attempt 1 fails once (retried), patient 3 fails all three attempts
+    writer = SimulatedTagWriter(failures={1: "Verification failed", 4: "No tag", 5: "No tag", 6: "No tag"})
+    summary = provision_batch(PATIENTS, writer, progress_log, max_attempts=3)
+
+    assert summary == {"total": 5, "skipped": 0, "written": 4, "failed": 1}
+    assert sorted(writer.tags.values()) == sorted(get_patient_url(p) for p in PATIENTS if p["id"] != "patient-3")
+    assert progress_log.completed() == {p["id"] for p in PATIENTS} - {"patient-3"}
+    print("✅ Batch written with retries")
+
+def test_batch_resume():
+    """Test that a rerun only writes the patients not yet done"""
+    print("Testing batch resume...")
+    progress_log = ProgressLog(os.path.join(tempfile.mkdtemp(), "progress.jsonl"))
+    provision_batch(PATIENTS[:2], SimulatedTagWriter(), progress_log)
+
+    writer = SimulatedTagWriter()
+    summary = provision_batch(PATIENTS, writer, progress_log)
+    assert summary["skipped"] == 2 and summary["written"] == 3
+    assert len(writer.tags) == 3
+    print("✅ Batch resumed where it stopped")
+
+def test_batch_short_links():
+    """Test that each tag gets its own short link and failed links are revoked"""
+    print("Testing batch short links...")
+    progress_log = ProgressLog(os.path.join(tempfile.mkdtemp(), "progress.jsonl"))
+    writer, links = SimulatedTagWriter(failures={1: "No tag", 2: "No tag"}), FakeLinkIssuer()
+    summary = provision_batch(PATIENTS[:3], writer, progress_log, max_attempts=2, links=links)
+
+    assert summary["written"] == 2 and summary["failed"] == 1
+    assert sorted(writer.tags.values()) == ["http://t.example/p/code1", "http://t.example/p/code3"]
+    assert links.attached == {"code1": "sim000000", "code3": "sim000003"}
+    assert links.discarded == ["code2"]
+    print("✅ One short link per tag")
+
+def test_tag_left_on_reader():
+    """Test that a tag left on the reader is never overwritten with the next patient's link"""
+    print("Testing a tag left on the reader...")
+    progress_log = ProgressLog(os.path.join(tempfile.mkdtemp(), "progress.jsonl"))
+    reader = FakeReader()
+    writer = FakeReaderTagWriter(timeout=0.2)
+    writer.clf = reader
+    first = reader.tag = FakeTag(reader, b"\x01")
+
+    assert writer.write_tag("http://t.example/p/a") == "01"
+    # The operator never lifts the tag: waiting for removal times out instead of rewriting it
+    try:
+        writer.write_tag("http://t.example/p/b")
+        assert False, "the tag left on the reader should not be written"
+    except TagWriteError as e:
+        assert "still on the reader" in str(e)
+    assert first.ndef.records[0].iri == "http://t.example/p/a"
+
+    # Lifted and put back: the same tag is refused
+    writer.last_tag = None
+    try:
+        writer.write_tag("http://t.example/p/b")
+        assert False, "the previous patient's tag should be refused"
+    except TagWriteError as e:
+        assert "previous patient" in str(e)
+    assert first.ndef.records[0].iri == "http://t.example/p/a"
+
+    # Swapped for a new tag while waiting for removal
+    polls = reader.polls
+    original = FakeTag.is_present.fget
+    def swap_after_a_few_polls(tag):
+        if reader.polls - polls > 3:
+            reader.tag = FakeTag(reader, b"\x02")
+        return original(tag)
+    FakeTag.is_present = property(swap_after_a_few_polls)
+    try:
+        summary = provision_batch([{"id": "patient-b", "name": "B"}], writer, progress_log)
+    finally:
+        FakeTag.is_present = property(original)
+    assert summary["written"] == 1
+    assert reader.tag.ndef.records[0].iri == get_patient_url({"id": "patient-b"})
+    assert first.ndef.records[0].iri == "http://t.example/p/a"
+    print("✅ Previous tag kept, next patient written to a new tag")
+
+class ReadOnlySupabase(FakeSupabase):
+    """Patients can be listed; any write fails the test"""
+    def __init__(self, patients=PATIENTS, **options):
+        super().__init__({"patients": [dict(patient) for patient in patients]}, **options)
+
+    def execute(self, query):
+        assert query.table == "patients" and query.action == "select", f"simulated run touched {query.table}"
+        return super().execute(query)
+
+def test_simulated_run_is_dry():
+    """Test that --simulate stores no short links and leaves the real progress log alone"""
+    print("Testing a simulated batch...")
+    progress_path = os.path.join(tempfile.mkdtemp(), "progress.jsonl")
+    args = argparse.Namespace(
+        condition=None, name_contains=None, ids_file=None, all=True, progress_log=progress_path,
+        simulate=True, full_urls=False, timeout=1, max_attempts=1
+    )
+    get_client = nfc_writer.get_supabase_client
+    nfc_writer.get_supabase_client = ReadOnlySupabase
+    try:
+        nfc_writer.run_batch(args)
+    finally:
+        nfc_writer.get_supabase_client = get_client
+
+    assert not os.path.exists(progress_path)
+    simulated = ProgressLog(nfc_writer.simulated_progress_log_path(progress_path))
+    assert simulated.completed() == {p["id"] for p in PATIENTS}
+    print("✅ Simulated run stored nothing")
+
+def test_batch_selection_pages_past_row_cap():
+    """Test that --all, --condition and --ids-file select every matching patient past the row cap"""
+    print("Testing batch patient selection over 2500 patients...")
+    cohort = [{"id": f"patient-{i:05d}", "name": f"Patient {i}", "condition": "Asthma" if i % 2 else "Diabetes"}
+              for i in range(2500)]
+    supabase = ReadOnlySupabase(cohort, max_rows=1000)
+
+    assert len(nfc_writer.list_patients(supabase)) == 2500
+    asthma = nfc_writer.list_patients(supabase, condition="Asthma")
+    assert len(asthma) == 1250 and {p["condition"] for p in asthma} == {"Asthma"}
+    assert [p["id"] for p in nfc_writer.list_patients(supabase, name_contains="patient 2499")] == ["patient-02499"]
+
+    # Ids from the file are looked up in chunks, whatever their number
+    wanted = [f"patient-{i:05d}" for i in range(0, 2500, 7)] + ["patient-missing"]
+    supabase.requests.clear()
+    listed = nfc_writer.list_patients(supabase, ids=wanted)
+    assert {p["id"] for p in listed} == set(wanted[:-1])
+    assert len(supabase.requests) == -(-len(wanted) // nfc_writer.IDS_CHUNK_SIZE)
+    print("✅ Every matching patient selected")
+
+if __name__ == "__main__":
+    test_batch_with_retries()
+    test_batch_resume()
+    test_batch_short_links()
+    test_tag_left_on_reader()
+    test_simulated_run_is_dry()
+    test_batch_selection_pages_past_row_cap()
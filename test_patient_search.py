@@ -0,0 +1,179 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from conftest import FakeSupabase
+from utils.patient_search import PatientSearchIndex, SEARCH_INDEX_MAX_AGE_SECONDS
+
+PATIENTS = [
+    {"id": "1", "name": "John Doe", "condition": "Diabetes"},
+    {"id": "2", "name": "Jane Doe", "condition": "Hypertension"},
+    {"id": "3", "name": "Johnny Smith", "condition": "Asthma"},
+]
+
+def test_prefix_and_condition_search():
+    """Test name prefix and condition matching"""
+    print("Testing patient search...")
+    index = PatientSearchIndex()
+    index.build(PATIENTS)
+
+    assert [p["id"] for p in index.search("joh")] == ["1", "3"]
+    assert [p["id"] for p in index.search("john")][0] == "1"  # exact beats prefix
+    assert [p["id"] for p in index.search("doe hyper")] == ["2"]
+    assert [p["id"] for p in index.search("")] == ["2", "1", "3"]
+    print("✅ Prefix and condition search works")
+
+def test_fuzzy_search():
+    """Test typo-tolerant matching"""
+    print("Testing fuzzy patient search...")
+    index = PatientSearchIndex()
+    index.build(PATIENTS)
+
+    assert [p["id"] for p in index.search("diabtes")] == ["1"]
+    assert [p["id"] for p in index.search("smiht")] == ["3"]
+    assert index.search("diabtes", fuzzy=False) == []
+    print("✅ Fuzzy search works")
+
+def test_index_updates():
+    """Test adding and removing patients"""
+    print("Testing patient search index updates...")
+    index = PatientSearchIndex()
+    index.build(PATIENTS)
+
+    index.remove("1")
+    assert index.search("diabetes") == []
+    index.add({"id": "4", "name": "Mary Major", "condition": "Diabetes"})
+    assert [p["id"] for p in index.search("diab")] == ["4"]
+    assert len(index) == 3
+    print("✅ Index updates work")
+
+def test_adds_from_another_thread():
+    """Test that searches stay consistent while another thread adds patients, as bulk imports do"""
+    print("Testing searches during concurrent adds...")
+    index = PatientSearchIndex()
+    index.build(PATIENTS)
+    done = threading.Event()
+
+    def import_patients():
+        for n in range(20000):
+            index.add({"id": f"i{n}", "name": f"Imported{n} Patient{n % 97}", "condition": f"Cond{n % 13}"})
+        done.set()
+
+    importer = threading.Thread(target=import_patients)
+    importer.start()
+    searches = 0
+    while not done.is_set():
+        # A typo walks the trigram sets of "imp..." tokens the importer is growing
+        for result in index.search("imprted", limit=5):
+            assert result["id"].startswith("i")
+        searches += 1
+    importer.join()
+    assert len(index) == 20003 and index.search("imported19999")[0]["id"] == "i19999"
+    print(f"✅ {searches} searches during 20000 adds")
+
+def test_index_covers_large_cohort(fake_supabase):
+    """Test that building the index pages past the per-request row cap"""
+    print("Testing patient search index over 2500 patients...")
+    rows = [{"id": f"p{n:05d}", "name": f"Name{n:05d}", "condition": "X"} for n in range(2500)]
+    rows[-1]["name"] = "Zelda Last"
+    fake = fake_supabase
+    fake.tables["patients"], fake.max_rows = rows, 1000
+    from routers import patients
+    patients.supabase = fake
+
+    patients.build_search_index()
+    assert len(patients.patient_search_index) == 2500
+    assert [p["id"] for p in patients.patient_search_index.search("zelda")] == ["p02499"]
+    print("✅ Every patient is searchable")
+
+def test_changes_during_rebuild_kept():
+    """Test that patients added or removed while a rebuild reads the table survive the swap"""
+    print("Testing changes during a rebuild...")
+    index = PatientSearchIndex()
+    index.build(PATIENTS)
+
+    index.begin_build()
+    snapshot = [dict(patient) for patient in PATIENTS]
+    index.add({"id": "4", "name": "Mary Major", "condition": "Diabetes"})
+    index.remove("1")
+    index.build(snapshot)
+
+    assert [p["id"] for p in index.search("diab")] == ["4"]
+    assert len(index) == 3
+    # Changes after the build are not replayed onto the next one
+    index.add({"id": "5", "name": "Late Entry", "condition": "Asthma"})
+    index.build(PATIENTS)
+    assert [p["id"] for p in index.search("diab")] == ["1"]
+    print("✅ Changes kept")
+
+class LoopCheckingSupabase(FakeSupabase):
+    """Records whether statements were run on an event loop thread"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_loop = []
+
+    def execute(self, query):
+        try:
+            asyncio.get_running_loop()
+            self.on_loop.append(True)
+        except RuntimeError:
+            self.on_loop.append(False)
+        return super().execute(query)
+
+def search(q):
+    from routers import patients
+    return [p["id"] for p in asyncio.run(patients.search_patients(q))["data"]["patients"]]
+
+def test_first_search_builds_off_the_loop(monkeypatch):
+    """Test that searches before the index exists share one build in a worker thread"""
+    print("Testing the first search...")
+    from routers import patients
+    fake = LoopCheckingSupabase({"patients": [dict(patient) for patient in PATIENTS]}, latency=0.05)
+    monkeypatch.setattr(patients, "supabase", fake)
+    monkeypatch.setattr(patients, "patient_search_index", PatientSearchIndex())
+
+    async def concurrent_searches():
+        return await asyncio.gather(*(patients.search_patients("doe") for _ in range(5)))
+
+    results = asyncio.run(concurrent_searches())
+    assert all([p["id"] for p in result["data"]["patients"]] == ["2", "1"] for result in results)
+    assert fake.requests == ["patients"] and fake.on_loop == [False]
+    print("✅ One build, off the event loop")
+
+def test_stale_index_rebuilt(monkeypatch):
+    """Test that patients created through another worker become searchable once the index is rebuilt"""
+    print("Testing search index rebuilds...")
+    from routers import patients
+    fake = FakeSupabase({"patients": [dict(patient) for patient in PATIENTS]})
+    monkeypatch.setattr(patients, "supabase", fake)
+    monkeypatch.setattr(patients, "patient_search_index", PatientSearchIndex())
+    patients.build_search_index()
+
+    # Another worker creates a patient; this worker's index is still fresh
+    fake.tables["patients"].append({"id": "4", "name": "Mary Major", "condition": "Diabetes"})
+    assert search("mary") == []
+    assert patients.search_index_build is None
+
+    async def search_then_wait(q):
+        response = await patients.search_patients(q)
+        await patients.search_index_build
+        return [p["id"] for p in response["data"]["patients"]]
+
+    # Past the maximum age a search answers from the old index and rebuilds it in the background
+    patients.patient_search_index.built_at = time.monotonic() - SEARCH_INDEX_MAX_AGE_SECONDS - 1
+    assert asyncio.run(search_then_wait("mary")) == []
+    assert search("mary") == ["4"]
+    assert not patients.patient_search_index.is_stale()
+    print("✅ Other workers' patients found after a rebuild")
+
+if __name__ == "__main__":
+    test_prefix_and_condition_search()
+    test_fuzzy_search()
+    test_index_updates()
+    test_adds_from_another_thread()
+    test_index_covers_large_cohort(FakeSupabase())
+    test_changes_during_rebuild_kept()
+    for test in (test_first_search_builds_off_the_loop, test_stale_index_rebuilt):
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test(monkeypatch)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test on-demand request profiling and the upstream call breakdown
+"""
+
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.http_clients import HttpClients
+from utils.profiling import ProfileStore, ProfilingMiddleware
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(0.02)
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def slow_summary():
+    total = 0
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        total += 1
+    return total
+
+def make_app(url, clients):
+    async def app(scope, receive, send):
+        client = clients.client("supabase", 2, 2, 5)
+        client.get(url + "patients?id=eq.1")
+        client.get(url + "dose_logs?patient_id=eq.1")
+        slow_summary()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b"{}"})
+    return app
+
+def call(app, headers):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/api/summary/1", "headers": headers}
+    asyncio.run(app(scope, receive, send))
+    return dict(messages[0]["headers"])
+
+def test_profile_on_request():
+    """Test that only requests with the token are profiled, with stacks and upstream calls"""
+    print("Testing request profiling...")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    clients = HttpClients()
+    store = ProfileStore(keep=5)
+    try:
+        app = ProfilingMiddleware(
+            make_app(f"http://127.0.0.1:{server.server_port}/", clients), store=store, token="secret", sample_rate=0
+        )
+        assert b"x-profile-id" not in call(app, [(b"x-profile", b"wrong")])
+        assert store.list() == []
+
+        headers = call(app, [(b"x-profile", b"secret")])
+        profile = store.get(headers[b"x-profile-id"].decode())
+        summary = profile.summary()
+        assert summary["status"] == 200 and summary["reason"] == "requested" and summary["samples"] > 5
+        assert any("slow_summary" in line for line in profile.folded().splitlines())
+        assert summary["upstream"]["supabase"]["calls"] == 2 and summary["upstream_ms"] >= 40
+        assert [c["url"].rsplit("/", 1)[-1] for c in summary["upstream_calls"]] == ["patients", "dose_logs"]
+        print(f"✅ {summary['samples']} samples, {summary['upstream_ms']}ms upstream of {summary['ms']}ms")
+    finally:
+        server.shutdown()
+        clients.close()
+
+if __name__ == "__main__":
+    test_profile_on_request()
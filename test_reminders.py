@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Test the heap-based dose reminder scheduler
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from conftest import FakeSupabase
+from routers import reminders as reminders_router
+from utils.reminders import ReminderScheduler
+
+MONDAY = datetime(2025, 3, 3)
+
+def at(day, hour, minute=0):
+    return MONDAY.replace(day=MONDAY.day + day, hour=hour, minute=minute).timestamp()
+
+class ListSink:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, reminder):
+        self.sent.append(reminder)
+
+def scheduler():
+    sink = ListSink()
+    reminders = ReminderScheduler(sink, grace_seconds=3600)
+    return reminders, sink
+
+def test_reminders_fire_and_skip_logged_doses():
+    """Test that due reminders are sent once and doses logged ahead of time suppress them"""
+    print("Testing reminders...")
+    reminders, sink = scheduler()
+    reminders.load([
+        {"id": "t1", "patient_id": "p1", "medication": "Metformin", "dosage": "500mg",
+         "frequency": "Twice daily", "start_date": "2025-03-01"},
+        {"id": "t2", "patient_id": "p2", "medication": "Inhaler", "dosage": "2 puffs",
+         "frequency": "Once daily (Schedule: Thursday)", "start_date": "2025-03-01"},
+    ], now=at(0, 8))
+
+    assert reminders.fire_due(at(0, 8, 59)) == 0
+    assert reminders.fire_due(at(0, 9)) == 1
+    assert sink.sent[0]["medication"] == "Metformin" and sink.sent[0]["dose_of_day"] == 1
+    assert reminders.fire_due(at(0, 9, 30)) == 0
+
+    # Both of Monday's doses logged before the evening reminder
+    reminders.dose_logged("p1", "Metformin", "2025-03-03")
+    reminders.dose_logged("p1", "Metformin", "2025-03-03")
+    assert reminders.fire_due(at(0, 21)) == 0 and reminders.skipped_logged == 1
+
+    # The inhaler is only scheduled on Thursdays
+    assert reminders.fire_due(at(3, 9)) == 2
+    assert sorted(r["medication"] for r in sink.sent[1:]) == ["Inhaler", "Metformin"]
+    assert reminders.skipped_late == 4  # Tuesday and Wednesday Metformin, hours late
+    print(f"✅ {reminders.sent} reminders sent, {reminders.skipped_logged} skipped as logged")
+
+def test_incremental_updates():
+    """Test that treatment changes reschedule without stale reminders, and deleted patients stop"""
+    print("Testing incremental updates...")
+    reminders, sink = scheduler()
+    reminders.load([], now=at(0, 7))
+    reminders.add_treatment({"id": "t1", "patient_id": "p1", "medication": "A", "frequency": "Once daily",
+                             "start_date": "2025-03-01"}, now=at(0, 7))
+    # Same treatment changed to three times daily: the first dose moves to 08:00
+    reminders.add_treatment({"id": "t1", "patient_id": "p1", "medication": "A", "frequency": "Three times daily",
+                             "start_date": "2025-03-01"}, now=at(0, 7))
+    assert reminders.fire_due(at(0, 8)) == 1
+    assert reminders.fire_due(at(0, 9)) == 0 and reminders.stale_popped == 1
+    assert reminders.upcoming("p1", now=at(0, 9))[0]["due_at"] == "2025-03-03T14:00:00"
+
+    reminders.forget_patient("p1")
+    assert reminders.fire_due(at(0, 20)) == 0 and reminders.upcoming("p1", now=at(0, 20)) == []
+
+    # Reminders far past due (after downtime) are dropped, not sent in a burst
+    reminders.add_treatment({"id": "t2", "patient_id": "p2", "medication": "B", "frequency": "Weekly",
+                             "start_date": "2025-03-04"}, now=at(0, 20))
+    assert reminders.fire_due(at(1, 12)) == 0 and reminders.skipped_late == 1
+    assert reminders.upcoming("p2", now=at(1, 12))[0]["due_at"] == "2025-03-11T09:00:00"
+    print("✅ Rescheduled, forgotten and late reminders handled")
+
+def test_ticks_do_not_scan_all_medications():
+    """Test that ticks cost the due reminders only, however many are scheduled"""
+    print("Testing tick cost...")
+    reminders, sink = scheduler()
+    frequencies = ["Once daily", "Twice daily", "Three times daily", "Weekly"]
+    treatments = [
+        {"id": n, "patient_id": f"p{n}", "medication": "A", "frequency": frequencies[n % 4], "start_date": "2025-03-01"}
+        for n in range(50000)
+    ]
+    started = time.perf_counter()
+    reminders.load(treatments, now=at(0, 7))
+    loaded = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for minute in range(30):
+        reminders.fire_due(at(0, 7, minute))
+    idle = time.perf_counter() - started
+    assert sink.sent == [] and idle < 0.01
+
+    assert reminders.fire_due(at(0, 8), limit=50000) == 12500  # three times daily, first dose
+    assert len(reminders._heap) == 50000
+    print(f"✅ 50k medications loaded in {loaded:.2f}s, 30 idle ticks in {idle * 1000:.2f}ms")
+
+def test_doses_logged_through_other_workers(fake_supabase):
+    """Test that due reminders are checked against the stored dose logs before they are sent"""
+    print("Testing reminders against the store...")
+    reminders, sink = scheduler()
+    treatments = [
+        {"id": "t1", "patient_id": "p1", "medication": "Metformin", "frequency": "Twice daily", "start_date": "2025-03-01"},
+        {"id": "t2", "patient_id": "p2", "medication": "Inhaler", "frequency": "Once daily", "start_date": "2025-03-01"},
+        {"id": "t3", "patient_id": "p3", "medication": "Aspirin", "frequency": "Once daily", "start_date": "2025-03-01"},
+    ]
+    reminders.load(treatments, now=at(0, 8))
+    # p1's morning dose was logged through another worker, p3 was deleted through another worker
+    store = fake_supabase
+    store.tables.update({
+        "patients": [{"id": "p1"}, {"id": "p2"}],
+        "dose_logs": [{"patient_id": "p1", "medication": "Metformin", "date": "2025-03-03"},
+                      {"patient_id": "p2", "medication": "Inhaler", "date": "2025-03-02"}]
+    })
+    reminders_router.supabase = store
+
+    due = reminders.take_due(at(0, 9))
+    assert len(due) == 3
+    reminders.send(reminders.confirm(due, *reminders_router.fetch_logged_doses(due)))
+    assert [r["patient_id"] for r in sink.sent] == ["p2"] and reminders.skipped_logged == 1
+    assert reminders.upcoming("p3", now=at(0, 9)) == []
+
+    # Reloading the schedules does not count today's logged doses twice
+    reminders.load(treatments[:1], store.tables["dose_logs"][:1], now=at(0, 9))
+    reminders.load(treatments[:1], store.tables["dose_logs"][:1], now=at(0, 9))
+    assert reminders.fire_due(at(0, 21)) == 1 and sink.sent[-1]["dose_of_day"] == 2
+    print("✅ Doses logged and patients deleted elsewhere suppress reminders")
+
+def test_one_worker_sends_reminders(fake_supabase):
+    """Test that a single worker is elected to send reminders and another takes over when it exits"""
+    print("Testing reminder scheduler election...")
+    store = fake_supabase
+    store.tables.update({"treatments": [], "dose_logs": []})
+    saved = (reminders_router.supabase, reminders_router.reminder_scheduler,
+             reminders_router.REMINDER_LOCK_PATH, reminders_router.REMINDER_STANDBY_SECONDS)
+
+    async def scenario():
+        workers = [asyncio.create_task(reminders_router.run_reminder_scheduler()) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        elected = store.requests.count("treatments")
+        running = [worker for worker in workers if not worker.done()]
+        # The elected worker is the one that started its scheduler; stop it
+        workers[0].cancel()
+        await asyncio.sleep(0.1)
+        took_over = store.requests.count("treatments")
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        return elected, len(running), took_over
+
+    with tempfile.TemporaryDirectory() as directory:
+        reminders_router.supabase = store
+        reminders_router.reminder_scheduler = ReminderScheduler(ListSink())
+        reminders_router.REMINDER_LOCK_PATH = os.path.join(directory, "reminders.lock")
+        reminders_router.REMINDER_STANDBY_SECONDS = 0.01
+        try:
+            elected, running, took_over = asyncio.run(scenario())
+        finally:
+            (reminders_router.supabase, reminders_router.reminder_scheduler,
+             reminders_router.REMINDER_LOCK_PATH, reminders_router.REMINDER_STANDBY_SECONDS) = saved
+    assert running == 3
+    assert elected == 1 and took_over == 2
+    print("✅ One worker sends reminders, another takes over")
+
+class SlowSink:
+    """SMS gateway stand-in: blocks, and hangs for the patients in `hanging`"""
+    def __init__(self, hanging=()):
+        self.sent, self.hanging = [], set(hanging)
+
+    def send(self, reminder):
+        time.sleep(1.5 if reminder["patient_id"] in self.hanging else 0.05)
+        self.sent.append(reminder["patient_id"])
+
+class AsyncSink:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, reminder):
+        await asyncio.sleep(0.01)
+        self.sent.append(reminder["patient_id"])
+
+def due_reminders(*patient_ids):
+    return [{"patient_id": patient_id, "medication": "Metformin", "dosage": None,
+             "due_at": "2025-03-03T09:00:00", "dose_of_day": 1} for patient_id in patient_ids]
+
+def test_slow_sink_does_not_block_the_loop():
+    """Test that blocking and hanging sinks are sent to off the event loop, within a time bound"""
+    print("Testing slow reminder sinks...")
+    sink = SlowSink(hanging={"p3"})
+    reminders = ReminderScheduler(sink)
+
+    async def deliver_while_ticking():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        started = time.perf_counter()
+        sent = await reminders.deliver(due_reminders("p1", "p2", "p3", "p4"), timeout=0.5, concurrency=4)
+        elapsed = time.perf_counter() - started
+        ticker.cancel()
+        return sent, elapsed, ticks
+
+    sent, elapsed, ticks = asyncio.run(deliver_while_ticking())
+    assert sent == 3 and sorted(sink.sent) == ["p1", "p2", "p4"]
+    # The sends ran side by side and the hanging one was given up on
+    assert elapsed < 1.5, f"{elapsed:.2f}s"
+    assert ticks >= 10
+    metrics = reminders.metrics()
+    assert metrics["sent"] == 3 and metrics["failed"] == 1 and metrics["timed_out"] == 1
+    print(f"✅ Delivered in {elapsed:.2f}s, {ticks} loop ticks meanwhile")
+
+def test_async_sink():
+    """Test that a sink with a coroutine send() is awaited on the loop"""
+    print("Testing async reminder sinks...")
+    sink = AsyncSink()
+    reminders = ReminderScheduler(sink)
+    assert asyncio.run(reminders.deliver(due_reminders("p1", "p2"))) == 2
+    assert sorted(sink.sent) == ["p1", "p2"] and reminders._send_executor is None
+    print("✅ Async sink awaited")
+
+if __name__ == "__main__":
+    test_reminders_fire_and_skip_logged_doses()
+    test_incremental_updates()
+    test_ticks_do_not_scan_all_medications()
+    test_doses_logged_through_other_workers(FakeSupabase())
+    test_one_worker_sends_reminders(FakeSupabase())
+    test_slow_sink_does_not_block_the_loop()
+    test_async_sink()
@@ -0,0 +1,133 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+from conftest import FakeSupabase
+from utils.rolling_adherence import RollingAdherenceTracker
+
+def day(offset):
+    return (date.today() - timedelta(days=offset)).strftime("%Y-%m-%d")
+
+def test_rolling_windows():
+    """Test that a bad recent week shows up in the 7-day window only"""
+    print("Testing rolling-window adherence...")
+    tracker = RollingAdherenceTracker()
+
+    # 60 days of perfect adherence followed by a week of missed doses
+    logs = [{"medication": "Metformin", "status": "Taken", "date": day(d)} for d in range(7, 67)]
+    logs += [{"medication": "Metformin", "status": "Missed", "date": day(d)} for d in range(0, 7)]
+    tracker.load("patient-1", logs)
+
+    windows = tracker.windows("patient-1")
+    print(f"Windows: {windows}")
+    assert windows["7d"] == 0.0
+    assert round(windows["30d"], 2) == round(23 / 30 * 100, 2)
+    assert round(windows["90d"], 2) == round(60 / 67 * 100, 2)
+
+    # Incremental updates land in today's bucket
+    tracker.record("patient-1", "Metformin", "Taken", day(0))
+    windows = tracker.windows("patient-1")
+    assert round(windows["7d"], 2) == round(1 / 8 * 100, 2)
+    print("✅ Rolling windows computed correctly")
+
+def test_horizon():
+    """Test that logs older than the horizon are dropped"""
+    print("Testing rolling-window horizon...")
+    tracker = RollingAdherenceTracker()
+    tracker.record("patient-2", "Aspirin", "Taken", day(0))
+    tracker.record("patient-2", "Aspirin", "Missed", day(90))
+    windows = tracker.windows("patient-2")
+    assert windows["90d"] == 100.0
+    assert tracker.windows("unknown")["7d"] is None
+    print("✅ Horizon respected")
+
+def test_windows_roll_over_days():
+    """Test that the running window sums match a recount as days roll over"""
+    print("Testing running window sums...")
+    tracker = RollingAdherenceTracker()
+    logs = [{"medication": "A", "status": "Taken" if d % 3 else "Missed", "date": day(d)} for d in range(0, 120, 2)]
+    tracker.load("patient-3", logs)
+    today = date.today().toordinal()
+    for later in (0, 1, 5, 29, 30, 60, 89, 90, 200):
+        expected = {}
+        for window in (7, 30, 90):
+            counted = [log for log in logs if 0 <= later + (date.today() - date.fromisoformat(log["date"])).days < window]
+            taken = sum(log["status"] == "Taken" for log in counted)
+            expected[f"{window}d"] = taken / len(counted) * 100 if counted else None
+        assert tracker.windows("patient-3", today + later) == expected, later
+    print("✅ Window sums roll over correctly")
+
+def test_stale_versions_reload():
+    """Test that buffers are only current for the stored patient version they were loaded at"""
+    print("Testing rolling-window versions...")
+    tracker = RollingAdherenceTracker()
+    tracker.load("patient-4", [{"medication": "A", "status": "Taken", "date": day(0)}], version=3)
+    assert tracker.is_current("patient-4", 3)
+    # Another worker logged a dose and the stored version moved on
+    assert not tracker.is_current("patient-4", 4)
+    # Without a version column patients are always reloaded
+    assert not tracker.is_current("patient-4", None)
+    # A dose recorded here bumped the stored version to one we haven't seen
+    tracker.record("patient-4", "A", "Missed", day(0))
+    assert not tracker.is_current("patient-4", 3)
+    print("✅ Patients reload when their version changes")
+
+def test_seed_pages_past_row_cap(fake_supabase, monkeypatch):
+    """Test that seeding the patient list loads complete windows for every patient of a large cohort"""
+    print("Testing rolling-window seeding...")
+    # Doses missed more than a month ago, taken since
+    rows = [
+        {"id": n, "patient_id": f"seed-{n % 250}", "medication": "A", "status": "Taken" if n // 250 < 30 else "Missed",
+         "date": day(n // 250)}
+        for n in range(250 * 100)
+    ]
+    fake = fake_supabase
+    fake.tables["dose_logs"], fake.max_rows = rows, 1000
+    from routers import patients
+    tracker = RollingAdherenceTracker()
+    monkeypatch.setattr(patients, "supabase", fake)
+    monkeypatch.setattr(patients, "rolling_adherence", tracker)
+
+    patients.seed_rolling_adherence([f"seed-{n}" for n in range(250)], versions={"seed-0": 7})
+    # 90 days of history per patient, ids sent in chunks of SEED_CHUNK_SIZE
+    chunks = [value for query in fake.queries for _, op, value in query.filters if op == "in"]
+    assert max(len(ids) for ids in chunks) <= patients.SEED_CHUNK_SIZE
+    full = RollingAdherenceTracker()
+    full.load("expected", [row for row in rows if row["patient_id"] == "seed-0"])
+    assert full.windows("expected")["90d"] < 50
+    assert all(tracker.windows(f"seed-{n}") == full.windows("expected") for n in range(250))
+    assert tracker.is_current("seed-0", 7) and not tracker.is_current("seed-1", None)
+    print(f"✅ 250 patients seeded in {len(fake.requests)} requests")
+
+def test_list_without_version_column(fake_supabase, monkeypatch):
+    """Test that without a version column the patient list only seeds patients it has not tracked"""
+    print("Testing the patient list without patient versions...")
+    fake = fake_supabase
+    fake.tables["patients"] = [
+        {"id": f"p{n}", "name": f"P{n}", "age": 40, "gender": "F", "condition": "X"} for n in range(3)
+    ]
+    fake.tables["dose_logs"] = [{"id": n, "patient_id": f"p{n}", "medication": "A", "status": "Taken", "date": day(0)}
+                                for n in range(3)]
+    from routers import patients
+    monkeypatch.setattr(patients, "supabase", fake)
+    monkeypatch.setattr(patients, "rolling_adherence", RollingAdherenceTracker())
+
+    asyncio.run(patients.get_all_patients())
+    assert fake.requests.count("dose_logs") == 1
+    # A patient added since is seeded alone; the others are not read again
+    fake.tables["patients"].append({"id": "p3", "name": "P3", "age": 40, "gender": "F", "condition": "X"})
+    fake.queries.clear()
+    asyncio.run(patients.get_all_patients())
+    (seeded,) = [value for query in fake.queries if query.table == "dose_logs"
+                 for column, _, value in query.filters if column == "patient_id"]
+    assert seeded == {"p3"}
+    print("✅ Only untracked patients seeded")
+
+if __name__ == "__main__":
+    test_rolling_windows()
+    test_horizon()
+    test_windows_roll_over_days()
+    test_stale_versions_reload()
+    for test in (test_seed_pages_past_row_cap, test_list_without_version_column):
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test(FakeSupabase(), monkeypatch)
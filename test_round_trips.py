@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test upstream round trip counting and per-endpoint round trip budgets
+"""
+
+from conftest import FakeSupabase
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers import patients, summary
+from utils.round_trips import RoundTripMiddleware, assert_round_trip_budget, record_round_trip
+
+class CountingSupabase(FakeSupabase):
+    def execute(self, query):
+        # Each statement is one request to Supabase
+        record_round_trip("supabase", 0.001)
+        return super().execute(query)
+
+def make_client():
+    fake = CountingSupabase({
+        "patients": [{"id": f"p{n}", "name": "Test Patient", "adherence_percent": 90, "risk_label": "Low",
+                      "version": 1} for n in range(5)],
+        "dose_logs": [{"patient_id": "p0", "medication": "M", "status": "Taken", "date": "2025-01-06"}],
+        "treatments": [{"patient_id": "p0", "medication": "M", "frequency": "Daily", "start_date": "2025-01-01"}],
+    })
+    patients.supabase = summary.supabase = fake
+    app = FastAPI()
+    app.include_router(patients.router)
+    app.include_router(summary.router)
+    app.add_middleware(RoundTripMiddleware)
+    return TestClient(app), fake
+
+def test_summary_budget():
+    """Test that a summary makes five round trips cold and two once its caches are loaded"""
+    print("Testing summary round trips...")
+    client, fake = make_client()
+    response = client.get("/api/summary/p0")
+    assert response.status_code == 200
+    assert assert_round_trip_budget(response, supabase=5) == {"supabase": 5}
+    assert "supabase;dur=" in response.headers["Server-Timing"]
+
+    warm = client.get("/api/summary/p0")
+    assert assert_round_trip_budget(warm, supabase=2) == {"supabase": 2}
+    try:
+        assert_round_trip_budget(response, supabase=2)
+        assert False, "five calls should exceed a budget of two"
+    except AssertionError as e:
+        assert "supabase 5 calls (budget 2)" in str(e)
+
+    # A write through another worker bumps the stored version and the history is read again
+    fake.tables["patients"][0]["version"] = 2
+    assert assert_round_trip_budget(client.get("/api/summary/p0"), supabase=5) == {"supabase": 5}
+    print("✅ Summary within budget")
+
+def test_delete_by_name_is_constant():
+    """Test that deleting several patients by name does not make round trips per patient"""
+    print("Testing delete by name round trips...")
+    client, fake = make_client()
+    response = client.delete("/api/patient/name/Test Patient")
+    assert response.json()["data"]["deleted_count"] == 5 and fake.tables["patients"] == []
+    assert_round_trip_budget(response, supabase=6)
+    print("✅ 5 patients deleted in 6 round trips")
+
+if __name__ == "__main__":
+    test_summary_budget()
+    test_delete_by_name_is_constant()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test short-code patient links and the resolver cache
+"""
+
+import time
+from utils.short_links import (
+    ShortLinkResolver, generate_code, is_valid_code, short_link_url,
+    SHORT_CODE_LENGTH, UNKNOWN, REVOKED
+)
+
+STORE = {
+    "activecode": {"code": "activecode", "patient_id": "patient-1", "revoked_at": None},
+    "lostcode22": {"code": "lostcode22", "patient_id": "patient-1", "revoked_at": "2025-01-01T00:00:00+00:00"},
+}
+
+class CountingLoader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, code):
+        self.calls += 1
+        return STORE.get(code)
+
+def test_code_format():
+    """Test that codes are compact, valid and unique"""
+    print("Testing code generation...")
+    codes = {generate_code() for _ in range(10000)}
+    assert len(codes) == 10000
+    assert all(is_valid_code(code) for code in codes)
+    assert not is_valid_code("0" * SHORT_CODE_LENGTH)
+    assert len(short_link_url(next(iter(codes)))) < 40
+    print("✅ Codes are compact and unique")
+
+def test_resolver_caches_hits_and_misses():
+    """Test that the store is only read once per code"""
+    print("Testing resolver cache...")
+    resolver, load = ShortLinkResolver(), CountingLoader()
+    for _ in range(3):
+        assert resolver.resolve("activecode", load) == ("patient-1", None)
+        assert resolver.resolve("lostcode22", load) == (None, REVOKED)
+        assert resolver.resolve("nosuchcode", load) == (None, UNKNOWN)
+    assert load.calls == 3
+    print("✅ Store read once per code")
+
+def test_revocation():
+    """Test that revoking one tag's code stops it resolving immediately"""
+    print("Testing revocation...")
+    resolver, load = ShortLinkResolver(), CountingLoader()
+    resolver.remember("othertag22", "patient-1")
+    assert resolver.resolve("activecode", load) == ("patient-1", None)
+    resolver.revoke("activecode")
+    assert resolver.resolve("activecode", load) == (None, REVOKED)
+    assert resolver.resolve("othertag22", load) == ("patient-1", None)
+    print("✅ Revoked code no longer resolves, other tags still do")
+
+def test_cached_resolve_is_fast():
+    """Test that a cached resolution takes well under a millisecond"""
+    print("Testing resolve latency...")
+    resolver, load = ShortLinkResolver(), CountingLoader()
+    resolver.resolve("activecode", load)
+    rounds = 100000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        resolver.resolve("activecode", load)
+    per_call = (time.perf_counter() - started) / rounds
+    print(f"   {per_call * 1e6:.2f} µs per cached resolve")
+    assert per_call < 0.0001
+    print("✅ Cached resolve is fast")
+
+if __name__ == "__main__":
+    test_code_format()
+    test_resolver_caches_hits_and_misses()
+    test_revocation()
+    test_cached_resolve_is_fast()
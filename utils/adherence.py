@@ -3,7 +3,8 @@ def calculate_adherence(dose_logs):
     Calculate adherence percentage based on dose logs.
     
     Args:
-        dose_logs: List of dose log records with status field
+        dose_logs: List of dose log records with status field (and an optional
+            count, for logs standing in for rolled up doses)
         
     Returns:
         float: Adherence percentage (0-100)
@@ -11,8 +12,8 @@ def calculate_adherence(dose_logs):
     if not dose_logs:
         return 0.0
     
-    total_doses = len(dose_logs)
-    taken_doses = sum(1 for log in dose_logs if log.get('status') == 'Taken')
+    total_doses = sum(log.get('count', 1) for log in dose_logs)
+    taken_doses = sum(log.get('count', 1) for log in dose_logs if log.get('status') == 'Taken')
     
     return (taken_doses / total_doses) * 100 if total_doses > 0 else 0.0
 
@@ -26,4 +27,4 @@ def count_missed_doses(dose_logs):
     Returns:
         int: Number of missed doses
     """
-    return sum(1 for log in dose_logs if log.get('status') == 'Missed')
\ No newline at end of file
+    return sum(log.get('count', 1) for log in dose_logs if log.get('status') == 'Missed')
\ No newline at end of file
@@ -0,0 +1,346 @@
+import sys
+import threading
+from datetime import date
+from functools import lru_cache
+from utils.rolling_adherence import log_date_ordinal
+
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Calendar heatmap levels, one character per day
+NOT_SCHEDULED, UNLOGGED, MISSED, PARTIAL, TAKEN = "01234"
+HEATMAP_LEGEND = {
+    NOT_SCHEDULED: "nothing scheduled or logged",
+    UNLOGGED: "scheduled, nothing logged",
+    MISSED: "only missed doses",
+    PARTIAL: "some doses missed",
+    TAKEN: "every dose taken",
+}
+
+
+def schedule_weekdays(frequency):
+    """
+    Get the weekdays (0 = Monday) of a treatment from its frequency field,
+    e.g. "Once daily (Schedule: Monday, Thursday)". Unscheduled treatments run every day.
+    """
+    if frequency and " (Schedule: " in frequency:
+        names = frequency.split(" (Schedule: ")[1].rstrip(")").split(", ")
+        days = [WEEKDAY_NAMES.index(name) for name in names if name in WEEKDAY_NAMES]
+        if days:
+            return days
+    return list(range(7))
+
+
+@lru_cache(maxsize=64)
+def weekday_mask(year, weekdays):
+    """
+    Bitset of the days of `year` falling on any of `weekdays` (tuple, 0 = Monday).
+    """
+    first = date(year, 1, 1).weekday()
+    mask = 0
+    for index in range(days_in_year(year)):
+        if (first + index) % 7 in weekdays:
+            mask |= 1 << index
+    return mask
+
+
+def days_in_year(year):
+    return date(year + 1, 1, 1).toordinal() - date(year, 1, 1).toordinal()
+
+
+def day_bit(ordinal):
+    """
+    Get (year, day index within the year) of a day ordinal.
+    """
+    day = date.fromordinal(ordinal)
+    return day.year, ordinal - date(day.year, 1, 1).toordinal()
+
+
+def shifted(bits, offset):
+    return bits << offset if offset >= 0 else bits >> -offset
+
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+
+def set_bits(bits):
+    """
+    Yield the indexes of the set bits, lowest first.
+    """
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def longest_run(bits):
+    """
+    Length of the longest run of consecutive set bits.
+    """
+    length = 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+
+def trailing_run(bits, width):
+    """
+    Length of the run of set bits ending at bit `width - 1`.
+    """
+    gaps = ~bits & ((1 << width) - 1)
+    return width - gaps.bit_length()
+
+
+class MedicationYear:
+    """
+    Taken, missed and scheduled days of one medication over one year, bit i being day i of the year.
+    """
+
+    __slots__ = ("taken", "missed", "scheduled")
+
+    def __init__(self):
+        self.taken = self.missed = self.scheduled = 0
+
+
+class AdherenceBitmapStore:
+    """
+    Per-patient, per-medication adherence calendars as year-long bitsets.
+
+    A medication costs three 366-bit integers per year (about 140 bytes of
+    payload, a few hundred with object headers), however many doses were
+    logged. Range queries such as missed days in a month, streaks and calendar
+    heatmaps are answered with shifts, masks and popcounts over a span of days
+    instead of grouping dose logs by date.
+
+    Patients are seeded from their dose logs and treatments, then updated as
+    doses are logged. Setting a bit is idempotent, so recording a dose that was
+    already loaded is harmless. Doses logged through other server processes
+    only show in the store, so readers pass the patient row's stored version
+    to is_current() and reload the patient when it changed, as with
+    RollingAdherenceTracker.
+    """
+
+    def __init__(self):
+        # patient_id -> {medication: {year: MedicationYear}}
+        self._patients = {}
+        # patient_id -> {medication: (start ordinal, weekdays)}
+        self._schedules = {}
+        # patient_id -> stored patient version the calendars were loaded at
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._patients)
+
+    def is_loaded(self, patient_id):
+        return patient_id in self._patients
+
+    def is_current(self, patient_id, version):
+        """
+        Whether the patient was loaded at this stored version, with no dose recorded since.
+        Without a version (no version column) patients are never current and are reloaded.
+        """
+        return version is not None and patient_id in self._patients and self._versions.get(patient_id) == version
+
+    def _year(self, patient_id, medication, year):
+        years = self._patients[patient_id].setdefault(medication, {})
+        bitsets = years.get(year)
+        if bitsets is None:
+            bitsets = years[year] = MedicationYear()
+            schedule = self._schedules[patient_id].get(medication)
+            if schedule:
+                bitsets.scheduled = self._scheduled_bits(year, *schedule)
+        return bitsets
+
+    @staticmethod
+    def _scheduled_bits(year, start, weekdays):
+        first = date(year, 1, 1).toordinal()
+        if start >= first + days_in_year(year):
+            return 0
+        mask = weekday_mask(year, weekdays)
+        return mask & ~((1 << max(start - first, 0)) - 1)
+
+    def _add(self, patient_id, medication, ordinal, status):
+        year, index = day_bit(ordinal)
+        bitsets = self._year(patient_id, medication or "", year)
+        if status == "Taken":
+            bitsets.taken |= 1 << index
+        elif status == "Missed":
+            bitsets.missed |= 1 << index
+
+    def load(self, patient_id, dose_logs, treatments=(), version=None):
+        """
+        (Re)build the calendars of a patient from their dose logs and treatments,
+        read at a stored patient version.
+        """
+        schedules = {}
+        for treatment in treatments or []:
+            start = log_date_ordinal({"date": treatment.get("start_date")})
+            weekdays = tuple(schedule_weekdays(treatment.get("frequency")))
+            previous = schedules.get(treatment["medication"])
+            if previous:
+                # Several treatments of one medication: earliest start, union of weekdays
+                start = min(start, previous[0])
+                weekdays = tuple(sorted(set(weekdays) | set(previous[1])))
+            schedules[treatment["medication"]] = (start, weekdays)
+
+        with self._lock:
+            self._patients[patient_id] = {}
+            self._schedules[patient_id] = schedules
+            self._versions[patient_id] = version
+            for log in dose_logs or []:
+                self._add(patient_id, log.get("medication"), log_date_ordinal(log), log.get("status"))
+            # Scheduled medications show on the calendar from their start date even before any log
+            for medication, (start, _) in schedules.items():
+                self._year(patient_id, medication, date.fromordinal(start).year)
+
+    def ensure_loaded(self, patient_id, dose_logs, treatments=()):
+        if patient_id not in self._patients:
+            self.load(patient_id, dose_logs, treatments)
+
+    def record(self, patient_id, medication, status, log_date=None):
+        """
+        Set the bit of a single dose. Returns False if the patient is not loaded.
+        """
+        with self._lock:
+            if patient_id not in self._patients:
+                return False
+            self._add(patient_id, medication, log_date_ordinal({"date": log_date}), status)
+            # The dose bumped the stored version, so the next versioned read reloads
+            self._versions[patient_id] = None
+            return True
+
+    def forget(self, patient_id):
+        with self._lock:
+            self._patients.pop(patient_id, None)
+            self._schedules.pop(patient_id, None)
+            self._versions.pop(patient_id, None)
+
+    def medications(self, patient_id):
+        return list(self._patients.get(patient_id, {}))
+
+    def span(self, patient_id, start, end, medication=None):
+        """
+        Taken, missed and scheduled bitsets over days start..end (ordinals, inclusive),
+        bit i being day start + i. Without a medication, bits are OR-ed across medications
+        and `complete` holds the days on which every logged dose was taken.
+
+        Returns:
+            dict: {"taken", "missed", "scheduled", "complete", "width"}
+        """
+        width = end - start + 1
+        taken = missed = scheduled = 0
+        with self._lock:
+            medications = self._patients.get(patient_id, {})
+            schedules = self._schedules.get(patient_id, {})
+            selected = [medication] if medication is not None else list(medications)
+            for name in selected:
+                years = medications.get(name, {})
+                for year in range(date.fromordinal(start).year, date.fromordinal(end).year + 1):
+                    bitsets = years.get(year)
+                    if bitsets is None:
+                        if name not in schedules:
+                            continue
+                        # A scheduled medication reaching a year it has no logs in yet
+                        bitsets = self._year(patient_id, name, year)
+                    offset = date(year, 1, 1).toordinal() - start
+                    taken |= shifted(bitsets.taken, offset)
+                    missed |= shifted(bitsets.missed, offset)
+                    scheduled |= shifted(bitsets.scheduled, offset)
+        window = (1 << width) - 1
+        taken, missed, scheduled = taken & window, missed & window, scheduled & window
+        return {
+            "taken": taken,
+            "missed": missed,
+            "scheduled": scheduled,
+            "complete": taken & ~missed,
+            "width": width
+        }
+
+    def missed_days(self, patient_id, start, end, medication=None):
+        """
+        ISO dates between start and end (ordinals, inclusive) with a missed dose.
+        """
+        bits = self.span(patient_id, start, end, medication)["missed"]
+        return [date.fromordinal(start + index).isoformat() for index in set_bits(bits)]
+
+    def streaks(self, patient_id, start, end, medication=None):
+        """
+        Longest and current (ending on the last logged day) runs of days with every dose taken.
+        """
+        days = self.span(patient_id, start, end, medication)
+        logged = days["taken"] | days["missed"]
+        return {
+            "longest": longest_run(days["complete"]),
+            "current": trailing_run(days["complete"], logged.bit_length()) if logged else 0
+        }
+
+    def heatmap(self, patient_id, start, end, medication=None, today=None):
+        """
+        Calendar levels (see HEATMAP_LEGEND), one character per day from start to end.
+        Scheduled days after today are not reported as unlogged.
+        """
+        today = today or date.today().toordinal()
+        days = self.span(patient_id, start, end, medication)
+        width = days["width"]
+        logged = days["taken"] | days["missed"]
+        past = (1 << max(min(today - start + 1, width), 0)) - 1
+        layers = [
+            (UNLOGGED, days["scheduled"] & ~logged & past),
+            (MISSED, days["missed"] & ~days["taken"]),
+            (PARTIAL, days["missed"] & days["taken"]),
+            (TAKEN, days["complete"]),
+        ]
+        levels = [NOT_SCHEDULED] * width
+        for level, bits in layers:
+            # Bit strings are most significant first; reverse to day order
+            for index, bit in enumerate(reversed(format(bits, f"0{width}b"))):
+                if bit == "1":
+                    levels[index] = level
+        return "".join(levels)
+
+    def missed_days_by_medication(self, patient_id):
+        """
+        Missed days of every logged medication, in the shape of the summary's missed_days.
+        """
+        missed_info = {}
+        with self._lock:
+            medications = {medication: dict(years) for medication, years in self._patients.get(patient_id, {}).items()}
+            schedules = dict(self._schedules.get(patient_id, {}))
+        for medication, years in medications.items():
+            if not any(bitsets.taken | bitsets.missed for bitsets in years.values()):
+                continue
+            missed_days = []
+            for year in sorted(years):
+                first = date(year, 1, 1).toordinal()
+                missed_days.extend(
+                    {"date": date.fromordinal(first + index).isoformat(), "medication": medication}
+                    for index in set_bits(years[year].missed)
+                )
+            weekdays = schedules.get(medication, (None, ()))[1]
+            missed_info[medication] = {
+                "scheduled_days": [WEEKDAY_NAMES[day] for day in weekdays] if len(weekdays) < 7 else [],
+                "missed_days": missed_days,
+                "total_missed": len(missed_days)
+            }
+        return missed_info
+
+    def metrics(self):
+        with self._lock:
+            bitsets = [b for medications in self._patients.values() for years in medications.values() for b in years.values()]
+        payload = sum((b.taken.bit_length() + b.missed.bit_length() + b.scheduled.bit_length() + 7) // 8 for b in bitsets)
+        allocated = sum(
+            sys.getsizeof(b) + sys.getsizeof(b.taken) + sys.getsizeof(b.missed) + sys.getsizeof(b.scheduled)
+            for b in bitsets
+        )
+        return {
+            "patients": len(self._patients),
+            "medication_years": len(bitsets),
+            "payload_bytes": payload,
+            "allocated_bytes": allocated,
+            "bytes_per_medication_year": round(allocated / len(bitsets)) if bitsets else None
+        }
+
+
+adherence_bitmaps = AdherenceBitmapStore()
@@ -0,0 +1,118 @@
+import os
+import numpy as np
+from utils.rolling_adherence import log_date_ordinal
+
+FORECAST_LOOKBACK_DAYS = int(os.getenv("FORECAST_LOOKBACK_DAYS", "90"))
+FORECAST_HORIZON_DAYS = 7
+
+# Damped Holt smoothing parameters, shared by the whole cohort
+SMOOTHING_LEVEL = float(os.getenv("FORECAST_SMOOTHING_LEVEL", "0.3"))
+SMOOTHING_TREND = float(os.getenv("FORECAST_SMOOTHING_TREND", "0.1"))
+TREND_DAMPING = float(os.getenv("FORECAST_TREND_DAMPING", "0.9"))
+
+
+def build_daily_counts(patient_ids, dose_logs, today, days=FORECAST_LOOKBACK_DAYS):
+    """
+    Build (taken, total) daily dose counts for a cohort, one row per patient.
+
+    Args:
+        patient_ids: Patients in row order
+        dose_logs: Iterable of dose logs with patient_id, status and date
+        today: Ordinal of the last day (inclusive)
+
+    Returns:
+        tuple: (taken, total) float32 arrays of shape (patients, days), oldest day first
+    """
+    index = {patient_id: row for row, patient_id in enumerate(patient_ids)}
+    start = today - days + 1
+    # Logs share a few distinct dates, so parse each date string once
+    day_offsets = {}
+    cells, taken_cells = [], []
+    for log in dose_logs:
+        row = index.get(log.get("patient_id"))
+        if row is None:
+            continue
+        value = log.get("date") or log.get("created_at")
+        day = day_offsets.get(value)
+        if day is None:
+            day = day_offsets[value] = log_date_ordinal(log) - start
+        if 0 <= day < days:
+            cell = row * days + day
+            cells.append(cell)
+            if log.get("status") == "Taken":
+                taken_cells.append(cell)
+
+    size = len(index) * days
+    total = np.bincount(np.asarray(cells, dtype=np.int64), minlength=size).astype(np.float32)
+    taken = np.bincount(np.asarray(taken_cells, dtype=np.int64), minlength=size).astype(np.float32)
+    return taken.reshape(-1, days), total.reshape(-1, days)
+
+
+def forecast_adherence(taken, total, horizon=FORECAST_HORIZON_DAYS, alpha=SMOOTHING_LEVEL,
+                       beta=SMOOTHING_TREND, phi=TREND_DAMPING):
+    """
+    Forecast daily adherence for every patient at once with damped Holt smoothing.
+
+    The smoothing runs once over the days, updating all patients per step as
+    arrays. Days without logs leave a patient's level and trend unchanged.
+
+    Returns:
+        dict of arrays (one entry per patient, NaN for patients without logs):
+            daily: (patients, horizon) predicted adherence percent per day
+            forecast: mean predicted adherence over the horizon
+            trend: smoothed change in adherence points per day
+            recent: actual adherence over the last `horizon` days
+    """
+    observed = total > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        series = np.where(observed, taken / total * 100, np.nan).astype(np.float32)
+
+    patients = series.shape[0]
+    # Start from each patient's first observed day
+    first = observed.argmax(axis=1)
+    level = series[np.arange(patients), first]
+    trend = np.zeros(patients, dtype=np.float32)
+
+    for day in range(series.shape[1]):
+        seen = observed[:, day]
+        predicted = level + phi * trend
+        new_level = alpha * series[:, day] + (1 - alpha) * predicted
+        new_trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        level = np.where(seen, new_level, level)
+        trend = np.where(seen, new_trend, trend)
+
+    # Damped trend: the h-step forecast adds trend * (phi + phi^2 + ... + phi^h)
+    damping = np.cumsum(phi ** np.arange(1, horizon + 1, dtype=np.float32))
+    daily = np.clip(level[:, None] + trend[:, None] * damping[None, :], 0, 100)
+
+    recent_taken, recent_total = taken[:, -horizon:].sum(axis=1), total[:, -horizon:].sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        recent = np.where(recent_total > 0, recent_taken / recent_total * 100, np.nan)
+
+    return {"daily": daily, "forecast": daily.mean(axis=1), "trend": trend, "recent": recent}
+
+
+def _number(value, digits=1):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def forecast_rows(patient_ids, forecast, generated_on):
+    """
+    Rows for the adherence_forecasts table, skipping patients without logs in the lookback.
+    """
+    rows = []
+    for row, patient_id in enumerate(patient_ids):
+        predicted = forecast["forecast"][row]
+        if np.isnan(predicted):
+            continue
+        recent = _number(forecast["recent"][row])
+        rows.append({
+            "patient_id": patient_id,
+            "forecast_7d": _number(predicted),
+            "daily_forecast": [_number(value) for value in forecast["daily"][row]],
+            "trend": _number(forecast["trend"][row], 2),
+            # Predicted change against the last 7 days; most negative = about to slip
+            "change_7d": None if recent is None else round(float(predicted) - recent, 1),
+            "generated_on": generated_on
+        })
+    return rows
@@ -0,0 +1,207 @@
+import asyncio
+import math
+import os
+from collections import deque
+from starlette.responses import JSONResponse
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "5"))
+# Skip optional work (AI feedback) while requests of the class are queueing
+ADMISSION_DEGRADE = os.getenv("ADMISSION_DEGRADE", "true").lower() in ("1", "true", "yes")
+
+# Route class -> (concurrent requests, queued requests), per server process
+ROUTE_CLASS_LIMITS = {
+    "dose_write": (int(os.getenv("ADMISSION_DOSE_WRITE_CONCURRENCY", "8")), int(os.getenv("ADMISSION_DOSE_WRITE_QUEUE", "32"))),
+    "write": (int(os.getenv("ADMISSION_WRITE_CONCURRENCY", "16")), int(os.getenv("ADMISSION_WRITE_QUEUE", "64"))),
+    "read": (int(os.getenv("ADMISSION_READ_CONCURRENCY", "64")), int(os.getenv("ADMISSION_READ_QUEUE", "256"))),
+}
+
+# Never limited: probes, metrics and long-lived event streams
+EXEMPT_PREFIXES = ("/health", "/api/events/stream")
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; retry_after is a hint in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Concurrency limit with a bounded FIFO wait queue for one route class.
+
+    Requests beyond max_concurrent wait in the queue; requests arriving to a
+    full queue, or waiting longer than queue_timeout, are shed.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = deque()
+        # Moving average of request service time, for Retry-After
+        self.service_seconds = 0.1
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.degraded = 0
+        self.peak_queue = 0
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    @property
+    def over_budget(self):
+        """True while requests of this class are queueing for a slot"""
+        return bool(self._waiters)
+
+    def retry_after(self):
+        # Time for the current backlog to drain at full concurrency
+        backlog = self.active + len(self._waiters)
+        return max(1, math.ceil(self.service_seconds * backlog / self.max_concurrent))
+
+    def _shed(self):
+        self.shed += 1
+        raise Overloaded(self.retry_after())
+
+    async def acquire(self):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._shed()
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.queued += 1
+        self.peak_queue = max(self.peak_queue, len(self._waiters))
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(future)
+            self.timed_out += 1
+            self._shed()
+        except asyncio.CancelledError:
+            self._discard(future)
+            # The slot may have been handed over just before the client went away
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self.admitted += 1
+
+    def _discard(self, future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def release(self, service_seconds=None):
+        if service_seconds is not None:
+            self.service_seconds += 0.2 * (service_seconds - self.service_seconds)
+        # Hand the slot straight to the oldest waiter still waiting
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def metrics(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": len(self._waiters),
+            "peak_queue_depth": self.peak_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "degraded": self.degraded,
+            "avg_service_ms": round(self.service_seconds * 1000, 1)
+        }
+
+
+class AdmissionController:
+    """
+    Maps requests to route classes and their limiters.
+    """
+
+    def __init__(self, limits=ROUTE_CLASS_LIMITS):
+        self.limiters = {name: AdmissionLimiter(name, *limit) for name, limit in limits.items()}
+
+    def classify(self, method, path):
+        """
+        Returns:
+            str: Route class, or None for requests that are never limited
+        """
+        if path.startswith(EXEMPT_PREFIXES):
+            return None
+        if path == "/api/log_dose":
+            return "dose_write"
+        if method in ("POST", "PUT", "PATCH", "DELETE"):
+            return "write"
+        return "read"
+
+    def should_degrade(self, route_class):
+        """
+        Check whether optional work should be skipped for a request of this class, and count it.
+        """
+        limiter = self.limiters[route_class]
+        if ADMISSION_DEGRADE and limiter.over_budget:
+            limiter.degraded += 1
+            return True
+        return False
+
+    def metrics(self):
+        return {name: limiter.metrics() for name, limiter in self.limiters.items()}
+
+
+admission_controller = AdmissionController()
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware applying per route class concurrency limits.
+
+    Shed requests get 429 Too Many Requests with a Retry-After header before
+    any route code runs.
+    """
+
+    def __init__(self, app, controller=admission_controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        route_class = None
+        if scope["type"] == "http" and ADMISSION_CONTROL:
+            route_class = self.controller.classify(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.controller.limiters[route_class]
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry shortly"},
+                status_code=429,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(loop.time() - started)
@@ -0,0 +1,91 @@
+import csv
+import json
+
+READ_CHUNK_SIZE = 64 * 1024
+# A JSON record that has not decoded within this many characters is treated as malformed
+MAX_RECORD_SIZE = 1024 * 1024
+
+# CSV columns: one row per patient or prescription, told apart by `type`
+IMPORT_COLUMNS = [
+    "type", "external_id", "name", "age", "gender", "condition",
+    "patient_external_id", "patient_id", "medication", "dosage", "frequency", "start_date", "schedule_days",
+]
+
+
+def iter_csv_records(text_file):
+    """
+    Yield (row number, record) from a CSV file, reading it line by line.
+    Empty cells are left out, schedule_days may be separated by ";" or ",".
+    """
+    for row_number, row in enumerate(csv.DictReader(text_file), start=1):
+        record = {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+        if "schedule_days" in record:
+            separator = ";" if ";" in record["schedule_days"] else ","
+            record["schedule_days"] = [day.strip() for day in record["schedule_days"].split(separator) if day.strip()]
+        yield row_number, record
+
+
+def iter_json_records(text_file, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield (row number, record) from a JSON array of objects or from JSON Lines,
+    decoding one object at a time from a sliding buffer so the whole document
+    is never held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, row_number, eof = "", 0, 0, False
+    started = False
+    while True:
+        # Skip separators between records
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if not started and position < len(buffer):
+            started = True
+            if buffer[position] == "[":
+                position += 1
+                continue
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        if position < len(buffer):
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof or len(buffer) - position > MAX_RECORD_SIZE:
+                    raise
+                record = None
+            if record is not None:
+                row_number += 1
+                if not isinstance(record, dict):
+                    raise ValueError(f"Record {row_number} is not a JSON object")
+                yield row_number, record
+                position = end
+                continue
+        if eof:
+            return
+        chunk = text_file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_import_records(text_file, import_format):
+    if import_format == "csv":
+        return iter_csv_records(text_file)
+    if import_format == "json":
+        return iter_json_records(text_file)
+    raise ValueError(f"Unsupported import format: {import_format}")
+
+
+def expand_record(record, row_number):
+    """
+    Split a record into (kind, fields) items. Patients may nest their prescriptions
+    under "treatments" (JSON), which then refer to the patient's external id.
+    """
+    kind = record.get("type") or ("treatment" if "medication" in record and "name" not in record else "patient")
+    fields = {key: value for key, value in record.items() if key not in ("type", "treatments")}
+    if kind == "patient" and record.get("treatments"):
+        # Nested prescriptions need a key for their patient even without an external id
+        fields.setdefault("external_id", f"row-{row_number}")
+    yield kind, fields
+    if kind == "patient":
+        for treatment in record.get("treatments") or []:
+            yield "treatment", {**treatment, "patient_external_id": fields["external_id"]}
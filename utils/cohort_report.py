@@ -0,0 +1,258 @@
+import csv
+import html
+import io
+import json
+from collections import defaultdict
+from datetime import date, datetime
+from utils.adherence import calculate_adherence
+from utils.adherence_bitmaps import AdherenceBitmapStore
+from utils.cohort_stats import RISK_LABELS
+from utils.dose_rollups import combine_history, fetch_rollups
+
+REPORT_PAGE_SIZE = 200
+LOGS_PAGE_SIZE = 1000
+PATIENTS_PAGE_SIZE = 1000
+PATIENT_COLUMNS = "id, name, condition, adherence_percent, risk_label"
+
+REPORT_COLUMNS = [
+    "patient_id", "name", "condition", "risk_label", "adherence_all_time",
+    "doses_logged", "doses_taken", "doses_missed", "adherence_month",
+    "days_missed", "longest_streak", "medications", "worst_medication", "worst_medication_adherence",
+]
+
+
+def parse_month(value=None):
+    """
+    Get the first and last day ordinals of a "YYYY-MM" month, the previous month by default.
+    """
+    if value:
+        first = datetime.strptime(value, "%Y-%m").date()
+    else:
+        today = date.today()
+        first = date(today.year - (today.month == 1), (today.month - 2) % 12 + 1, 1)
+    following = date(first.year + first.month // 12, first.month % 12 + 1, 1)
+    return first.toordinal(), following.toordinal() - 1
+
+
+def month_label(start):
+    return date.fromordinal(start).strftime("%Y-%m")
+
+
+def fetch_patient_page(supabase, after=None, page_size=REPORT_PAGE_SIZE, columns=PATIENT_COLUMNS, where=None):
+    """
+    One page of patients ordered by id, after the `after` id (keyset pagination, so pages
+    stay stable while patients are added and a run can resume from the last id).
+    `where` adds filters to the query, e.g. lambda query: query.eq("condition", "Asthma").
+    """
+    query = supabase.table("patients").select(columns).order("id")
+    if where is not None:
+        query = where(query)
+    if after is not None:
+        query = query.gt("id", after)
+    return query.limit(page_size).execute().data or []
+
+
+def fetch_all_patients(supabase, columns=PATIENT_COLUMNS, page_size=PATIENTS_PAGE_SIZE, where=None):
+    """
+    Every patient (matching `where`), paged by id (PostgREST caps rows per request).
+    """
+    patients, after = [], None
+    while True:
+        page = fetch_patient_page(supabase, after, page_size, columns, where)
+        patients.extend(page)
+        if len(page) < page_size:
+            return patients
+        after = page[-1]["id"]
+
+
+def fetch_month_logs(supabase, patient_ids, start, end):
+    """
+    Dose logs of a page of patients within the month, paged (PostgREST caps rows per request).
+    Months already compacted come from their rollups, as logs with a count.
+    """
+    logs, offset = [], 0
+    while True:
+        page = supabase.table("dose_logs").select("patient_id, medication, status, date").in_(
+            "patient_id", patient_ids
+        ).gte("date", date.fromordinal(start).isoformat()).lte("date", date.fromordinal(end).isoformat()).order(
+            "id"
+        ).range(offset, offset + LOGS_PAGE_SIZE - 1).execute().data or []
+        logs.extend(page)
+        if len(page) < LOGS_PAGE_SIZE:
+            break
+        offset += LOGS_PAGE_SIZE
+
+    rollups = fetch_rollups(supabase, patient_ids, start, end)
+    if not rollups:
+        return logs
+    logs_by_patient = defaultdict(list)
+    for log in logs:
+        logs_by_patient[log["patient_id"]].append(log)
+    return [
+        log for patient_id in patient_ids
+        for log in combine_history(logs_by_patient.get(patient_id, []), rollups.get(patient_id, []))
+    ]
+
+
+def summarize_patients(patients, dose_logs, start, end):
+    """
+    Report rows for a page of patients from their dose logs of the month.
+    A plain function of its arguments, so pages can be summarized in worker processes.
+    """
+    logs_by_patient = defaultdict(list)
+    for log in dose_logs:
+        logs_by_patient[log["patient_id"]].append(log)
+
+    calendars = AdherenceBitmapStore()
+    rows = []
+    for patient in patients:
+        logs = logs_by_patient.get(patient["id"], [])
+        by_medication = defaultdict(list)
+        for log in logs:
+            by_medication[log.get("medication") or ""].append(log)
+        medication_adherence = {medication: calculate_adherence(med_logs) for medication, med_logs in by_medication.items()}
+        worst = min(medication_adherence, key=medication_adherence.get) if medication_adherence else None
+
+        calendars.load(patient["id"], logs)
+        logged = sum(log.get("count", 1) for log in logs)
+        taken = sum(log.get("count", 1) for log in logs if log.get("status") == "Taken")
+        rows.append({
+            "patient_id": patient["id"],
+            "name": patient.get("name"),
+            "condition": patient.get("condition"),
+            "risk_label": patient.get("risk_label") or "Unknown",
+            "adherence_all_time": round(patient.get("adherence_percent") or 0, 1),
+            "doses_logged": logged,
+            "doses_taken": taken,
+            "doses_missed": sum(log.get("count", 1) for log in logs if log.get("status") == "Missed"),
+            "adherence_month": round(taken / logged * 100, 1) if logged else None,
+            "days_missed": len(calendars.missed_days(patient["id"], start, end)),
+            "longest_streak": calendars.streaks(patient["id"], start, end)["longest"],
+            "medications": len(by_medication),
+            "worst_medication": worst,
+            "worst_medication_adherence": round(medication_adherence[worst], 1) if worst is not None else None
+        })
+        calendars.forget(patient["id"])
+    return rows
+
+
+def empty_totals():
+    return {"patients": 0, "patients_with_logs": 0, "doses_logged": 0, "doses_taken": 0,
+            "risk_distribution": {label: 0 for label in RISK_LABELS}}
+
+
+def add_totals(totals, rows):
+    for row in rows:
+        totals["patients"] += 1
+        totals["patients_with_logs"] += row["doses_logged"] > 0
+        totals["doses_logged"] += row["doses_logged"]
+        totals["doses_taken"] += row["doses_taken"]
+        label = row["risk_label"] if row["risk_label"] in totals["risk_distribution"] else "Unknown"
+        totals["risk_distribution"][label] += 1
+    return totals
+
+
+def _blank(value):
+    return "" if value is None else value
+
+
+class CsvReport:
+    media_type = "text/csv"
+    extension = "csv"
+
+    def header(self, month):
+        return self.rows([dict(zip(REPORT_COLUMNS, REPORT_COLUMNS))], 0)
+
+    def rows(self, rows, written):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        for row in rows:
+            writer.writerow([_blank(row[column]) for column in REPORT_COLUMNS])
+        return buffer.getvalue()
+
+    def footer(self, totals):
+        return ""
+
+
+class JsonReport:
+    """
+    A JSON document {"month", "patients": [...], "totals"} written row by row.
+    """
+    media_type = "application/json"
+    extension = "json"
+
+    def header(self, month):
+        return f'{{"month": {json.dumps(month)}, "patients": [\n'
+
+    def rows(self, rows, written):
+        lines = [json.dumps(row) for row in rows]
+        text = ",\n".join(lines)
+        return ("" if not written or not lines else ",\n") + text
+
+    def footer(self, totals):
+        return f'\n], "totals": {json.dumps(totals)}}}\n'
+
+
+class HtmlReport:
+    """
+    A standalone, printable HTML table.
+    """
+    media_type = "text/html"
+    extension = "html"
+
+    def header(self, month):
+        headings = "".join(f"<th>{html.escape(column.replace('_', ' '))}</th>" for column in REPORT_COLUMNS)
+        return (
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            f"<title>Adherence report {html.escape(month)}</title>\n<style>"
+            "body{font-family:sans-serif;font-size:12px}table{border-collapse:collapse;width:100%}"
+            "th,td{border:1px solid #ccc;padding:2px 4px;text-align:left}th{background:#eee}"
+            "tr.High td{background:#fde2e2}@media print{thead{display:table-header-group}tr{page-break-inside:avoid}}"
+            "</style></head><body>\n"
+            f"<h1>Adherence report {html.escape(month)}</h1>\n"
+            f"<p>Generated {date.today().isoformat()}</p>\n"
+            f"<table><thead><tr>{headings}</tr></thead><tbody>\n"
+        )
+
+    def rows(self, rows, written):
+        return "".join(
+            f"<tr class=\"{html.escape(str(row['risk_label']))}\">"
+            + "".join(f"<td>{html.escape(str(_blank(row[column])))}</td>" for column in REPORT_COLUMNS)
+            + "</tr>\n"
+            for row in rows
+        )
+
+    def footer(self, totals):
+        adherence = totals["doses_taken"] / totals["doses_logged"] * 100 if totals["doses_logged"] else 0
+        risks = ", ".join(f"{label} {count}" for label, count in totals["risk_distribution"].items())
+        return (
+            "</tbody></table>\n"
+            f"<p>{totals['patients']} patients, {totals['patients_with_logs']} with doses logged this month. "
+            f"Cohort adherence {adherence:.1f}% over {totals['doses_logged']} doses. Risk: {html.escape(risks)}.</p>\n"
+            "</body></html>\n"
+        )
+
+
+REPORT_FORMATS = {"csv": CsvReport(), "json": JsonReport(), "html": HtmlReport()}
+
+
+def stream_report(supabase, report_format, start, end, page_size=REPORT_PAGE_SIZE):
+    """
+    Generate a report chunk by chunk, one page of patients at a time, so memory
+    stays bounded by the page size however large the clinic is.
+    """
+    report = REPORT_FORMATS[report_format]
+    totals, after = empty_totals(), None
+    yield report.header(month_label(start))
+    while True:
+        patients = fetch_patient_page(supabase, after, page_size)
+        if not patients:
+            break
+        logs = fetch_month_logs(supabase, [patient["id"] for patient in patients], start, end)
+        rows = summarize_patients(patients, logs, start, end)
+        yield report.rows(rows, totals["patients"])
+        add_totals(totals, rows)
+        after = patients[-1]["id"]
+        if len(patients) < page_size:
+            break
+    yield report.footer(totals)
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+
+RISK_LABELS = ("Low", "Medium", "High", "Unknown")
+HISTOGRAM_BUCKET_SIZE = 10
+ATTENTION_ADHERENCE_THRESHOLD = 60
+ATTENTION_LIST_LIMIT = 20
+COHORT_STATS_TTL_SECONDS = float(os.getenv("COHORT_STATS_TTL_SECONDS", "60"))
+
+
+def _empty_risk_distribution():
+    return {label: 0 for label in RISK_LABELS}
+
+
+def compute_cohort_stats(patients):
+    """
+    Compute dashboard statistics for a cohort in a single pass over the patient rows.
+
+    Args:
+        patients: List of patient records with condition, adherence_percent and risk_label
+
+    Returns:
+        dict: Totals, risk distribution, adherence histogram, patients needing
+        attention and per-condition breakdowns
+    """
+    total = 0
+    adherence_sum = 0.0
+    risk_distribution = _empty_risk_distribution()
+    histogram = [0] * (100 // HISTOGRAM_BUCKET_SIZE)
+    attention = []
+    conditions = defaultdict(lambda: {"count": 0, "adherence_sum": 0.0, "risk_distribution": _empty_risk_distribution()})
+
+    for patient in patients:
+        adherence = patient.get("adherence_percent") or 0
+        risk_label = patient.get("risk_label") or "Unknown"
+        if risk_label not in risk_distribution:
+            risk_label = "Unknown"
+
+        total += 1
+        adherence_sum += adherence
+        risk_distribution[risk_label] += 1
+        histogram[min(int(adherence // HISTOGRAM_BUCKET_SIZE), len(histogram) - 1)] += 1
+
+        if risk_label == "High" or adherence < ATTENTION_ADHERENCE_THRESHOLD:
+            attention.append({
+                "id": patient["id"],
+                "name": patient.get("name"),
+                "adherence_percent": adherence,
+                "risk_label": risk_label
+            })
+
+        condition = conditions[patient.get("condition") or "Unknown"]
+        condition["count"] += 1
+        condition["adherence_sum"] += adherence
+        condition["risk_distribution"][risk_label] += 1
+
+    attention.sort(key=lambda p: p["adherence_percent"])
+
+    return {
+        "total_patients": total,
+        "average_adherence": adherence_sum / total if total > 0 else 0.0,
+        "risk_distribution": risk_distribution,
+        "adherence_histogram": [
+            {
+                "range": f"{i * HISTOGRAM_BUCKET_SIZE}-{(i + 1) * HISTOGRAM_BUCKET_SIZE}",
+                "count": count
+            }
+            for i, count in enumerate(histogram)
+        ],
+        "needs_attention": {
+            "count": len(attention),
+            "patients": attention[:ATTENTION_LIST_LIMIT]
+        },
+        "by_condition": {
+            name: {
+                "count": data["count"],
+                "average_adherence": data["adherence_sum"] / data["count"],
+                "risk_distribution": data["risk_distribution"]
+            }
+            for name, data in conditions.items()
+        }
+    }
+
+
+class CohortStatsCache:
+    """
+    Holds the last computed cohort statistics until a write invalidates them or the TTL expires.
+
+    Every dose write invalidates the statistics, so after a write many dashboards
+    ask for them at once; refresh() makes them share one recomputation.
+    """
+
+    def __init__(self, ttl_seconds=COHORT_STATS_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._stats = None
+        self._computed_at = 0.0
+        # Bumped by every invalidation, so statistics read before a write are not cached after it
+        self.generation = 0
+        # (generation, asyncio task) of the recomputation in flight
+        self._refresh = None
+
+    def get(self):
+        if self._stats is None or time.monotonic() - self._computed_at > self.ttl_seconds:
+            return None
+        return self._stats
+
+    def set(self, stats, generation=None):
+        """
+        Cache statistics, unless they were read before an invalidation since `generation`.
+        """
+        if generation is not None and generation != self.generation:
+            return
+        self._stats = stats
+        self._computed_at = time.monotonic()
+
+    def invalidate(self):
+        self._stats = None
+        self.generation += 1
+
+    async def refresh(self, compute):
+        """
+        Get the cached statistics, or compute them with `compute` in a worker thread.
+
+        Callers arriving while a recomputation is in flight wait for it instead
+        of starting their own. Callers arriving after an invalidation start a
+        new one, since the one in flight may have read the patients before the write.
+
+        Returns:
+            tuple: (statistics, whether they were cached)
+        """
+        stats = self.get()
+        if stats is not None:
+            return stats, True
+        generation = self.generation
+        if self._refresh is None or self._refresh[0] != generation:
+            task = asyncio.ensure_future(asyncio.to_thread(compute))
+            self._refresh = (generation, task)
+            task.add_done_callback(lambda done: self._refreshed(generation, done))
+        # A caller that goes away must not cancel the recomputation the others wait on
+        return await asyncio.shield(self._refresh[1]), False
+
+    def _refreshed(self, generation, task):
+        if self._refresh is not None and self._refresh[1] is task:
+            self._refresh = None
+        if not task.cancelled() and task.exception() is None:
+            self.set(task.result(), generation)
+
+
+cohort_stats_cache = CohortStatsCache()
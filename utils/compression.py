@@ -0,0 +1,114 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "text/csv")
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the best supported content coding from an Accept-Encoding header.
+
+    The highest q-value wins, with brotli preferred on ties; "*" covers the
+    codings not listed and q=0 refuses a coding.
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name.strip():
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in supported:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing complete responses above COMPRESSION_MIN_SIZE.
+
+    Brotli is used when installed and accepted by the client, gzip otherwise.
+    Streaming responses (e.g. Server-Sent Events) are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            pending_start, start_message = start_message, None
+            body = message.get("body", b"")
+            response_headers = [(k, v) for k, v in pending_start.get("headers", [])]
+            names = {k.lower(): v for k, v in response_headers}
+            content_type = names.get(b"content-type", b"").decode("latin-1")
+
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or b"content-encoding" in names
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                await send(pending_start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            response_headers = [(k, v) for k, v in response_headers if k.lower() != b"content-length"]
+            response_headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", b"Accept-Encoding")
+            ]
+            await send({**pending_start, "headers": response_headers})
+            await send({**message, "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import islice
+from utils.file_lock import FileLock
+
+# Most queue files claimed by the workers of one server
+MAX_QUEUE_SLOTS = 64
+
+
+class DurableDoseQueue:
+    """
+    File-backed FIFO queue of accepted dose logs.
+
+    Entries are appended as JSON lines to `path` (fsynced when `fsync` is set)
+    and a separate offset file records how far the log has been flushed, so
+    pending entries survive a restart. Entries are handed out strictly in
+    append order, which keeps the doses of each patient ordered. Appends may
+    run in worker threads while the flusher commits.
+
+    One process at a time may use a queue file; see claim_dose_queue.
+    """
+
+    def __init__(self, path, fsync=True, lock=None):
+        self.path = path
+        self.lock = lock
+        self.offset_path = f"{path}.offset"
+        self.dead_letter_path = f"{path}.dead"
+        self.fsync = fsync
+        self._pending = deque()
+        self._end_offset = 0
+        self._mutex = threading.Lock()
+
+        # Metrics
+        self.accepted = 0
+        self.flushed = 0
+        self.dead_lettered = 0
+        self.flush_batches = 0
+        self.flush_failures = 0
+        self.last_flush_seconds = None
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+        self._recover()
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        tmp_path = f"{self.offset_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def _recover(self):
+        """
+        Reload entries appended after the last flushed offset.
+        """
+        if not os.path.exists(self.path):
+            return
+        offset = self._read_offset()
+        size = os.path.getsize(self.path)
+        if offset > size:
+            # Crashed between truncating the log and resetting the offset
+            offset = 0
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            position = offset
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn write at the tail, never acknowledged
+                    break
+                position += len(line)
+                self._pending.append((position, json.loads(line)))
+        self._end_offset = position
+        if position < size:
+            with open(self.path, "r+b") as f:
+                f.truncate(position)
+
+    def append(self, entry):
+        """
+        Durably append an entry. Returns once it is on disk.
+        """
+        entry = {**entry, "queued_at": time.time()}
+        line = (json.dumps(entry) + "\n").encode()
+        # Held across the fsync so the flusher can't truncate the log under this write
+        with self._mutex:
+            with open(self.path, "ab") as f:
+                f.write(line)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._end_offset += len(line)
+            self._pending.append((self._end_offset, entry))
+            self.accepted += 1
+
+    def peek_batch(self, max_size):
+        """
+        Get up to `max_size` of the oldest pending entries without removing them.
+        """
+        with self._mutex:
+            return [entry for _, entry in islice(self._pending, max_size)]
+
+    def commit(self, count, flush_seconds=None):
+        """
+        Mark the `count` oldest pending entries as flushed.
+        """
+        if count <= 0:
+            return
+        self._advance(count)
+        self.flushed += count
+        if flush_seconds is not None:
+            self.flush_batches += 1
+            self.last_flush_seconds = flush_seconds
+            self.max_flush_seconds = max(self.max_flush_seconds, flush_seconds)
+            self.total_flush_seconds += flush_seconds
+
+    def _advance(self, count):
+        with self._mutex:
+            offset = None
+            for _ in range(count):
+                offset, _ = self._pending.popleft()
+
+            if self._pending:
+                self._write_offset(offset)
+            else:
+                # Everything is flushed, so start the log over instead of growing it
+                with open(self.path, "r+b") as f:
+                    f.truncate(0)
+                self._end_offset = 0
+                self._write_offset(0)
+
+    def dead_letter(self, count, error):
+        """
+        Move the `count` oldest pending entries to the dead-letter file.
+        """
+        entries = self.peek_batch(count)
+        with open(self.dead_letter_path, "a") as f:
+            for entry in entries:
+                f.write(json.dumps({"entry": entry, "error": error}) + "\n")
+        self.dead_lettered += len(entries)
+        self._advance(len(entries))
+
+    def close(self):
+        """
+        Release the queue file for another process.
+        """
+        if self.lock is not None and self.lock.held:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def metrics(self):
+        oldest = self._pending[0][1].get("queued_at") if self._pending else None
+        return {
+            "path": self.path,
+            "depth": len(self._pending),
+            "oldest_pending_seconds": time.time() - oldest if oldest else 0.0,
+            "accepted": self.accepted,
+            "flushed": self.flushed,
+            "dead_lettered": self.dead_lettered,
+            "flush_batches": self.flush_batches,
+            "flush_failures": self.flush_failures,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.flush_batches if self.flush_batches else None
+        }
+
+
+def queue_slot_path(path, slot):
+    """
+    Queue file of a slot: `path` itself for slot 0, then dose_queue.1.log, dose_queue.2.log...
+    """
+    if slot == 0:
+        return path
+    base, extension = os.path.splitext(path)
+    return f"{base}.{slot}{extension}"
+
+
+def claim_dose_queue(path, fsync=True, max_slots=MAX_QUEUE_SLOTS):
+    """
+    Open the first queue file not held by another process (e.g. uvicorn worker).
+
+    Each worker flushes and truncates its own file only, so it never drops doses
+    another worker acknowledged. The claim is an exclusive lock on the file's
+    .lock side file; it is released when the worker exits, and a worker started
+    later claims the file and recovers the doses left in it.
+    """
+    for slot in range(max_slots):
+        slot_path = queue_slot_path(path, slot)
+        lock = FileLock(f"{slot_path}.lock")
+        if lock.acquire(blocking=False):
+            return DurableDoseQueue(slot_path, fsync=fsync, lock=lock)
+    raise RuntimeError(f"All {max_slots} dose queue files next to {path} are held by other processes")
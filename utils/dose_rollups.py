@@ -0,0 +1,165 @@
+import os
+from collections import defaultdict
+from datetime import date
+from utils.rolling_adherence import log_date_ordinal
+
+ROLLUPS_TABLE = "dose_log_rollups"
+
+# Dose logs older than this (whole months) are rolled up and archived by compact_dose_logs.py
+DOSE_LOG_RETENTION_DAYS = int(os.getenv("DOSE_LOG_RETENTION_DAYS", "365"))
+# Rolling windows (90 days), the forecast lookback (90) and evaluate_risk_model.py (104)
+# read raw logs of their own period, so those are never compacted
+MIN_RETENTION_DAYS = 120
+
+ROLLUP_PAGE_SIZE = 1000
+HISTORY_PAGE_SIZE = 1000
+
+# Rollups count Taken and Missed doses apart; other statuses come back as this one
+OTHER_STATUS = "Inconsistent"
+
+
+def month_start(ordinal):
+    day = date.fromordinal(ordinal)
+    return date(day.year, day.month, 1).toordinal()
+
+
+def next_month_start(ordinal):
+    day = date.fromordinal(ordinal)
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1).toordinal()
+
+
+def compaction_cutoff(today=None, retention_days=DOSE_LOG_RETENTION_DAYS):
+    """
+    First day of the month holding the day retention_days ago; logs dated before it are compacted.
+    """
+    today = today or date.today().toordinal()
+    return month_start(today - retention_days)
+
+
+def build_rollups(dose_logs, existing=()):
+    """
+    Per-patient, per-medication monthly rollups of dose logs, merged into existing rollups.
+
+    A rollup keeps the month's counts and, per day of the month, the
+    [taken, missed, total] counts, so calendars, streaks and daily features
+    rebuilt from it are the same as from the raw logs.
+
+    Returns:
+        list: Rollup rows keyed by (patient_id, medication, month)
+    """
+    rollups = {}
+    for rollup in existing:
+        key = (rollup["patient_id"], rollup["medication"], rollup["month"])
+        rollups[key] = {**rollup, "daily": {day: list(counts) for day, counts in rollup["daily"].items()}}
+
+    for log in dose_logs:
+        ordinal = log_date_ordinal(log)
+        month = date.fromordinal(month_start(ordinal)).isoformat()
+        key = (log["patient_id"], log.get("medication") or "", month)
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = {
+                "patient_id": key[0], "medication": key[1], "month": month,
+                "taken": 0, "missed": 0, "total": 0, "daily": {}
+            }
+        counts = rollup["daily"].setdefault(str(date.fromordinal(ordinal).day), [0, 0, 0])
+        status = log.get("status")
+        if status == "Taken":
+            rollup["taken"] += 1
+            counts[0] += 1
+        elif status == "Missed":
+            rollup["missed"] += 1
+            counts[1] += 1
+        rollup["total"] += 1
+        counts[2] += 1
+    return list(rollups.values())
+
+
+def expand_rollups(rollups):
+    """
+    Weighted dose logs standing in for rolled up ones: one per day and status,
+    with a "count" of the doses it represents.
+    """
+    for rollup in rollups:
+        first = date.fromisoformat(str(rollup["month"])[:10])
+        for day, (taken, missed, total) in rollup["daily"].items():
+            log_date = first.replace(day=int(day)).isoformat()
+            for status, count in (("Taken", taken), ("Missed", missed), (OTHER_STATUS, total - taken - missed)):
+                if count:
+                    yield {
+                        "patient_id": rollup["patient_id"],
+                        "medication": rollup["medication"],
+                        "status": status,
+                        "date": log_date,
+                        "count": count
+                    }
+
+
+def compacted_through(rollups):
+    """
+    Last day ordinal covered by a patient's rollups, None if nothing was compacted.
+    """
+    months = [rollup["month"] for rollup in rollups]
+    if not months:
+        return None
+    return next_month_start(date.fromisoformat(str(max(months))[:10]).toordinal()) - 1
+
+
+def combine_history(dose_logs, rollups):
+    """
+    A patient's dose history: their rollups and the raw logs after the compacted months.
+
+    Raw logs must be fetched before the rollups. Logs compacted in between are
+    then covered by the rollups and dropped here, never counted twice.
+    """
+    rollups = list(rollups)
+    through = compacted_through(rollups)
+    recent = [log for log in dose_logs if through is None or log_date_ordinal(log) > through]
+    return recent + list(expand_rollups(rollups))
+
+
+def fetch_rollups(supabase, patient_ids, start=None, end=None, page_size=ROLLUP_PAGE_SIZE):
+    """
+    Rollups of some patients, optionally only the months between two day ordinals.
+
+    Returns:
+        dict: patient_id -> list of rollups
+    """
+    by_patient = defaultdict(list)
+    offset = 0
+    while True:
+        query = supabase.table(ROLLUPS_TABLE).select("*").in_("patient_id", list(patient_ids))
+        if start is not None:
+            query = query.gte("month", date.fromordinal(month_start(start)).isoformat())
+        if end is not None:
+            query = query.lte("month", date.fromordinal(end).isoformat())
+        page = query.order("patient_id").order("medication").order("month").range(
+            offset, offset + page_size - 1
+        ).execute().data or []
+        for rollup in page:
+            by_patient[rollup["patient_id"]].append(rollup)
+        if len(page) < page_size:
+            return by_patient
+        offset += page_size
+
+
+def fetch_patient_history(supabase, patient_id, columns="*", page_size=HISTORY_PAGE_SIZE):
+    """
+    A patient's raw dose logs combined with their rollups (see combine_history).
+
+    Returns:
+        tuple: (dose history, number of raw logs fetched)
+    """
+    # Paged, so patients with more logs than PostgREST returns per request get their whole history
+    dose_logs, offset = [], 0
+    while True:
+        page = supabase.table("dose_logs").select(columns).eq("patient_id", patient_id).order("id").range(
+            offset, offset + page_size - 1
+        ).execute().data or []
+        dose_logs.extend(page)
+        if len(page) < page_size:
+            break
+        offset += page_size
+    # After the raw logs, so logs compacted in between are counted once (see combine_history)
+    rollups = fetch_rollups(supabase, [patient_id]).get(patient_id, [])
+    return combine_history(dose_logs, rollups), len(dose_logs)
@@ -0,0 +1,53 @@
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+
+
+def patient_validators(resource, patient):
+    """
+    Response headers validating a patient resource, from the patient row's stored version.
+
+    `version` and `updated_at` are bumped by database triggers on every write to
+    the patient's rows (see README). Select the row with "*": the columns may
+    not exist yet, and PostgREST rejects selects naming unknown columns.
+
+    The version lives in the database, so every server process sends the same
+    validators and a write through any of them invalidates them. Read the patient
+    row before the rest of the data, so a concurrent write can only make the
+    validators older, never newer.
+
+    Returns:
+        dict: ETag, Last-Modified and Cache-Control headers, None when the
+        patients table has no version column (conditional requests are then not answered)
+    """
+    version = patient.get("version")
+    if version is None:
+        return None
+    validators = {"ETag": f'W/"{resource}-{version}"', "Cache-Control": "no-cache"}
+    updated_at = patient.get("updated_at")
+    if updated_at:
+        modified = datetime.fromisoformat(str(updated_at).replace("Z", "+00:00"))
+        validators["Last-Modified"] = formatdate(modified.timestamp(), usegmt=True)
+    return validators
+
+
+def is_not_modified(request_headers, validators):
+    """
+    Evaluate If-None-Match / If-Modified-Since request headers against the validators.
+    """
+    if validators is None:
+        return False
+    if_none_match = request_headers.get("if-none-match")
+    if_modified_since = request_headers.get("if-modified-since")
+    etag = validators["ETag"]
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # Weak comparison, so W/"x" matches "x"
+        bare = etag[2:] if etag.startswith("W/") else etag
+        return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == bare for tag in tags)
+    if if_modified_since and "Last-Modified" in validators:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+            return parsedate_to_datetime(validators["Last-Modified"]).timestamp() <= since
+        except (TypeError, ValueError):
+            return False
+    return False
@@ -0,0 +1,79 @@
+import asyncio
+import itertools
+import os
+import time
+
+EVENT_SUBSCRIBER_BUFFER = int(os.getenv("EVENT_SUBSCRIBER_BUFFER", "100"))
+
+
+class Subscription:
+    """
+    A subscriber's bounded event buffer, optionally filtered to a set of patients.
+    """
+
+    def __init__(self, patient_ids=None, buffer_size=EVENT_SUBSCRIBER_BUFFER):
+        self.patient_ids = set(patient_ids) if patient_ids else None
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+
+    def wants(self, event):
+        return self.patient_ids is None or event.get("patient_id") in self.patient_ids
+
+    def offer(self, event):
+        """
+        Buffer an event without blocking the publisher.
+
+        A subscriber that falls a full buffer behind loses its backlog and gets a
+        single "resync" event instead, telling it to refetch.
+
+        Returns:
+            int: Number of buffered events dropped
+        """
+        try:
+            self.queue.put_nowait(event)
+            return 0
+        except asyncio.QueueFull:
+            dropped = self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "ts": event["ts"]})
+            return dropped
+
+
+class EventBroadcaster:
+    """
+    Fans out compact change events to live subscribers.
+
+    publish() must be called from the event loop thread.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, patient_ids=None):
+        subscription = Subscription(patient_ids)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.discard(subscription)
+
+    def publish(self, event_type, **fields):
+        event = {"id": next(self._ids), "type": event_type, "ts": time.time(), **fields}
+        self.published += 1
+        for subscription in self._subscriptions:
+            if subscription.wants(event):
+                self.dropped += subscription.offer(event)
+        return event
+
+    def metrics(self):
+        return {
+            "subscribers": len(self._subscriptions),
+            "published": self.published,
+            "dropped": self.dropped
+        }
+
+
+event_broadcaster = EventBroadcaster()
@@ -0,0 +1,211 @@
+import threading
+from datetime import date
+import numpy as np
+from utils.rolling_adherence import log_date_ordinal
+
+# Behavioral features served to the risk model, in column order
+BEHAVIOR_FEATURES = [
+    "current_streak",            # consecutive days, up to the latest logged day, with every dose taken
+    "longest_streak",
+    "days_since_last_log",
+    "daily_adherence_std",       # spread of daily adherence, in percentage points
+    "weekday_spread",            # best minus worst weekday adherence, in percentage points
+    "min_medication_adherence",  # adherence of the patient's worst medication
+    "medication_count",
+]
+
+# Per-patient state columns (float32 counts and day ordinals are exact below 2^24)
+(TAKEN, TOTAL, LAST_DAY, OPEN_TAKEN, OPEN_TOTAL, STREAK, LAST_CLOSED, LONGEST,
+ DAYS_N, DAYS_MEAN, DAYS_M2, MIN_MEDICATION, MEDICATION_COUNT) = range(13)
+WEEKDAY_TAKEN = 13
+WEEKDAY_TOTAL = WEEKDAY_TAKEN + 7
+STATE_COLUMNS = WEEKDAY_TOTAL + 7
+
+EMPTY_ROW = np.zeros(STATE_COLUMNS, dtype=np.float32)
+EMPTY_ROW[LAST_DAY] = -1
+EMPTY_ROW[LAST_CLOSED] = -2
+
+
+class BehaviorFeatureStore:
+    """
+    Behavioral features per patient, maintained incrementally as doses are logged.
+
+    Each patient is one row of running counters in a float32 matrix (about 110
+    bytes per patient). Days are closed as newer days arrive, updating streaks
+    and a running (Welford) variance of daily adherence, so features never
+    need the raw logs again. matrix() turns the counters into a dense feature
+    matrix for a whole cohort with array operations.
+
+    Doses logged for a day older than the patient's latest day cannot be
+    applied incrementally; record() then returns False and the caller reloads
+    the patient from their logs.
+    """
+
+    def __init__(self, capacity=1024):
+        self._state = np.tile(EMPTY_ROW, (capacity, 1))
+        self._rows = {}
+        self._free = []
+        # Per-medication (taken, total), for the worst-medication feature
+        self._medications = {}
+        # Patients are updated from worker threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def is_loaded(self, patient_id):
+        return patient_id in self._rows
+
+    def _allocate(self, patient_id):
+        if self._free:
+            row = self._free.pop()
+        else:
+            row = len(self._rows)
+            if row == len(self._state):
+                grown = np.tile(EMPTY_ROW, (len(self._state) * 2, 1))
+                grown[:row] = self._state
+                self._state = grown
+        self._state[row] = EMPTY_ROW
+        self._rows[patient_id] = row
+        self._medications[patient_id] = {}
+        return row
+
+    def _close_day(self, state):
+        rate = state[OPEN_TAKEN] / state[OPEN_TOTAL]
+        state[DAYS_N] += 1
+        delta = rate - state[DAYS_MEAN]
+        state[DAYS_MEAN] += delta / state[DAYS_N]
+        state[DAYS_M2] += delta * (rate - state[DAYS_MEAN])
+
+        day = state[LAST_DAY]
+        if state[OPEN_TAKEN] == state[OPEN_TOTAL]:
+            state[STREAK] = state[STREAK] + 1 if state[LAST_CLOSED] == day - 1 else 1
+        else:
+            state[STREAK] = 0
+        state[LAST_CLOSED] = day
+        state[LONGEST] = max(state[LONGEST], state[STREAK])
+
+    def _add(self, patient_id, row, medication, day, status, count=1):
+        state = self._state[row]
+        taken = status == "Taken"
+        if state[LAST_DAY] >= 0 and day > state[LAST_DAY]:
+            self._close_day(state)
+            state[OPEN_TAKEN] = state[OPEN_TOTAL] = 0
+        state[LAST_DAY] = day
+        state[OPEN_TOTAL] += count
+        state[TOTAL] += count
+        weekday = date.fromordinal(day).weekday()
+        state[WEEKDAY_TOTAL + weekday] += count
+        if taken:
+            state[OPEN_TAKEN] += count
+            state[TAKEN] += count
+            state[WEEKDAY_TAKEN + weekday] += count
+
+        medications = self._medications[patient_id]
+        counts = medications.setdefault(medication or "", [0, 0])
+        counts[0] += taken * count
+        counts[1] += count
+        state[MIN_MEDICATION] = min(t / n for t, n in medications.values())
+        state[MEDICATION_COUNT] = len(medications)
+
+    def load(self, patient_id, dose_logs):
+        """
+        (Re)build a patient's counters from their dose logs.
+        """
+        ordered = sorted(((log_date_ordinal(log), index, log) for index, log in enumerate(dose_logs or [])))
+        with self._lock:
+            row = self._rows.get(patient_id)
+            if row is None:
+                row = self._allocate(patient_id)
+            else:
+                self._state[row] = EMPTY_ROW
+                self._medications[patient_id] = {}
+            for day, _, log in ordered:
+                self._add(patient_id, row, log.get("medication"), day, log.get("status"), log.get("count", 1))
+
+    def ensure_loaded(self, patient_id, dose_logs):
+        if patient_id not in self._rows:
+            self.load(patient_id, dose_logs)
+
+    def record(self, patient_id, medication, status, log_date=None):
+        """
+        Apply a single dose.
+
+        Returns:
+            bool: False if the patient is not loaded or the dose is for a day before
+                their latest one, in which case the patient must be reloaded
+        """
+        day = log_date_ordinal({"date": log_date})
+        with self._lock:
+            row = self._rows.get(patient_id)
+            if row is None or day < self._state[row, LAST_DAY]:
+                return False
+            self._add(patient_id, row, medication, day, status)
+            return True
+
+    def forget(self, patient_id):
+        with self._lock:
+            row = self._rows.pop(patient_id, None)
+            if row is not None:
+                self._medications.pop(patient_id, None)
+                self._free.append(row)
+
+    def matrix(self, patient_ids, today=None):
+        """
+        Dense (patients, len(BEHAVIOR_FEATURES)) float32 feature matrix.
+        Patients that are not loaded get a row of zeros.
+        """
+        today = today or date.today().toordinal()
+        with self._lock:
+            rows = np.array([self._rows.get(patient_id, -1) for patient_id in patient_ids], dtype=np.int64)
+            state = np.where((rows >= 0)[:, None], self._state[np.maximum(rows, 0)], EMPTY_ROW) if len(rows) else np.tile(EMPTY_ROW, (0, 1))
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            has_logs = state[:, TOTAL] > 0
+            open_complete = (state[:, OPEN_TOTAL] > 0) & (state[:, OPEN_TAKEN] == state[:, OPEN_TOTAL])
+            chained = (state[:, LAST_CLOSED] == state[:, LAST_DAY] - 1) & (state[:, STREAK] > 0)
+            current_streak = np.where(open_complete, np.where(chained, state[:, STREAK] + 1, 1), 0)
+            longest_streak = np.maximum(state[:, LONGEST], current_streak)
+            days_since = np.where(has_logs, today - state[:, LAST_DAY], 0)
+
+            # Fold the open (latest) day into the running variance of daily adherence
+            open_rate = np.where(state[:, OPEN_TOTAL] > 0, state[:, OPEN_TAKEN] / state[:, OPEN_TOTAL], 0)
+            n = state[:, DAYS_N] + 1
+            delta = open_rate - state[:, DAYS_MEAN]
+            mean = state[:, DAYS_MEAN] + delta / n
+            m2 = state[:, DAYS_M2] + delta * (open_rate - mean)
+            daily_std = np.where(has_logs, np.sqrt(np.maximum(m2, 0) / n) * 100, 0)
+
+            weekday_total = state[:, WEEKDAY_TOTAL:WEEKDAY_TOTAL + 7]
+            weekday_logged = weekday_total > 0
+            weekday_rate = state[:, WEEKDAY_TAKEN:WEEKDAY_TAKEN + 7] / weekday_total
+            weekday_spread = np.where(
+                weekday_logged.sum(axis=1) > 1,
+                (np.where(weekday_logged, weekday_rate, -np.inf).max(axis=1)
+                 - np.where(weekday_logged, weekday_rate, np.inf).min(axis=1)) * 100,
+                0
+            )
+
+        return np.column_stack((
+            current_streak, longest_streak, days_since, daily_std, weekday_spread,
+            state[:, MIN_MEDICATION] * 100, state[:, MEDICATION_COUNT]
+        )).astype(np.float32)
+
+    def features(self, patient_id, today=None):
+        """
+        Behavioral features of one patient as a dict, None if the patient is not loaded.
+        """
+        if patient_id not in self._rows:
+            return None
+        values = self.matrix([patient_id], today)[0]
+        return {name: float(value) for name, value in zip(BEHAVIOR_FEATURES, values)}
+
+    def metrics(self):
+        return {
+            "patients": len(self._rows),
+            "state_bytes": self._state.nbytes,
+            "bytes_per_patient": self._state.itemsize * STATE_COLUMNS
+        }
+
+
+behavior_features = BehaviorFeatureStore()
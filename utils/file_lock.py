@@ -0,0 +1,73 @@
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Exclusive lock on a side file, held across processes (e.g. uvicorn workers).
+
+    Threads sharing one FileLock (model builds run in worker threads) take turns
+    on a thread lock first, so only one of them owns the open file at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._thread_lock = threading.Lock()
+
+    def acquire(self, blocking=True):
+        """
+        Take the lock, waiting for it when `blocking`. Returns False if it is held elsewhere.
+        """
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            self._file = open(self.path, "a+")
+        except OSError:
+            self._thread_lock.release()
+            raise
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self._file.seek(0)
+                # LK_LOCK retries for ~10s; keep waiting while another worker is training
+                while True:
+                    try:
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+        except OSError:
+            self._file.close()
+            self._file = None
+            self._thread_lock.release()
+            return False
+        return True
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+        self._thread_lock.release()
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from supabase import ClientOptions, create_client
+from utils.profiling import record_upstream_call
+from utils.round_trips import record_round_trip
+
+try:
+    import h2  # noqa: F401  (HTTP/2 support for httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2 = os.getenv("HTTP2", "1") == "1" and HTTP2_AVAILABLE
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+# How long a request waits for a free pooled connection before failing
+HTTP_POOL_TIMEOUT_SECONDS = float(os.getenv("HTTP_POOL_TIMEOUT_SECONDS", "5"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_MAX_KEEPALIVE_CONNECTIONS", "10"))
+SUPABASE_READ_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_READ_TIMEOUT_SECONDS", "30"))
+
+# Gemini calls go over a single long-lived gRPC channel; this bounds how many run at once
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "20"))
+
+
+def is_permanent_error(error):
+    """
+    Check whether a store error will fail again on retry (Postgres data or integrity errors).
+    """
+    code = str(getattr(error, "code", "") or "")
+    return code.startswith("22") or code.startswith("23")
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """
+    Connection-pooling transport that counts requests in flight, pool waits and failures.
+    """
+
+    def __init__(self, name, limits, **kwargs):
+        super().__init__(limits=limits, **kwargs)
+        self.name = name
+        self.max_connections = limits.max_connections
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.pool_timeouts = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    def handle_request(self, request):
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        status = None
+        try:
+            response = super().handle_request(request)
+            status = response.status_code
+            return response
+        except httpx.PoolTimeout:
+            self.pool_timeouts += 1
+            raise
+        except httpx.TimeoutException:
+            self.timeouts += 1
+            raise
+        except httpx.TransportError:
+            self.errors += 1
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                self.in_flight -= 1
+                self.total_seconds += seconds
+            record_round_trip(self.name, seconds)
+            record_upstream_call(self.name, request.method, str(request.url.copy_with(query=None)), status, seconds)
+
+    def metrics(self):
+        connections = list(getattr(self._pool, "connections", []))
+        return {
+            "max_connections": self.max_connections,
+            "open_connections": len(connections),
+            "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            # With HTTP/2 several requests share a connection, so this can exceed 1 without queueing
+            "saturation": round(self.in_flight / self.max_connections, 3) if self.max_connections else None,
+            "requests": self.requests,
+            "pool_timeouts": self.pool_timeouts,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "mean_latency_ms": round(self.total_seconds / self.requests * 1000, 2) if self.requests else None
+        }
+
+
+class CallLimiter:
+    """
+    Bounded concurrency and call metrics for an API reached through its own SDK.
+    """
+
+    def __init__(self, name, max_concurrency, wait_timeout=HTTP_POOL_TIMEOUT_SECONDS):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.saturated = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one of the slots for a call. Raises TimeoutError if none frees up in time.
+        """
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            self.saturated += 1
+            raise TimeoutError("All connection slots are busy")
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        status = 200
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            status = None
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                self.in_flight -= 1
+                self.total_seconds += seconds
+            self._slots.release()
+            record_round_trip(self.name, seconds)
+            record_upstream_call(self.name, "call", None, status, seconds)
+
+    def metrics(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "saturation": round(self.in_flight / self.max_concurrency, 3),
+            "calls": self.calls,
+            "saturated": self.saturated,
+            "errors": self.errors,
+            "mean_latency_ms": round(self.total_seconds / self.calls * 1000, 2) if self.calls else None
+        }
+
+
+class HttpClients:
+    """
+    The process's pooled HTTP clients, one per upstream service.
+
+    Clients keep connections alive between requests instead of reconnecting
+    (and renegotiating TLS) per call. They are created on first use, so modules
+    can build API clients at import time, and closed together on shutdown.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, name, max_connections, max_keepalive_connections, read_timeout):
+        with self._lock:
+            entry = self._clients.get(name)
+            if entry is None or entry[0].is_closed:
+                limits = httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_keepalive_connections,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+                )
+                # Retries only cover failures to connect, never a request that was sent
+                transport = InstrumentedTransport(name, limits, http2=HTTP2, retries=1)
+                timeout = httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT_SECONDS, pool=HTTP_POOL_TIMEOUT_SECONDS)
+                entry = self._clients[name] = (
+                    httpx.Client(transport=transport, timeout=timeout, follow_redirects=True),
+                    transport
+                )
+            return entry[0]
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client, _ in clients.values():
+            client.close()
+
+    def metrics(self):
+        with self._lock:
+            entries = dict(self._clients)
+        return {name: {"http2": HTTP2, **transport.metrics()} for name, (_, transport) in entries.items()}
+
+
+http_clients = HttpClients()
+gemini_calls = CallLimiter("gemini", GEMINI_MAX_CONCURRENCY)
+
+
+def supabase_http_client():
+    return http_clients.client(
+        "supabase", SUPABASE_MAX_CONNECTIONS, SUPABASE_MAX_KEEPALIVE_CONNECTIONS, SUPABASE_READ_TIMEOUT_SECONDS
+    )
+
+
+def create_supabase_client(url=None, key=None):
+    """
+    Supabase client sending its requests over the shared, pooled HTTP client.
+    """
+    url = url or os.getenv("SUPABASE_URL")
+    key = key or os.getenv("SUPABASE_SERVICE_KEY")
+    return create_client(url, key, options=ClientOptions(httpx_client=supabase_http_client()))
@@ -0,0 +1,153 @@
+import os
+import time
+import joblib
+import numpy as np
+
+from utils.file_lock import FileLock
+
+
+def process_memory():
+    """
+    Resident memory of this process, split into private and shared (file backed) bytes where available.
+    """
+    memory = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile", "RssShmem"):
+                    memory[key] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS; report it as a peak only
+        memory["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "rss_bytes": memory.get("VmRSS"),
+        "private_bytes": memory.get("RssAnon"),
+        "shared_bytes": (memory["RssFile"] + memory.get("RssShmem", 0)) if "RssFile" in memory else None,
+        "peak_rss": memory.get("peak_rss")
+    }
+
+
+def memory_mapped_arrays(model):
+    """
+    Count the numpy arrays of a fitted estimator that are memory mapped, and their size.
+    """
+    count, nbytes = 0, 0
+    for value in vars(model).values():
+        if isinstance(value, np.memmap) or (isinstance(value, np.ndarray) and isinstance(value.base, np.memmap)):
+            count += 1
+            nbytes += value.nbytes
+    return count, nbytes
+
+
+class SharedModelStore:
+    """
+    A model artifact shared by all worker processes on one host.
+
+    The artifact is built at most once, by whichever worker first takes the
+    file lock, and written atomically. Every worker then loads it with
+    memory mapping, so the arrays are read-only pages shared through the page
+    cache instead of one private copy per worker. A worker reloads when the
+    artifact on disk is replaced.
+    """
+
+    def __init__(self, path, build, is_current=None):
+        """
+        Args:
+            path: Artifact path
+            build: Callable returning a freshly trained model
+            is_current: Optional check that a loaded model still fits the code
+        """
+        self.path = path
+        self.build = build
+        self.is_current = is_current or (lambda model: True)
+        self.lock = FileLock(path + ".lock")
+        self._model = None
+        self._mtime = None
+        self.loaded_at = None
+        self.load_seconds = None
+        self.builds = 0
+
+    @property
+    def ready(self):
+        return self._model is not None
+
+    def _artifact_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        started = time.perf_counter()
+        model = joblib.load(self.path, mmap_mode="r")
+        self.load_seconds = time.perf_counter() - started
+        return model
+
+    def save(self, model):
+        """
+        Atomically replace the artifact with a model. Call with the lock held.
+        """
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        # Uncompressed, so the arrays can be memory mapped when loaded
+        joblib.dump(model, temp_path)
+        os.replace(temp_path, self.path)
+
+    def rebuild(self, build=None):
+        """
+        Train a new model (with `build`, default the store's) and publish it to all workers.
+        """
+        with self.lock:
+            model = (build or self.build)()
+            self.save(model)
+            self.builds += 1
+        self._model, self._mtime = None, None
+        return self.get()
+
+    def ensure(self):
+        """
+        Make sure a current artifact exists, building it under the lock if needed.
+        """
+        if self._artifact_mtime() is not None and self.is_current(self._load()):
+            return
+        with self.lock:
+            # Another worker may have built it while we waited for the lock
+            if self._artifact_mtime() is not None and self.is_current(self._load()):
+                return
+            self.save(self.build())
+            self.builds += 1
+
+    def get(self):
+        """
+        The loaded model, (re)loading it if the artifact is missing, stale or replaced.
+        """
+        mtime = self._artifact_mtime()
+        if self._model is not None and mtime == self._mtime:
+            return self._model
+        if mtime is None:
+            self.ensure()
+            mtime = self._artifact_mtime()
+        model = self._load()
+        if not self.is_current(model):
+            self.ensure()
+            mtime = self._artifact_mtime()
+            model = self._load()
+        self._model, self._mtime = model, mtime
+        self.loaded_at = time.time()
+        return model
+
+    def metrics(self):
+        mapped_arrays, mapped_bytes = memory_mapped_arrays(self._model) if self._model is not None else (0, 0)
+        return {
+            "pid": os.getpid(),
+            "ready": self.ready,
+            "artifact": self.path,
+            "artifact_bytes": os.path.getsize(self.path) if self._artifact_mtime() is not None else None,
+            "loaded_at": self.loaded_at,
+            "load_ms": round(self.load_seconds * 1000, 2) if self.load_seconds is not None else None,
+            "builds_by_this_worker": self.builds,
+            "memory_mapped_arrays": mapped_arrays,
+            "memory_mapped_bytes": mapped_bytes,
+            "memory": process_memory()
+        }
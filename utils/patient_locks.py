@@ -0,0 +1,44 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyedLocks:
+    """
+    One asyncio lock per key (e.g. patient id), created on demand and dropped
+    once no task holds or waits for it. Tasks for different keys never wait on
+    each other.
+
+    Only coordinates tasks within one process.
+    """
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders and waiters]
+        self.acquired = 0
+        self.contended = 0
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        if entry[0].locked():
+            self.contended += 1
+        try:
+            async with entry[0]:
+                self.acquired += 1
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def metrics(self):
+        return {
+            "active_keys": len(self._locks),
+            "acquired": self.acquired,
+            "contended": self.contended
+        }
+
+
+patient_locks = KeyedLocks()
@@ -0,0 +1,334 @@
+import os
+import re
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+# Rebuild the index from the patients table once it is this old, to pick up
+# patients created, renamed or deleted through other workers
+SEARCH_INDEX_MAX_AGE_SECONDS = float(os.getenv("SEARCH_INDEX_MAX_AGE_SECONDS", "300"))
+
+# Result sets larger than this many times the limit are ranked by walking the name order
+NAME_WALK_FACTOR = 8
+
+# Scores for how a query term matched a patient token
+EXACT_SCORE = 3
+PREFIX_SCORE = 2
+FUZZY_SCORE = 1
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase alphanumeric tokens.
+    """
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def trigrams(token):
+    padded = f"${token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_typos(term):
+    """
+    Number of edits tolerated for a query term of this length.
+    """
+    if len(term) <= 3:
+        return 0
+    if len(term) <= 6:
+        return 1
+    return 2
+
+
+def within_edit_distance(a, b, limit):
+    """
+    Check whether the edit distance between a and b is at most `limit`.
+
+    Insertions, deletions, substitutions and adjacent transpositions each count
+    as one edit (optimal string alignment distance).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return False
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            cost = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            )
+            if before is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                cost = min(cost, before[j - 2] + 1)
+            current[j] = cost
+            row_min = min(row_min, cost)
+        if row_min > limit:
+            return False
+        before, previous = previous, current
+    return previous[-1] <= limit
+
+
+class PatientSearchIndex:
+    """
+    In-memory search index over patient names and conditions.
+
+    Tokens are kept in a sorted list for prefix lookups and in a trigram inverted
+    index for typo-tolerant lookups. Both index distinct tokens, not patients, so
+    query cost depends on the vocabulary rather than the number of patients.
+
+    Patients are added from worker threads (warm-up, bulk imports) while
+    searches run on the event loop, so every read and write holds the lock.
+    Changes made while a rebuild reads the patients table are replayed onto
+    the rebuilt index, so they are not lost when it is swapped in.
+    """
+
+    def __init__(self):
+        self.built = False
+        self.built_at = None
+        self._builds = 0
+        self._journal = None
+        self._patients = {}
+        self._tokens_by_patient = {}
+        self._name_order = []
+        self._token_patients = {}
+        self._sorted_tokens = []
+        self._trigram_tokens = {}
+        self._lock = threading.Lock()
+
+    def begin_build(self):
+        """
+        Start recording changes for a build(), before its patients are read.
+        """
+        with self._lock:
+            self._builds += 1
+            if self._journal is None:
+                self._journal = []
+
+    def build(self, patients):
+        """
+        Rebuild the index from a list of patient records.
+
+        The new index is built aside and swapped in, so searches meanwhile use the old one.
+        """
+        fresh = PatientSearchIndex()
+        for patient in patients:
+            fresh._add(patient, bulk=True)
+        fresh._sorted_tokens.sort()
+        fresh._name_order.sort()
+        with self._lock:
+            # Adds and removes since begin_build() may be missing from `patients`
+            for action, change in self._journal or ():
+                if action == "add":
+                    fresh._add(change)
+                else:
+                    fresh._remove(change)
+            if self._builds:
+                self._builds -= 1
+            if not self._builds:
+                self._journal = None
+            self._patients = fresh._patients
+            self._tokens_by_patient = fresh._tokens_by_patient
+            self._name_order = fresh._name_order
+            self._token_patients = fresh._token_patients
+            self._sorted_tokens = fresh._sorted_tokens
+            self._trigram_tokens = fresh._trigram_tokens
+            self.built = True
+            self.built_at = time.monotonic()
+
+    def is_stale(self, max_age=SEARCH_INDEX_MAX_AGE_SECONDS):
+        return self.built_at is None or time.monotonic() - self.built_at > max_age
+
+    def add(self, patient):
+        """
+        Add or replace a patient.
+        """
+        with self._lock:
+            self._add(patient)
+            if self._journal is not None:
+                self._journal.append(("add", patient))
+
+    def _add(self, patient, bulk=False):
+        """
+        With bulk=True the sorted lists are appended to and must be sorted afterwards (see build()).
+        """
+        insert = list.append if bulk else insort
+        patient_id = patient["id"]
+        if patient_id in self._patients:
+            if bulk:
+                return
+            self._remove(patient_id)
+        record = {
+            "id": patient_id,
+            "name": patient.get("name"),
+            "condition": patient.get("condition")
+        }
+        self._patients[patient_id] = record
+        insert(self._name_order, (self._name_key(record), patient_id))
+        tokens = self._tokens_by_patient[patient_id] = self._patient_tokens(record)
+        for token in tokens:
+            ids = self._token_patients.get(token)
+            if ids is None:
+                ids = self._token_patients[token] = set()
+                insert(self._sorted_tokens, token)
+                for gram in trigrams(token):
+                    self._trigram_tokens.setdefault(gram, set()).add(token)
+            ids.add(patient_id)
+
+    def remove(self, patient_id):
+        with self._lock:
+            self._remove(patient_id)
+            if self._journal is not None:
+                self._journal.append(("remove", patient_id))
+
+    def _remove(self, patient_id):
+        record = self._patients.pop(patient_id, None)
+        if record is None:
+            return
+        del self._name_order[bisect_left(self._name_order, (self._name_key(record), patient_id))]
+        for token in self._tokens_by_patient.pop(patient_id):
+            ids = self._token_patients.get(token)
+            if ids is None:
+                continue
+            ids.discard(patient_id)
+            if not ids:
+                del self._token_patients[token]
+                del self._sorted_tokens[bisect_left(self._sorted_tokens, token)]
+                for gram in trigrams(token):
+                    tokens = self._trigram_tokens.get(gram)
+                    if tokens is not None:
+                        tokens.discard(token)
+                        if not tokens:
+                            del self._trigram_tokens[gram]
+
+    def __len__(self):
+        return len(self._patients)
+
+    @staticmethod
+    def _name_key(record):
+        return (record["name"] or "").lower()
+
+    @staticmethod
+    def _patient_tokens(record):
+        return set(tokenize(record["name"])) | set(tokenize(record["condition"]))
+
+    def _term_tokens(self, term, fuzzy):
+        """
+        Map each vocabulary token matching a single query term to its score.
+        """
+        token_scores = {}
+
+        # Exact and prefix matches from the sorted token list
+        start = bisect_left(self._sorted_tokens, term)
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(term):
+                break
+            token_scores[token] = EXACT_SCORE if token == term else PREFIX_SCORE
+
+        # Typo-tolerant matches from tokens sharing trigrams with the term,
+        # only needed when the term matched nothing literally
+        limit = max_typos(term)
+        if fuzzy and limit and not token_scores:
+            grams = trigrams(term)
+            # Each edit destroys at most four trigrams (a transposition)
+            required = max(1, len(grams) - 4 * limit)
+            shared = {}
+            for gram in grams:
+                for token in self._trigram_tokens.get(gram, ()):
+                    shared[token] = shared.get(token, 0) + 1
+            for token, count in shared.items():
+                if count >= required and within_edit_distance(term, token, limit):
+                    token_scores[token] = FUZZY_SCORE
+
+        return token_scores
+
+    def search(self, query, limit=20, fuzzy=True):
+        """
+        Search patients by name or condition.
+
+        Every query term must match a name or condition token exactly, by prefix
+        or (when fuzzy) within a small edit distance. Typo-tolerant matching only
+        runs for terms that match no token exactly or by prefix.
+
+        Returns:
+            list: Patient records ({id, name, condition, score}) sorted by score then name
+        """
+        with self._lock:
+            return self._search(query, limit, fuzzy)
+
+    def _search(self, query, limit, fuzzy):
+        terms = tokenize(query)
+        if not terms:
+            return [{**self._patients[patient_id], "score": 0} for _, patient_id in self._name_order[:limit]]
+
+        term_levels = [self._term_levels(self._term_tokens(term, fuzzy)) for term in terms]
+        if not all(term_levels):
+            return []
+
+        # Intersect terms from the most selective one; scores add up across terms
+        term_levels.sort(key=lambda levels: sum(len(ids) for ids in levels.values()))
+        levels = term_levels[0]
+        for other in term_levels[1:]:
+            combined = {}
+            for score, ids in levels.items():
+                for other_score, other_ids in other.items():
+                    matched = ids & other_ids
+                    if matched:
+                        total = score + other_score
+                        combined[total] = combined[total] | matched if total in combined else matched
+            levels = combined
+            if not levels:
+                return []
+
+        return [{**self._patients[patient_id], "score": score} for patient_id, score in self._rank(levels, limit)]
+
+    def _term_levels(self, token_scores):
+        """
+        Group the patients matching a term into disjoint sets by their best score.
+
+        The returned sets may be the index's own posting sets and must not be mutated.
+        """
+        by_score = {}
+        for token, score in token_scores.items():
+            by_score.setdefault(score, []).append(self._token_patients[token])
+
+        levels = {}
+        seen = None
+        for score in sorted(by_score, reverse=True):
+            postings = by_score[score]
+            ids = postings[0] if len(postings) == 1 else set().union(*postings)
+            if seen:
+                ids = ids - seen
+            if ids:
+                levels[score] = ids
+                seen = ids if seen is None else seen | ids
+        return levels
+
+    def _rank(self, levels, limit):
+        """
+        Pick the top `limit` (patient_id, score) pairs by score, then name.
+        """
+        ranked = []
+        for score in sorted(levels, reverse=True):
+            ids = levels[score]
+            wanted = limit - len(ranked)
+            if len(ids) <= NAME_WALK_FACTOR * wanted:
+                top = heapq.nsmallest(wanted, ids, key=lambda p: self._name_key(self._patients[p]))
+            else:
+                # Large levels are dense in the name order, so the walk stops early
+                top = []
+                for _, patient_id in self._name_order:
+                    if patient_id in ids:
+                        top.append(patient_id)
+                        if len(top) == wanted:
+                            break
+            ranked.extend((patient_id, score) for patient_id in top)
+            if len(ranked) >= limit:
+                break
+        return ranked
+
+patient_search_index = PatientSearchIndex()
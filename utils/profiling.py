@@ -0,0 +1,242 @@
+import contextvars
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+# Off by default; when off the middleware is not installed at all
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Requests sending "X-Profile: <token>" are profiled; empty disables the header
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+# Fraction of other requests profiled at random (0 = only on request)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+# Profiles kept in memory, and profiled requests allowed at once
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "50"))
+PROFILING_MAX_CONCURRENT = int(os.getenv("PROFILING_MAX_CONCURRENT", "2"))
+# Directory profiles are also written to (<id>.folded and <id>.json), if set
+PROFILING_DIR = os.getenv("PROFILING_DIR", "")
+
+PROFILE_HEADER = b"x-profile"
+MAX_STACK_DEPTH = 128
+
+# Never profiled: probes, the profile endpoints themselves and event streams
+EXEMPT_PREFIXES = ("/health", "/api/events/stream")
+
+# The profile of the request being handled, so upstream calls can be attributed to it
+active_profile = contextvars.ContextVar("active_profile", default=None)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def folded_stack(frame):
+    """
+    Root-first, semicolon separated stack of a frame, as used by flame graph tools.
+    """
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def record_upstream_call(service, method, url, status, seconds):
+    """
+    Attribute an upstream call to the request being profiled, if any.
+    """
+    profile = active_profile.get()
+    if profile is not None:
+        profile.upstream.append({
+            "service": service,
+            "method": method,
+            "url": url,
+            "status": status,
+            "ms": round(seconds * 1000, 2),
+            "at_ms": round((time.perf_counter() - profile.started) * 1000, 2)
+        })
+
+
+class RequestProfile:
+    """
+    Sampling profile of one request.
+
+    A sampler thread records the stack of the thread handling the request
+    every interval_ms. Route handlers run on the event loop thread, so samples
+    taken while the request awaits show the loop (or other requests it runs
+    meanwhile) rather than this request.
+    """
+
+    def __init__(self, method, path, reason, interval_ms=PROFILING_INTERVAL_MS):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self.upstream = []
+        self.status = None
+        self.started = None
+        self.seconds = None
+        self.created_at = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self, thread_id=None):
+        thread_id = thread_id or threading.get_ident()
+        self.created_at = time.time()
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, args=(thread_id,), daemon=True, name=f"profiler-{self.id}")
+        self._sampler.start()
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            self.samples[folded_stack(frame)] += 1
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.started
+        self._stop.set()
+        self._sampler.join()
+
+    def folded(self):
+        """
+        Profile in collapsed stack format ("frame;frame;frame count" per line), for flamegraph.pl or speedscope.
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+    def upstream_breakdown(self):
+        services = {}
+        for call in self.upstream:
+            service = services.setdefault(call["service"], {"calls": 0, "ms": 0.0, "errors": 0})
+            service["calls"] += 1
+            service["ms"] = round(service["ms"] + call["ms"], 2)
+            if call["status"] is None or call["status"] >= 400:
+                service["errors"] += 1
+        return services
+
+    def summary(self, top=15):
+        own = Counter()
+        for stack, count in self.samples.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        total = sum(self.samples.values())
+        upstream_ms = sum(call["ms"] for call in self.upstream)
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "status": self.status,
+            "created_at": self.created_at,
+            "ms": round(self.seconds * 1000, 2) if self.seconds is not None else None,
+            "interval_ms": self.interval * 1000,
+            "samples": total,
+            # Frames the sampled thread was executing, by share of samples
+            "top_frames": [
+                {"frame": frame, "samples": count, "share": round(count / total, 3)}
+                for frame, count in own.most_common(top)
+            ],
+            "upstream_ms": round(upstream_ms, 2),
+            "upstream": self.upstream_breakdown(),
+            "upstream_calls": self.upstream
+        }
+
+
+class ProfileStore:
+    """
+    The most recent profiles of this worker, optionally also written to a directory.
+    """
+
+    def __init__(self, keep=PROFILING_KEEP, directory=PROFILING_DIR):
+        self.directory = directory
+        self._profiles = deque(maxlen=keep)
+
+    def add(self, profile):
+        self._profiles.append(profile)
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(os.path.join(self.directory, f"{profile.id}.folded"), "w") as f:
+                    f.write(profile.folded())
+                with open(os.path.join(self.directory, f"{profile.id}.json"), "w") as f:
+                    json.dump(profile.summary(), f, indent=2)
+            except OSError as e:
+                print(f"Could not write profile {profile.id}: {e}")
+
+    def get(self, profile_id):
+        return next((profile for profile in self._profiles if profile.id == profile_id), None)
+
+    def list(self):
+        return [
+            {key: summary[key] for key in ("id", "method", "path", "reason", "status", "ms", "samples", "upstream_ms")}
+            for summary in (profile.summary() for profile in reversed(self._profiles))
+        ]
+
+
+profile_store = ProfileStore()
+
+
+def token_matches(value, token=PROFILING_TOKEN):
+    return bool(token) and value is not None and hmac.compare_digest(value, token.encode())
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests that ask for it with the X-Profile
+    header, or a random PROFILING_SAMPLE_RATE share of requests.
+
+    Profiled responses carry an X-Profile-Id header; the profile is kept in
+    profile_store for GET /health/profiles/{id}.
+    """
+
+    def __init__(self, app, store=profile_store, token=PROFILING_TOKEN,
+                 sample_rate=PROFILING_SAMPLE_RATE, max_concurrent=PROFILING_MAX_CONCURRENT):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.max_concurrent = max_concurrent
+        self.active = 0
+
+    def _reason(self, scope):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT_PREFIXES):
+            return None
+        if token_matches(dict(scope.get("headers") or []).get(PROFILE_HEADER), self.token):
+            return "requested"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        reason = self._reason(scope)
+        if reason is None or self.active >= self.max_concurrent:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], reason)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        self.active += 1
+        token = active_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            active_profile.reset(token)
+            self.active -= 1
+            self.store.add(profile)
@@ -0,0 +1,431 @@
+import asyncio
+import heapq
+import importlib
+import inspect
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from utils.adherence_bitmaps import schedule_weekdays
+from utils.event_bus import event_broadcaster
+from utils.rolling_adherence import log_date_ordinal
+
+logger = logging.getLogger(__name__)
+
+REMINDERS_ENABLED = os.getenv("REMINDERS", "false").lower() in ("1", "true", "yes")
+# "log", "events" or "package.module:factory" of a custom sink
+REMINDER_SINK = os.getenv("REMINDER_SINK", "log")
+# Longest sleep of the scheduler loop, so reminders added meanwhile are picked up within it
+REMINDER_TICK_SECONDS = float(os.getenv("REMINDER_TICK_SECONDS", "1"))
+# Reminders more than this late (e.g. after downtime) are dropped instead of sent
+REMINDER_GRACE_SECONDS = float(os.getenv("REMINDER_GRACE_SECONDS", "3600"))
+REMINDER_MAX_PER_TICK = int(os.getenv("REMINDER_MAX_PER_TICK", "10000"))
+# A sink call taking longer than this counts as a failed reminder; calls run on their own threads
+REMINDER_SEND_TIMEOUT_SECONDS = float(os.getenv("REMINDER_SEND_TIMEOUT_SECONDS", "10"))
+REMINDER_SEND_CONCURRENCY = int(os.getenv("REMINDER_SEND_CONCURRENCY", "4"))
+# The worker holding this lock sends the reminders; the others retry every REMINDER_STANDBY_SECONDS
+REMINDER_LOCK_PATH = os.getenv("REMINDER_LOCK_PATH", "reminders.lock")
+REMINDER_STANDBY_SECONDS = float(os.getenv("REMINDER_STANDBY_SECONDS", "30"))
+# Reload the schedules to pick up treatments created through other workers
+REMINDER_RELOAD_SECONDS = float(os.getenv("REMINDER_RELOAD_SECONDS", "600"))
+
+# Local dose times by frequency (the part before " (Schedule: ...)")
+DOSE_TIMES = {
+    "Once daily": ("09:00",),
+    "Twice daily": ("09:00", "21:00"),
+    "Three times daily": ("08:00", "14:00", "20:00"),
+    "Weekly": ("09:00",),
+}
+DEFAULT_DOSE_TIMES = DOSE_TIMES["Once daily"]
+
+
+def dose_minutes(frequency):
+    """
+    Minutes after midnight of a treatment's daily doses.
+    """
+    base = (frequency or "").split(" (Schedule: ")[0].strip()
+    times = DOSE_TIMES.get(base, DEFAULT_DOSE_TIMES)
+    return tuple(int(hours) * 60 + int(minutes) for hours, minutes in (t.split(":") for t in times))
+
+
+def treatment_schedule(treatment):
+    """
+    (start ordinal, weekdays, dose minutes, dosage) of a treatment.
+    Weekly treatments without schedule days repeat on the weekday they started.
+    """
+    start = log_date_ordinal({"date": treatment.get("start_date")})
+    frequency = treatment.get("frequency") or ""
+    weekdays = tuple(schedule_weekdays(frequency))
+    if frequency.startswith("Weekly") and " (Schedule: " not in frequency:
+        weekdays = (date.fromordinal(start).weekday(),)
+    return start, weekdays, dose_minutes(frequency), treatment.get("dosage")
+
+
+class MedicationReminders:
+    """
+    Reminder state of one patient's medication: its treatments and the doses logged on the latest logged day.
+    """
+
+    __slots__ = ("treatments", "version", "logged_day", "logged")
+
+    def __init__(self):
+        self.treatments = {}
+        self.version = 0
+        self.logged_day = None
+        self.logged = 0
+
+    def doses(self, day):
+        """
+        Sorted dose minutes on a day ordinal, from every treatment running that day.
+        """
+        weekday = date.fromordinal(day).weekday()
+        return sorted({
+            minute
+            for start, weekdays, minutes, _ in self.treatments.values() if start <= day and weekday in weekdays
+            for minute in minutes
+        })
+
+    def next_due(self, after):
+        """
+        (due timestamp, day ordinal, dose index of the day) of the first dose after a timestamp, None if none.
+        """
+        moment = datetime.fromtimestamp(after)
+        first = max(moment.date().toordinal(), min(start for start, _, _, _ in self.treatments.values()))
+        for day in range(first, first + 8):
+            midnight = datetime.combine(date.fromordinal(day), datetime.min.time())
+            for index, minute in enumerate(self.doses(day)):
+                due = (midnight + timedelta(minutes=minute)).timestamp()
+                if due > after:
+                    return due, day, index
+        return None
+
+    def dosage(self):
+        return next((dosage for *_, dosage in self.treatments.values() if dosage), None)
+
+
+class LogSink:
+    """
+    Stand-in for SMS/push delivery: logs reminders and keeps the most recent ones.
+    """
+
+    def __init__(self, keep=100):
+        self.sent = []
+        self.keep = keep
+
+    def send(self, reminder):
+        logger.info("Reminder for patient %s: %s %s due %s", reminder["patient_id"], reminder["medication"],
+                    reminder["dosage"] or "", reminder["due_at"])
+        self.sent = self.sent[-(self.keep - 1):] + [reminder]
+
+
+class EventSink:
+    """
+    Publishes reminders as dose_reminder events to the live event stream.
+    """
+
+    def send(self, reminder):
+        event_broadcaster.publish("dose_reminder", **reminder)
+
+
+REMINDER_SINKS = {"log": LogSink, "events": EventSink}
+
+
+def create_sink(name=REMINDER_SINK):
+    if name in REMINDER_SINKS:
+        return REMINDER_SINKS[name]()
+    module, _, factory = name.partition(":")
+    return getattr(importlib.import_module(module), factory)()
+
+
+class ReminderScheduler:
+    """
+    Dose reminders for every scheduled medication, from one global min-heap of due times.
+
+    Each patient medication has a single heap entry: its next due dose. Firing
+    a reminder pushes the medication's following dose, so a tick only touches
+    reminders that are due, never the whole cohort. Changing a treatment bumps
+    the medication's version and pushes a fresh entry; the outdated one is
+    skipped when it reaches the top of the heap. A reminder is not sent when
+    the doses logged that day already cover it (two doses logged before the
+    second reminder of a twice daily medication). Doses logged through other
+    workers are only known to the store, so confirm() checks due reminders
+    against the store's counts before they are sent.
+
+    The background scheduler sends through deliver(), which keeps slow sinks
+    off the event loop; send() is the synchronous equivalent.
+    """
+
+    def __init__(self, sink=None, grace_seconds=REMINDER_GRACE_SECONDS, clock=time.time):
+        self.sink = sink or LogSink()
+        self.grace_seconds = grace_seconds
+        self.clock = clock
+        # (patient_id, medication) -> MedicationReminders
+        self._medications = {}
+        self._by_patient = {}
+        # (due timestamp, sequence, key, version, day ordinal, dose index of the day)
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.active = False
+        self.sent = 0
+        self.skipped_logged = 0
+        self.skipped_late = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.stale_popped = 0
+        self._send_executor = None
+
+    def __len__(self):
+        return len(self._medications)
+
+    def _push(self, key, reminders, after):
+        due = reminders.next_due(after)
+        if due is not None:
+            heapq.heappush(self._heap, (due[0], next(self._sequence), key, reminders.version, *due[1:]))
+
+    def _compact(self):
+        # Outdated entries pile up when treatments change often; rebuild once they dominate
+        if len(self._heap) > 2 * len(self._medications) + 1024:
+            self._heap = [
+                entry for entry in self._heap
+                if (reminders := self._medications.get(entry[2])) is not None and reminders.version == entry[3]
+            ]
+            heapq.heapify(self._heap)
+
+    def _add(self, treatment):
+        key = (treatment["patient_id"], treatment["medication"])
+        reminders = self._medications.get(key)
+        if reminders is None:
+            reminders = self._medications[key] = MedicationReminders()
+            self._by_patient.setdefault(key[0], set()).add(key[1])
+        reminders.treatments[treatment.get("id")] = treatment_schedule(treatment)
+        return key, reminders
+
+    def add_treatment(self, treatment, now=None):
+        """
+        Schedule (or reschedule) the reminders of a treatment row. Ignored while the scheduler is off.
+        """
+        if not self.active:
+            return
+        with self._lock:
+            key, reminders = self._add(treatment)
+            reminders.version += 1
+            self._push(key, reminders, now or self.clock())
+            self._compact()
+
+    def start(self):
+        """
+        Turn the scheduler on before reading treatments for load(), so changes made meanwhile are kept.
+        """
+        self.active = True
+
+    def load(self, treatments, dose_logs=(), now=None):
+        """
+        Schedule all treatments at once (merged with any added since start()),
+        seeding today's logged doses. Also reloads the schedules; only doses
+        due after `now` are scheduled.
+        """
+        now = now or self.clock()
+        with self._lock:
+            for treatment in treatments:
+                self._add(treatment)
+            # The logged doses replace the counts, so reloading does not count them twice
+            for reminders in self._medications.values():
+                reminders.logged_day, reminders.logged = None, 0
+            for log in dose_logs:
+                self._count_dose(log["patient_id"], log.get("medication"), log_date_ordinal(log))
+            # One entry per medication, heapified in linear time
+            self._heap = []
+            for key, reminders in self._medications.items():
+                reminders.version += 1
+                due = reminders.next_due(now)
+                if due is not None:
+                    self._heap.append((due[0], next(self._sequence), key, reminders.version, *due[1:]))
+            heapq.heapify(self._heap)
+            self.active = True
+
+    def _count_dose(self, patient_id, medication, day):
+        reminders = self._medications.get((patient_id, medication))
+        if reminders is None:
+            return
+        if reminders.logged_day != day:
+            if reminders.logged_day is not None and day < reminders.logged_day:
+                return
+            reminders.logged_day, reminders.logged = day, 0
+        reminders.logged += 1
+
+    def dose_logged(self, patient_id, medication, log_date=None):
+        """
+        Count a logged dose, so reminders of doses already taken that day are not sent.
+        """
+        if not self.active:
+            return
+        with self._lock:
+            self._count_dose(patient_id, medication, log_date_ordinal({"date": log_date}))
+
+    def forget_patient(self, patient_id):
+        with self._lock:
+            for medication in self._by_patient.pop(patient_id, ()):
+                # Heap entries of the patient become outdated and are skipped
+                self._medications.pop((patient_id, medication), None)
+            self._compact()
+
+    def next_due_at(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def upcoming(self, patient_id, now=None):
+        """
+        Next reminder of each of a patient's medications.
+        """
+        now = now or self.clock()
+        with self._lock:
+            result = []
+            for medication in sorted(self._by_patient.get(patient_id, ())):
+                due = self._medications[(patient_id, medication)].next_due(now)
+                if due is not None:
+                    result.append({"medication": medication, "due_at": datetime.fromtimestamp(due[0]).isoformat()})
+            return result
+
+    def take_due(self, now=None, limit=REMINDER_MAX_PER_TICK):
+        """
+        Pop the reminders due by `now` and push each medication's following dose.
+        """
+        now = now or self.clock()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(due) < limit:
+                due_at, _, key, version, day, index = heapq.heappop(self._heap)
+                reminders = self._medications.get(key)
+                if reminders is None or reminders.version != version:
+                    self.stale_popped += 1
+                    continue
+                # Schedule the following dose before deciding about this one
+                self._push(key, reminders, due_at)
+                if reminders.logged_day == day and reminders.logged > index:
+                    self.skipped_logged += 1
+                elif now - due_at > self.grace_seconds:
+                    self.skipped_late += 1
+                else:
+                    due.append({
+                        "patient_id": key[0],
+                        "medication": key[1],
+                        "dosage": reminders.dosage(),
+                        "due_at": datetime.fromtimestamp(due_at).isoformat(),
+                        "dose_of_day": index + 1
+                    })
+        return due
+
+    def confirm(self, due, logged, patient_ids=None):
+        """
+        Drop due reminders covered by the doses logged in the store, or whose patient was deleted.
+
+        Args:
+            due: Reminders from take_due()
+            logged: Dose counts by (patient_id, medication, date) of the reminders' days
+            patient_ids: Ids of the due reminders' patients that still exist, None to skip the check
+
+        Returns:
+            list: The reminders to send
+        """
+        pending = []
+        for reminder in due:
+            patient_id = reminder["patient_id"]
+            if patient_ids is not None and patient_id not in patient_ids:
+                self.forget_patient(patient_id)
+            elif logged.get((patient_id, reminder["medication"], reminder["due_at"][:10]), 0) >= reminder["dose_of_day"]:
+                self.skipped_logged += 1
+            else:
+                pending.append(reminder)
+        return pending
+
+    def send(self, due):
+        """
+        Send reminders through the sink.
+
+        Returns:
+            int: Reminders sent
+        """
+        sent = 0
+        for reminder in due:
+            try:
+                self.sink.send(reminder)
+                sent += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Failed to send reminder for patient %s", reminder["patient_id"])
+        self.sent += sent
+        return sent
+
+    async def deliver(self, due, timeout=REMINDER_SEND_TIMEOUT_SECONDS, concurrency=REMINDER_SEND_CONCURRENCY):
+        """
+        Send reminders through the sink without blocking the event loop.
+
+        Blocking sinks run on a small thread pool of their own, so a hanging
+        SMS gateway can't tie up the threads the rest of the app uses; a sink
+        whose send() is a coroutine is awaited. Up to `concurrency` sends run
+        at once, each failing after `timeout` seconds.
+
+        Returns:
+            int: Reminders sent
+        """
+        if not due:
+            return 0
+        asynchronous = inspect.iscoroutinefunction(self.sink.send)
+        if not asynchronous and self._send_executor is None:
+            self._send_executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reminder-sink")
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def send_one(reminder):
+            async with slots:
+                try:
+                    if asynchronous:
+                        await asyncio.wait_for(self.sink.send(reminder), timeout)
+                    else:
+                        await asyncio.wait_for(loop.run_in_executor(self._send_executor, self.sink.send, reminder), timeout)
+                    return True
+                except asyncio.TimeoutError:
+                    self.failed += 1
+                    self.timed_out += 1
+                    logger.warning("Reminder for patient %s not sent within %.1fs", reminder["patient_id"], timeout)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Failed to send reminder for patient %s", reminder["patient_id"])
+                return False
+
+        sent = sum(await asyncio.gather(*(send_one(reminder) for reminder in due)))
+        self.sent += sent
+        return sent
+
+    def fire_due(self, now=None, limit=REMINDER_MAX_PER_TICK):
+        """
+        Send every reminder due by now through the sink.
+
+        Returns:
+            int: Reminders sent
+        """
+        return self.send(self.take_due(now, limit))
+
+    def metrics(self):
+        next_due = self.next_due_at()
+        return {
+            "active": self.active,
+            "sink": type(self.sink).__name__,
+            "patients": len(self._by_patient),
+            "medications": len(self._medications),
+            "heap_entries": len(self._heap),
+            "next_due_at": datetime.fromtimestamp(next_due).isoformat() if next_due else None,
+            "sent": self.sent,
+            "skipped_logged": self.skipped_logged,
+            "skipped_late": self.skipped_late,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "stale_popped": self.stale_popped
+        }
+
+
+reminder_scheduler = ReminderScheduler(create_sink() if REMINDERS_ENABLED else None)
@@ -1,4 +1,11 @@
 from typing import Dict, Any, Optional
+from fastapi.responses import JSONResponse
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
 
 def success_response(data: Optional[Dict[str, Any]] = None, message: str = "Success"):
     """
@@ -18,4 +25,37 @@ def error_response(message: str = "An error occurred", status_code: int = 400):
         "success": False,
         "message": message,
         "status_code": status_code
-    }
\ No newline at end of file
+    }
+
+def _json_default(value: Any) -> Any:
+    """
+    Fallback for values JSON has no type for: numpy scalars and arrays (from
+    the model features) become numbers and lists, anything else a string.
+    """
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+def dumps_json(content: Any) -> bytes:
+    """
+    Serialize response content to compact UTF-8 bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson when available.
+    
+    Returning it directly from an endpoint also skips FastAPI's jsonable_encoder
+    pass; numpy values are still serialized, other unknown types as strings.
+    """
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+def fast_success_response(data: Optional[Dict[str, Any]] = None, message: str = "Success"):
+    """
+    Standard success response format, serialized with FastJSONResponse.
+    """
+    return FastJSONResponse(success_response(data, message))
@@ -0,0 +1,200 @@
+import threading
+from datetime import date, datetime
+
+# Rolling windows (in days) reported alongside the all-time adherence
+WINDOWS = (7, 30, 90)
+HORIZON_DAYS = max(WINDOWS)
+
+
+def log_date_ordinal(log):
+    """
+    Get the day ordinal of a dose log from its date (or created_at) field.
+
+    Args:
+        log: Dose log record
+
+    Returns:
+        int: date.toordinal() of the log day, today if the log has no usable date
+    """
+    value = log.get("date") or log.get("created_at")
+    if value:
+        try:
+            return datetime.strptime(str(value)[:10], "%Y-%m-%d").date().toordinal()
+        except ValueError:
+            pass
+    return date.today().toordinal()
+
+
+class DailyRing:
+    """
+    Ring buffer of daily (taken, total) dose counts covering the last HORIZON_DAYS days.
+
+    Each slot remembers which day it holds, so a slot is reset lazily the first time
+    a newer day lands on it. Running (taken, total) sums of every window ending on
+    the latest day seen are kept up to date as doses are added, and days leaving a
+    window are subtracted as the day rolls over, so reading a window costs O(1).
+    """
+
+    __slots__ = ("days", "taken", "total", "anchor", "sums")
+
+    def __init__(self):
+        self.days = [-1] * HORIZON_DAYS
+        self.taken = [0] * HORIZON_DAYS
+        self.total = [0] * HORIZON_DAYS
+        # Last day of the running window sums, and {window: [taken, total]} ending on it
+        self.anchor = -1
+        self.sums = {window: [0, 0] for window in WINDOWS}
+
+    def advance(self, today):
+        """
+        Roll the window sums forward to end on `today`.
+        """
+        if today <= self.anchor:
+            return
+        if today - self.anchor >= HORIZON_DAYS:
+            # Every counted day left every window
+            for sums in self.sums.values():
+                sums[0] = sums[1] = 0
+        else:
+            for day in range(self.anchor + 1, today + 1):
+                for window, sums in self.sums.items():
+                    leaving = day - window
+                    slot = leaving % HORIZON_DAYS
+                    if self.days[slot] == leaving:
+                        sums[0] -= self.taken[slot]
+                        sums[1] -= self.total[slot]
+        self.anchor = today
+
+    def add(self, ordinal, taken, count=1):
+        self.advance(ordinal)
+        slot = ordinal % HORIZON_DAYS
+        if self.days[slot] != ordinal:
+            if self.days[slot] > ordinal:
+                # Slot already holds a newer day, so this one is past the horizon
+                return
+            self.days[slot] = ordinal
+            self.taken[slot] = 0
+            self.total[slot] = 0
+        self.total[slot] += count
+        if taken:
+            self.taken[slot] += count
+        for window, sums in self.sums.items():
+            if ordinal > self.anchor - window:
+                sums[1] += count
+                if taken:
+                    sums[0] += count
+
+    def counts(self, today, window):
+        """
+        Sum (taken, total) for the `window` days ending on `today` (inclusive).
+        """
+        self.advance(today)
+        if today == self.anchor:
+            return tuple(self.sums[window])
+        # A day before the latest logged one (e.g. doses dated ahead): add the slots up
+        start = today - window + 1
+        taken = total = 0
+        for slot, day in enumerate(self.days):
+            if start <= day <= today:
+                taken += self.taken[slot]
+                total += self.total[slot]
+        return taken, total
+
+
+def _window_percentages(rings, today):
+    result = {}
+    for window in WINDOWS:
+        taken = total = 0
+        for ring in rings:
+            ring_taken, ring_total = ring.counts(today, window)
+            taken += ring_taken
+            total += ring_total
+        result[f"{window}d"] = (taken / total) * 100 if total > 0 else None
+    return result
+
+
+class RollingAdherenceTracker:
+    """
+    In-memory rolling-window adherence per patient and medication.
+
+    Patients are seeded from their dose logs and then updated incrementally as
+    doses are logged. Doses logged through other server processes only show in
+    the store, so readers pass the patient row's stored version (see
+    utils.etag) to is_current() and reload the patient when it changed.
+    """
+
+    def __init__(self):
+        self._patients = {}
+        # patient_id -> stored patient version the buffers were loaded at
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def is_loaded(self, patient_id):
+        return patient_id in self._patients
+
+    def is_current(self, patient_id, version):
+        """
+        Whether the patient was loaded at this stored version, with no dose recorded since.
+        Without a version (no version column) patients are never current and are reloaded.
+        """
+        return version is not None and patient_id in self._patients and self._versions.get(patient_id) == version
+
+    def load(self, patient_id, dose_logs, version=None):
+        """
+        (Re)build the buffers of a patient from their dose logs, read at a stored patient version.
+        """
+        rings = {}
+        for log in dose_logs:
+            medication = log.get("medication") or ""
+            ring = rings.get(medication)
+            if ring is None:
+                ring = rings[medication] = DailyRing()
+            ring.add(log_date_ordinal(log), log.get("status") == "Taken", log.get("count", 1))
+        with self._lock:
+            self._patients[patient_id] = rings
+            self._versions[patient_id] = version
+
+    def ensure_loaded(self, patient_id, dose_logs):
+        if patient_id not in self._patients:
+            self.load(patient_id, dose_logs)
+
+    def record(self, patient_id, medication, status, log_date=None):
+        """
+        Add a single dose to the buffers of a patient.
+        """
+        with self._lock:
+            rings = self._patients.setdefault(patient_id, {})
+            ring = rings.get(medication)
+            if ring is None:
+                ring = rings[medication] = DailyRing()
+            ring.add(log_date_ordinal({"date": log_date}), status == "Taken")
+            # The dose bumped the stored version; a reader may even have loaded it already,
+            # so the next versioned read reloads instead of trusting this count
+            self._versions[patient_id] = None
+
+    def forget(self, patient_id):
+        with self._lock:
+            self._patients.pop(patient_id, None)
+            self._versions.pop(patient_id, None)
+
+    def windows(self, patient_id, today=None):
+        """
+        Get rolling adherence percentages for a patient across all medications.
+
+        Returns:
+            dict: {"7d": float|None, "30d": ..., "90d": ...}, None when a window has no logs
+        """
+        today = today or date.today().toordinal()
+        with self._lock:
+            return _window_percentages(self._patients.get(patient_id, {}).values(), today)
+
+    def windows_by_medication(self, patient_id, today=None):
+        today = today or date.today().toordinal()
+        with self._lock:
+            return {
+                medication: _window_percentages([ring], today)
+                for medication, ring in self._patients.get(patient_id, {}).items()
+            }
+
+
+rolling_adherence = RollingAdherenceTracker()
@@ -0,0 +1,107 @@
+import contextvars
+import os
+
+# Debug mode: report each request's upstream round trips in its response headers
+ROUND_TRIP_HEADERS = os.getenv("ROUND_TRIP_HEADERS", "false").lower() in ("1", "true", "yes")
+
+CALLS_HEADER = "X-Upstream-Calls"
+
+# Round trips of the request being handled
+request_round_trips = contextvars.ContextVar("request_round_trips", default=None)
+
+
+class RoundTrips:
+    """
+    Count and time of the upstream calls (Supabase, Gemini) made for one request.
+    """
+
+    def __init__(self):
+        self.services = {}
+
+    def record(self, service, seconds):
+        calls, total = self.services.get(service, (0, 0.0))
+        self.services[service] = (calls + 1, total + seconds)
+
+    def headers(self):
+        """
+        X-Upstream-Calls ("supabase=3, gemini=1") and Server-Timing headers, shown by browser dev tools.
+        """
+        return [
+            (CALLS_HEADER.lower().encode(), ", ".join(
+                f"{service}={calls}" for service, (calls, _) in sorted(self.services.items())
+            ).encode()),
+            (b"server-timing", ", ".join(
+                f'{service};dur={total * 1000:.1f};desc="{calls} calls"'
+                for service, (calls, total) in sorted(self.services.items())
+            ).encode())
+        ]
+
+
+def record_round_trip(service, seconds):
+    """
+    Count an upstream call against the request being handled, if any.
+    """
+    round_trips = request_round_trips.get()
+    if round_trips is not None:
+        round_trips.record(service, seconds)
+
+
+class RoundTripMiddleware:
+    """
+    ASGI middleware adding the upstream round trips made before the response
+    started to its headers. Only installed when ROUND_TRIP_HEADERS is set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        round_trips = RoundTrips()
+
+        async def send_with_round_trips(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), *round_trips.headers()]}
+            await send(message)
+
+        token = request_round_trips.set(round_trips)
+        try:
+            await self.app(scope, receive, send_with_round_trips)
+        finally:
+            request_round_trips.reset(token)
+
+
+def round_trips_of(response):
+    """
+    Upstream calls per service reported by a response's X-Upstream-Calls header.
+    """
+    header = response.headers.get(CALLS_HEADER)
+    if header is None:
+        raise AssertionError(f"No {CALLS_HEADER} header, is ROUND_TRIP_HEADERS enabled?")
+    calls = {}
+    for part in filter(None, (part.strip() for part in header.split(","))):
+        service, _, count = part.partition("=")
+        calls[service] = int(count)
+    return calls
+
+
+def assert_round_trip_budget(response, **budget):
+    """
+    Test helper: fail when a response made more upstream calls than budgeted.
+
+    Services not in the budget are allowed no calls, e.g.
+    assert_round_trip_budget(client.get("/api/summary/1"), supabase=2)
+    """
+    calls = round_trips_of(response)
+    over = {
+        service: (count, budget.get(service, 0))
+        for service, count in calls.items() if count > budget.get(service, 0)
+    }
+    if over:
+        raise AssertionError("Round trip budget exceeded: " + ", ".join(
+            f"{service} {count} calls (budget {allowed})" for service, (count, allowed) in sorted(over.items())
+        ))
+    return calls
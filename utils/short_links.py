@@ -0,0 +1,134 @@
+import os
+import secrets
+from datetime import datetime, timezone
+from utils.ttl_cache import TTLCache
+
+# Lowercase base32 without 0/1/i/l/o, so codes survive being read aloud or retyped
+CODE_ALPHABET = "23456789abcdefghjkmnpqrstuvwxyz"
+# 10 characters of a 31 symbol alphabet is ~49 bits, far too many to enumerate
+SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", "10"))
+SHORT_LINK_URL_TEMPLATE = os.getenv("SHORT_LINK_URL_TEMPLATE", "http://localhost:8000/p/{code}")
+PATIENT_DASHBOARD_URL_TEMPLATE = os.getenv("PATIENT_DASHBOARD_URL_TEMPLATE", "http://localhost:8081/patient/{patient_id}")
+SHORT_LINK_CACHE_SIZE = int(os.getenv("SHORT_LINK_CACHE_SIZE", "50000"))
+# Bounds how long a code revoked by another server process keeps resolving here
+SHORT_LINK_CACHE_TTL_SECONDS = float(os.getenv("SHORT_LINK_CACHE_TTL_SECONDS", "300"))
+SHORT_LINK_NEGATIVE_TTL_SECONDS = float(os.getenv("SHORT_LINK_NEGATIVE_TTL_SECONDS", "60"))
+
+LINKS_TABLE = "patient_links"
+
+# Reasons a code does not resolve
+UNKNOWN = "unknown"
+REVOKED = "revoked"
+
+
+def generate_code(length=SHORT_CODE_LENGTH):
+    return "".join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def is_valid_code(code):
+    return len(code) == SHORT_CODE_LENGTH and all(char in CODE_ALPHABET for char in code)
+
+
+def short_link_url(code):
+    return SHORT_LINK_URL_TEMPLATE.format(code=code)
+
+
+def dashboard_url(patient_id):
+    return PATIENT_DASHBOARD_URL_TEMPLATE.format(patient_id=patient_id)
+
+
+def create_short_link(supabase, patient_id, tag_id=None, attempts=3):
+    """
+    Issue a new code for a patient and store it in the patient_links table.
+
+    Returns:
+        dict: The stored link row
+    """
+    for attempt in range(attempts):
+        row = {"code": generate_code(), "patient_id": patient_id}
+        if tag_id:
+            row["tag_id"] = tag_id
+        try:
+            response = supabase.table(LINKS_TABLE).insert(row).execute()
+            return response.data[0] if response.data else row
+        except Exception as e:
+            # A code collision violates the primary key; anything else is a real error
+            if "23505" not in str(e) or attempt == attempts - 1:
+                raise
+
+
+def revoke_short_link(supabase, code):
+    """
+    Mark a code revoked. Returns the updated row, or None if the code does not exist.
+    """
+    response = supabase.table(LINKS_TABLE).update({
+        "revoked_at": datetime.now(timezone.utc).isoformat()
+    }).eq("code", code).execute()
+    return response.data[0] if response.data else None
+
+
+def load_short_link(supabase, code):
+    response = supabase.table(LINKS_TABLE).select("code, patient_id, revoked_at").eq("code", code).limit(1).execute()
+    return response.data[0] if response.data else None
+
+
+class ShortLinkResolver:
+    """
+    In-memory cache of code -> patient id in front of the patient_links table.
+
+    Misses (unknown and revoked codes) are cached too, briefly, so that a
+    revoked tag being tapped repeatedly does not reach the store each time.
+    """
+
+    def __init__(self, maxsize=SHORT_LINK_CACHE_SIZE, ttl_seconds=SHORT_LINK_CACHE_TTL_SECONDS,
+                 negative_ttl_seconds=SHORT_LINK_NEGATIVE_TTL_SECONDS):
+        self._links = TTLCache(maxsize, ttl_seconds)
+        self._misses = TTLCache(maxsize, negative_ttl_seconds)
+        self.hits = 0
+        self.loads = 0
+
+    def resolve(self, code, load):
+        """
+        Resolve a code, calling load(code) for the stored row on a cache miss.
+
+        Returns:
+            tuple: (patient_id, None) or (None, UNKNOWN / REVOKED)
+        """
+        patient_id = self._links.get(code)
+        if patient_id is not None:
+            self.hits += 1
+            return patient_id, None
+        reason = self._misses.get(code)
+        if reason is not None:
+            self.hits += 1
+            return None, reason
+
+        self.loads += 1
+        row = load(code)
+        if row is None:
+            self._misses.set(code, UNKNOWN)
+            return None, UNKNOWN
+        if row.get("revoked_at"):
+            self._misses.set(code, REVOKED)
+            return None, REVOKED
+        self._links.set(code, row["patient_id"])
+        return row["patient_id"], None
+
+    def remember(self, code, patient_id):
+        self._misses.pop(code)
+        self._links.set(code, patient_id)
+
+    def revoke(self, code):
+        self._links.pop(code)
+        self._misses.set(code, REVOKED)
+
+    def metrics(self):
+        return {
+            "cached_links": len(self._links),
+            "cached_misses": len(self._misses),
+            "hits": self.hits,
+            "loads": self.loads
+        }
+
+
+short_link_resolver = ShortLinkResolver()
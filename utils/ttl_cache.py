@@ -0,0 +1,52 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded key/value store whose entries expire after `ttl_seconds`.
+
+    When full, the least recently written entry is evicted first.
+    """
+
+    def __init__(self, maxsize, ttl_seconds):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._evict()
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def _evict(self):
+        now = time.monotonic()
+        # Entries are in write order with a fixed TTL, so expired ones are at the front
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.maxsize:
+                break
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
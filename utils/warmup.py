@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+
+# Pause between attempts of a required warm-up step that failed
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+
+class WarmUp:
+    """
+    Startup warm-up of a worker, and its readiness.
+
+    Warm-up runs as chains of steps: steps of a chain run in order (each in a
+    worker thread), chains run concurrently. Required steps are retried until
+    they succeed; optional ones are attempted once and their failure is only
+    reported. The worker is ready once every chain has finished and every
+    required step succeeded.
+    """
+
+    def __init__(self, retry_seconds=WARMUP_RETRY_SECONDS):
+        self.retry_seconds = retry_seconds
+        self.steps = {}
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    @property
+    def ready(self):
+        return self.done and all(step["status"] == "ok" for step in self.steps.values() if step["required"])
+
+    async def _run_chain(self, chain):
+        for name, function, required in chain:
+            step = self.steps[name]
+            started = time.perf_counter()
+            while True:
+                step["status"] = "running"
+                step["attempts"] += 1
+                try:
+                    await asyncio.to_thread(function)
+                    step["status"], step["error"] = "ok", None
+                    break
+                except Exception as e:
+                    step["status"], step["error"] = "failed", str(e)
+                    if not required:
+                        break
+                    print(f"Warm-up step {name} failed, retrying in {self.retry_seconds}s: {e}")
+                    await asyncio.sleep(self.retry_seconds)
+            step["ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def run(self, *chains):
+        """
+        Args:
+            chains: Lists of (name, function, required) steps
+        """
+        self.started_at = time.time()
+        for chain in chains:
+            for name, _, required in chain:
+                self.steps[name] = {"status": "pending", "required": required, "attempts": 0, "ms": None, "error": None}
+        await asyncio.gather(*(self._run_chain(chain) for chain in chains))
+        self.finished_at = time.time()
+        failed = [name for name, step in self.steps.items() if step["status"] != "ok"]
+        print(f"Warm-up finished in {self.finished_at - self.started_at:.1f}s"
+              + (f", optional steps failed: {', '.join(failed)}" if failed else ""))
+
+    def report(self):
+        end = self.finished_at or time.time()
+        return {
+            "ready": self.ready,
+            "warming_up": self.started_at is not None and not self.done,
+            "seconds": round(end - self.started_at, 2) if self.started_at else None,
+            "steps": self.steps
+        }
+
+
+warmup = WarmUp()